@@ -0,0 +1,33 @@
+"""add topology_snapshot to ai_analysis_history
+
+Revision ID: 0001_topology_snapshot
+Revises: 
+Create Date: 2026-10-17 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0001_topology_snapshot'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def _has_column(table: str, column: str) -> bool:
+    # ฐานข้อมูลที่สร้างด้วย create_all หลังเพิ่มคอลัมน์นี้จะมีคอลัมน์อยู่แล้ว
+    inspector = sa.inspect(op.get_bind())
+    return column in {c["name"] for c in inspector.get_columns(table)}
+
+
+def upgrade() -> None:
+    if not _has_column("ai_analysis_history", "topology_snapshot"):
+        op.add_column("ai_analysis_history", sa.Column("topology_snapshot", sa.JSON(), nullable=True))
+
+
+def downgrade() -> None:
+    if _has_column("ai_analysis_history", "topology_snapshot"):
+        with op.batch_alter_table("ai_analysis_history") as batch_op:
+            batch_op.drop_column("topology_snapshot")
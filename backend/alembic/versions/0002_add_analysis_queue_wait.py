@@ -0,0 +1,33 @@
+"""add queue_wait_seconds to ai_analysis_history
+
+Revision ID: 0002_queue_wait
+Revises: 0001_topology_snapshot
+Create Date: 2026-10-17 11:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0002_queue_wait'
+down_revision = '0001_topology_snapshot'
+branch_labels = None
+depends_on = None
+
+
+def _has_column(table: str, column: str) -> bool:
+    # ฐานข้อมูลที่สร้างด้วย create_all หลังเพิ่มคอลัมน์นี้จะมีคอลัมน์อยู่แล้ว
+    inspector = sa.inspect(op.get_bind())
+    return column in {c["name"] for c in inspector.get_columns(table)}
+
+
+def upgrade() -> None:
+    if not _has_column("ai_analysis_history", "queue_wait_seconds"):
+        op.add_column("ai_analysis_history", sa.Column("queue_wait_seconds", sa.Float(), nullable=True))
+
+
+def downgrade() -> None:
+    if _has_column("ai_analysis_history", "queue_wait_seconds"):
+        with op.batch_alter_table("ai_analysis_history") as batch_op:
+            batch_op.drop_column("queue_wait_seconds")
@@ -0,0 +1,47 @@
+"""add Ollama token usage and timing to ai_analysis_history
+
+Revision ID: 0003_ollama_usage
+Revises: 0002_queue_wait
+Create Date: 2026-10-17 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0003_ollama_usage'
+down_revision = '0002_queue_wait'
+branch_labels = None
+depends_on = None
+
+COLUMNS = [
+    ("prompt_tokens", sa.Integer),
+    ("completion_tokens", sa.Integer),
+    ("load_duration_ms", sa.Integer),
+    ("prompt_eval_duration_ms", sa.Integer),
+    ("eval_duration_ms", sa.Integer),
+    ("time_to_first_token_ms", sa.Integer),
+    ("tokens_per_second", sa.Float),
+]
+
+
+def _columns(table: str) -> set:
+    # ฐานข้อมูลที่สร้างด้วย create_all หลังเพิ่มคอลัมน์เหล่านี้จะมีคอลัมน์อยู่แล้ว
+    inspector = sa.inspect(op.get_bind())
+    return {c["name"] for c in inspector.get_columns(table)}
+
+
+def upgrade() -> None:
+    existing = _columns("ai_analysis_history")
+    for name, column_type in COLUMNS:
+        if name not in existing:
+            op.add_column("ai_analysis_history", sa.Column(name, column_type(), nullable=True))
+
+
+def downgrade() -> None:
+    existing = _columns("ai_analysis_history")
+    with op.batch_alter_table("ai_analysis_history") as batch_op:
+        for name, _ in reversed(COLUMNS):
+            if name in existing:
+                batch_op.drop_column(name)
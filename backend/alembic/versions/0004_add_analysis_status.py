@@ -0,0 +1,37 @@
+"""add status to ai_analysis_history
+
+Revision ID: 0004_analysis_status
+Revises: 0003_ollama_usage
+Create Date: 2026-10-17 13:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0004_analysis_status'
+down_revision = '0003_ollama_usage'
+branch_labels = None
+depends_on = None
+
+
+def _has_column(table: str, column: str) -> bool:
+    # ฐานข้อมูลที่สร้างด้วย create_all หลังเพิ่มคอลัมน์นี้จะมีคอลัมน์อยู่แล้ว
+    inspector = sa.inspect(op.get_bind())
+    return column in {c["name"] for c in inspector.get_columns(table)}
+
+
+def upgrade() -> None:
+    # แถวเดิมทั้งหมดถูกบันทึกหลังวิเคราะห์เสร็จแล้ว
+    if not _has_column("ai_analysis_history", "status"):
+        op.add_column(
+            "ai_analysis_history",
+            sa.Column("status", sa.String(20), nullable=False, server_default="completed")
+        )
+
+
+def downgrade() -> None:
+    if _has_column("ai_analysis_history", "status"):
+        with op.batch_alter_table("ai_analysis_history") as batch_op:
+            batch_op.drop_column("status")
@@ -0,0 +1,54 @@
+"""add ai_analysis_batches and ai_analysis_jobs.batch_id
+
+Revision ID: 0005_analysis_batches
+Revises: 0004_analysis_status
+Create Date: 2026-10-17 14:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0005_analysis_batches'
+down_revision = '0004_analysis_status'
+branch_labels = None
+depends_on = None
+
+
+def _has_table(table: str) -> bool:
+    return sa.inspect(op.get_bind()).has_table(table)
+
+
+def _has_column(table: str, column: str) -> bool:
+    # ฐานข้อมูลที่สร้างด้วย create_all หลังเพิ่มตาราง/คอลัมน์นี้จะมีอยู่แล้ว
+    inspector = sa.inspect(op.get_bind())
+    return column in {c["name"] for c in inspector.get_columns(table)}
+
+
+def upgrade() -> None:
+    if not _has_table("ai_analysis_batches"):
+        op.create_table(
+            "ai_analysis_batches",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id"), nullable=True),
+            sa.Column("total_jobs", sa.Integer(), nullable=False, server_default="0"),
+            sa.Column("created_at", sa.DateTime(timezone=True), nullable=True),
+        )
+        op.create_index("ix_ai_analysis_batches_id", "ai_analysis_batches", ["id"])
+    if _has_table("ai_analysis_jobs") and not _has_column("ai_analysis_jobs", "batch_id"):
+        with op.batch_alter_table("ai_analysis_jobs") as batch_op:
+            batch_op.add_column(sa.Column("batch_id", sa.Integer(), nullable=True))
+            batch_op.create_foreign_key(
+                "fk_ai_analysis_jobs_batch_id", "ai_analysis_batches", ["batch_id"], ["id"], ondelete="CASCADE"
+            )
+            batch_op.create_index("ix_ai_analysis_jobs_batch_id", ["batch_id"])
+
+
+def downgrade() -> None:
+    if _has_table("ai_analysis_jobs") and _has_column("ai_analysis_jobs", "batch_id"):
+        with op.batch_alter_table("ai_analysis_jobs") as batch_op:
+            batch_op.drop_index("ix_ai_analysis_jobs_batch_id")
+            batch_op.drop_column("batch_id")
+    if _has_table("ai_analysis_batches"):
+        op.drop_table("ai_analysis_batches")
@@ -0,0 +1,40 @@
+"""add composite indexes for analysis history listing
+
+Revision ID: 0006_history_indexes
+Revises: 0005_analysis_batches
+Create Date: 2026-10-17 16:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0006_history_indexes'
+down_revision = '0005_analysis_batches'
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    ("ix_ai_analysis_history_user_created", "ai_analysis_history", ["user_id", "created_at"]),
+    ("ix_ai_analysis_history_user_project_created", "ai_analysis_history", ["user_id", "project_id", "created_at"]),
+    ("ix_ai_analysis_history_project_id", "ai_analysis_history", ["project_id"]),
+]
+
+
+def _has_index(table: str, name: str) -> bool:
+    # ฐานข้อมูลที่สร้างด้วย create_all หลังเพิ่ม index เหล่านี้จะมีอยู่แล้ว
+    inspector = sa.inspect(op.get_bind())
+    return name in {index["name"] for index in inspector.get_indexes(table)}
+
+
+def upgrade() -> None:
+    for name, table, columns in INDEXES:
+        if not _has_index(table, name):
+            op.create_index(name, table, columns)
+
+
+def downgrade() -> None:
+    for name, table, _ in reversed(INDEXES):
+        if _has_index(table, name):
+            op.drop_index(name, table_name=table)
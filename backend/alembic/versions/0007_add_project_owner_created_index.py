@@ -0,0 +1,31 @@
+"""add projects (owner_id, created_at) index for cursor pagination
+
+Revision ID: 0007_project_owner_created
+Revises: 0006_history_indexes
+Create Date: 2026-10-17 18:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0007_project_owner_created'
+down_revision = '0006_history_indexes'
+branch_labels = None
+depends_on = None
+
+
+def _has_index(table: str, name: str) -> bool:
+    inspector = sa.inspect(op.get_bind())
+    return name in {index["name"] for index in inspector.get_indexes(table)}
+
+
+def upgrade() -> None:
+    if not _has_index("projects", "ix_projects_owner_created"):
+        op.create_index("ix_projects_owner_created", "projects", ["owner_id", "created_at"])
+
+
+def downgrade() -> None:
+    if _has_index("projects", "ix_projects_owner_created"):
+        op.drop_index("ix_projects_owner_created", table_name="projects")
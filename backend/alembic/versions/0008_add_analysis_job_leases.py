@@ -0,0 +1,46 @@
+"""add ai_analysis_jobs lease_owner / lease_expires_at
+
+Revision ID: 0008_analysis_job_leases
+Revises: 0007_project_owner_created
+Create Date: 2026-10-17 20:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0008_analysis_job_leases'
+down_revision = '0007_project_owner_created'
+branch_labels = None
+depends_on = None
+
+
+def _has_table(table: str) -> bool:
+    return sa.inspect(op.get_bind()).has_table(table)
+
+
+def _has_column(table: str, column: str) -> bool:
+    # ฐานข้อมูลที่สร้างด้วย create_all หลังเพิ่มคอลัมน์นี้จะมีอยู่แล้ว
+    inspector = sa.inspect(op.get_bind())
+    return column in {c["name"] for c in inspector.get_columns(table)}
+
+
+def upgrade() -> None:
+    # งานเดิมไม่มี lease: process ใดก็รับต่อได้ (ตาราง jobs สร้างด้วย create_all ตอน startup ถ้ายังไม่มี)
+    if not _has_table("ai_analysis_jobs"):
+        return
+    if not _has_column("ai_analysis_jobs", "lease_owner"):
+        op.add_column("ai_analysis_jobs", sa.Column("lease_owner", sa.String(64), nullable=True))
+    if not _has_column("ai_analysis_jobs", "lease_expires_at"):
+        op.add_column("ai_analysis_jobs", sa.Column("lease_expires_at", sa.DateTime(timezone=True), nullable=True))
+
+
+def downgrade() -> None:
+    if not _has_table("ai_analysis_jobs"):
+        return
+    with op.batch_alter_table("ai_analysis_jobs") as batch_op:
+        if _has_column("ai_analysis_jobs", "lease_expires_at"):
+            batch_op.drop_column("lease_expires_at")
+        if _has_column("ai_analysis_jobs", "lease_owner"):
+            batch_op.drop_column("lease_owner")
@@ -0,0 +1,43 @@
+"""add ai_analysis_history.updated_at for stale running-row detection
+
+Revision ID: 0009_history_updated_at
+Revises: 0008_analysis_job_leases
+Create Date: 2026-10-17 21:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0009_history_updated_at'
+down_revision = '0008_analysis_job_leases'
+branch_labels = None
+depends_on = None
+
+
+def _has_column(table: str, column: str) -> bool:
+    # ฐานข้อมูลที่สร้างด้วย create_all หลังเพิ่มคอลัมน์นี้จะมีอยู่แล้ว
+    inspector = sa.inspect(op.get_bind())
+    return column in {c["name"] for c in inspector.get_columns(table)}
+
+
+def _has_index(table: str, name: str) -> bool:
+    inspector = sa.inspect(op.get_bind())
+    return name in {index["name"] for index in inspector.get_indexes(table)}
+
+
+def upgrade() -> None:
+    # แถวเดิม updated_at ว่าง: ถ้ายังเป็น running ถือว่าค้างจาก process ก่อน
+    if not _has_column("ai_analysis_history", "updated_at"):
+        op.add_column("ai_analysis_history", sa.Column("updated_at", sa.DateTime(timezone=True), nullable=True))
+    if not _has_index("ai_analysis_history", "ix_ai_analysis_history_status_updated"):
+        op.create_index("ix_ai_analysis_history_status_updated", "ai_analysis_history", ["status", "updated_at"])
+
+
+def downgrade() -> None:
+    if _has_index("ai_analysis_history", "ix_ai_analysis_history_status_updated"):
+        op.drop_index("ix_ai_analysis_history_status_updated", table_name="ai_analysis_history")
+    if _has_column("ai_analysis_history", "updated_at"):
+        with op.batch_alter_table("ai_analysis_history") as batch_op:
+            batch_op.drop_column("updated_at")
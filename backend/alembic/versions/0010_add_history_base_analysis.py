@@ -0,0 +1,48 @@
+"""add ai_analysis_history.base_analysis_id (incremental results are not a baseline)
+
+Revision ID: 0010_history_base_analysis
+Revises: 0009_history_updated_at
+Create Date: 2026-10-17 22:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0010_history_base_analysis'
+down_revision = '0009_history_updated_at'
+branch_labels = None
+depends_on = None
+
+# หัวข้อแรกของรายงานจาก INCREMENTAL_PROMPT (รายงานเต็มขึ้นต้นด้วยหัวข้อ "การจัดวางอุปกรณ์...")
+INCREMENTAL_HEADING = "## 1. สรุปการเปลี่ยนแปลง"
+
+
+def _has_column(table: str, column: str) -> bool:
+    # ฐานข้อมูลที่สร้างด้วย create_all หลังเพิ่มคอลัมน์นี้จะมีอยู่แล้ว
+    inspector = sa.inspect(op.get_bind())
+    return column in {c["name"] for c in inspector.get_columns(table)}
+
+
+def upgrade() -> None:
+    if not _has_column("ai_analysis_history", "base_analysis_id"):
+        with op.batch_alter_table("ai_analysis_history") as batch_op:
+            batch_op.add_column(sa.Column("base_analysis_id", sa.Integer(), nullable=True))
+            batch_op.create_foreign_key(
+                "fk_ai_analysis_history_base_analysis_id", "ai_analysis_history",
+                ["base_analysis_id"], ["id"], ondelete="SET NULL"
+            )
+    # ผล incremental ที่บันทึกก่อนหน้านี้ไม่รู้ฐาน: เอา snapshot ออกเพื่อไม่ให้ใช้เป็นฐานของครั้งถัดไป
+    op.execute(
+        sa.text(
+            "UPDATE ai_analysis_history SET topology_snapshot = NULL "
+            "WHERE topology_snapshot IS NOT NULL AND analysis_result LIKE :pattern"
+        ).bindparams(pattern=f"%{INCREMENTAL_HEADING}%")
+    )
+
+
+def downgrade() -> None:
+    if _has_column("ai_analysis_history", "base_analysis_id"):
+        with op.batch_alter_table("ai_analysis_history") as batch_op:
+            batch_op.drop_column("base_analysis_id")
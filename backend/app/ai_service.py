@@ -1,140 +1,606 @@
+import re
 import json
 import asyncio
 import aiohttp
 from aiohttp import ClientTimeout
 import time
-from typing import Dict, List, Any, Optional, Union, Literal
-from .config import settings
+from contextlib import nullcontext
+from typing import Dict, List, Any, AsyncIterator, Optional, Set, Tuple, Union, Literal
+from .config import OllamaBackendConfig, settings
+from .analysis_cache import AnalysisCache, cache_key
+from .db_executor import run_in_db_thread
+from .singleflight import SingleFlight
+from .analysis_scheduler import AnalysisTicket
+from .analysis_progress import AnalysisProgress
+from .ollama_metrics import GenerationUsage, analysis_duration_seconds, observe_completion, parse_usage
+from .http_client import http_client, request_timeout
+from .ollama_pool import NoBackendAvailable, OllamaBackend, OllamaBackendPool
+from .token_estimator import ContextSizingStats, choose_num_ctx, estimate_messages_tokens
+from .topology_encoding import compact_topology_summary
+from .graph_analysis import analyze_topology, format_facts, partition_topology
+from .incremental_analysis import diff_topology, previous_analysis_context, should_use_incremental
 import logging
 
 logger = logging.getLogger(__name__)
 
+OLLAMA_UNAVAILABLE_MESSAGE = "ไม่สามารถเชื่อมต่อกับ Ollama ได้ กรุณาตรวจสอบว่า Ollama ทำงานอยู่ที่ http://10.80.49.111:11434"
+NO_NETWORK_DATA_MESSAGE = "ไม่พบข้อมูลเครือข่าย กรุณาสร้าง อุปกรณ์ และการเชื่อมต่อ"
+
+# เปลี่ยนค่านี้ทุกครั้งที่แก้ prompt หรือรูปแบบ context (ทำให้ cache เดิมใช้ไม่ได้)
+# ค่า config อย่าง ANALYSIS_MODE และ TOPOLOGY_ENCODING อยู่ใน cache key แล้ว (_analysis_variant) ไม่ต้องเปลี่ยนค่านี้
+PROMPT_VERSION = "5"
+
+# System prompt สำหรับ network topology analysis
+SYSTEM_PROMPT = """คุณเป็นผู้เชี่ยวชาญด้านเครือข่ายคอมพิวเตอร์ ให้คำแนะนำเกี่ยวกับการออกแบบและวิเคราะห์แผนผังเครือข่าย 
+                ให้คำตอบเป็นภาษาไทยที่เข้าใจง่าย และให้คำแนะนำที่เป็นประโยชน์"""
+
+# Prompt หลักสำหรับการวิเคราะห์ (ใช้ร่วมกันทั้งแบบปกติและแบบ streaming)
+ANALYSIS_PROMPT = """วิเคราะห์แผนผังเครือข่ายนี้อย่างครอบคลุม โดยจำกัดการวิเคราะห์เฉพาะในมิติ 
+        **การออกแบบและโครงสร้างทางกายภาพ (Physical/Topology)** เท่านั้น ไม่ต้องวิเคราะห์ในเชิง **Logical Layer, Protocol, หรือการตั้งค่า IP**  
+
+## 1. การจัดวางอุปกรณ์ตามหลักการ Layer ของเครือข่าย
+
+### 1.1 วิเคราะห์การจัดวาง Layer ปัจจุบัน
+- ระบุว่าอุปกรณ์แต่ละตัวอยู่ใน Layer ใด (Internet Edge, Core, Distribution, Access)
+- ตรวจสอบว่าการจัดวางปัจจุบันเป็นไปตามหลักการออกแบบเครือข่ายหรือไม่
+- ระบุอุปกรณ์ที่วางผิด Layer (ถ้ามี)
+
+### 1.2 คำแนะนำการจัดวางที่เหมาะสม
+- **Internet Edge Layer**: แนะนำอุปกรณ์ที่ควรอยู่ชั้นนี้ (ISP, Edge Router, Firewall)
+- **Core Layer**: แนะนำอุปกรณ์ที่ควรเป็นแกนกลาง (Core Switch, Core Router)
+- **Distribution Layer**: แนะนำอุปกรณ์กระจายสัญญาณ (Distribution Switch, L3 Switch)
+- **Access Layer**: แนะนำอุปกรณ์ที่เชื่อมต่อกับ End Device (Access Switch, Wireless AP)
+- ให้เหตุผลว่าทำไมควรจัดวางแบบนั้น
+
+### 1.3 การปรับปรุงตำแหน่งอุปกรณ์
+- เสนอการย้ายอุปกรณ์ที่อยู่ผิดตำแหน่ง
+- แนะนำการเพิ่มอุปกรณ์ในแต่ละ Layer (ถ้าขาด)
+
+## 2. การวิเคราะห์โครงสร้างและจุดบกพร่อง
+
+### 2.1 ตรวจสอบการเชื่อมต่อผิดลำดับ
+- **ระบุการเชื่อมต่อที่ผิดหลักการ**: เช่น PC เชื่อมตรงกับ Core Switch, Server เชื่อมกับ Access Switch
+- **ตรวจสอบ Hierarchy**: เช็คว่ามีการข้าม Layer หรือเชื่อมต่อย้อนกลับ (Backward Connection)
+- **Flat Network Problem**: ระบุถ้าเครือข่ายแบนเกินไป (ไม่มีการแบ่ง Layer)
+
+### 2.2 ระบุจุดคอขวด (Bottleneck)
+- **Traffic Concentration**: ระบุจุดที่ Traffic มารวมกันมากเกินไป
+- **Bandwidth Mismatch**: ชี้ให้เห็นจุดที่ bandwidth ไม่สมดุลกัน
+- **Overloaded Device**: ระบุอุปกรณ์ที่อาจรับภาระมากเกินไป
+- **ISP Connection**: ประเมินว่า bandwidth จาก ISP เพียงพอหรือเป็นจุดคอขวด
+
+### 2.3 การไหลของข้อมูล (Data Flow)
+- ติดตามเส้นทางข้อมูลจาก End Device → Access → Distribution → Core → ISP
+- ระบุเส้นทางที่ไม่มีประสิทธิภาพหรือเส้นทางอ้อม
+- ประเมินความซับซ้อนของการเชื่อมต่อ
+
+### 2.4 จุดเสี่ยงอื่นๆ
+- **Single Point of Failure (SPOF)**: ระบุจุดที่ถ้าขาดแล้วเครือข่ายล่ม
+- **Lack of Redundancy**: ชี้ให้เห็นจุดที่ขาด Backup Path
+- **Security Gap**: ระบุจุดที่อาจเกิดช่องโหว่ด้านความปลอดภัย
+
+## 3. การตรวจสอบความเพียงพอของ Bandwidth และ Throughput
+
+### 3.1 การวิเคราะห์ ISP Bandwidth (ถ้ามี ISP)
+- **บังคับวิเคราะห์**: ต้องระบุค่า Bandwidth จาก ISP
+- คำนวณว่า Bandwidth จาก ISP เพียงพอต่อผู้ใช้ทั้งหมดหรือไม่
+- เปรียบเทียบ ISP Bandwidth กับความต้องการรวมของ End User
+
+### 3.2 การวิเคราะห์ Throughput ของอุปกรณ์
+- **บังคับวิเคราะห์**: ต้องระบุค่า Max Throughput ของทุกอุปกรณ์ที่มีข้อมูล
+- ตรวจสอบว่า Throughput ของ Edge Device รองรับ ISP Bandwidth เต็มที่หรือไม่
+- ประเมิน Throughput ของ Core/Distribution Switch ว่าเพียงพอหรือไม่
+- ระบุอุปกรณ์ที่ Throughput ไม่เพียงพอต่อ Traffic ที่ต้องรับ
+
+### 3.3 การวิเคราะห์ Bandwidth ของสายเชื่อมต่อ
+- **บังคับวิเคราะห์**: ต้องระบุค่า Bandwidth ของทุกเส้นทางที่มีข้อมูล
+- ตรวจสอบความสมดุลของ Bandwidth ในแต่ละ Layer
+- ระบุเส้นทางที่ Bandwidth ต่ำเกินไป (Underprovisioned)
+- ระบุเส้นทางที่ Bandwidth สูงเกินไป (Overprovisioned)
+
+### 3.4 การประเมินความเพียงพอตามจำนวนผู้ใช้
+- **บังคับวิเคราะห์**: ต้องระบุจำนวน User Capacity ของทุก PC ที่มีข้อมูล
+- คำนวณ Bandwidth ต่อ User (เฉลี่ย)
+- ประเมินว่า Bandwidth ต่อคนเพียงพอต่อการใช้งานทั่วไปหรือไม่
+- แนะนำค่า Bandwidth ที่เหมาะสมตามจำนวนผู้ใช้
+
+### 3.5 สรุปปัญหา Bandwidth/Throughput
+- สรุปจุดที่ Bandwidth/Throughput ไม่เพียงพอ
+- ให้คำแนะนำการแก้ไข (อัพเกรด, เพิ่มสาย, เปลี่ยนอุปกรณ์)
+
+## 4. คำแนะนำการปรับปรุงแผนผัง
+
+### 4.1 การเพิ่ม Firewall และอุปกรณ์รักษาความปลอดภัย
+- **ถ้ายังไม่มี Firewall**: แนะนำให้เพิ่มและระบุตำแหน่งที่เหมาะสม (หลัง ISP หรือหน้า Core)
+- **ถ้ามี Firewall แล้ว**: ประเมินว่าอยู่ในตำแหน่งที่ถูกต้องหรือไม่
+- แนะนำการเพิ่มอุปกรณ์เสริม (IDS/IPS, UTM, WAF) พร้อมตำแหน่งที่เหมาะสม
+- เสนอการสร้าง DMZ สำหรับ Server ที่ต้องเปิดให้ภายนอกเข้าถึง
+
+### 4.2 การปรับโครงสร้างให้เหมาะสมยิ่งขึ้น
+- **Layer Adjustment**: แนะนำการปรับโครงสร้าง Layer ให้ชัดเจนขึ้น
+- **Connection Restructure**: แนะนำการเปลี่ยนเส้นทางการเชื่อมต่อให้ถูกต้อง
+- **Device Upgrade**: แนะนำอุปกรณ์ที่ควรอัพเกรด
+- **Device Addition**: แนะนำอุปกรณ์ที่ควรเพิ่มเติม
+
+### 4.3 การเพิ่ม Redundancy และ High Availability
+- แนะนำการเพิ่ม Redundant Path สำหรับ Critical Link
+- เสนอ Dual ISP หรือ Backup Internet Connection
+- แนะนำการใช้ Link Aggregation หรือ Port Channeling
+- เสนอ Backup Device สำหรับอุปกรณ์สำคัญ
+
+### 4.4 การขยายเครือข่ายในอนาคต
+- แนะนำวิธีการขยายเครือข่ายเมื่อมี User เพิ่มขึ้น
+- เสนอการเตรียม Scalability
+- แนะนำการอัพเกรดที่ควรทำในระยะยาว
+
+### 4.5 สรุปลำดับความสำคัญของการปรับปรุง
+- จัดลำดับความสำคัญ (Critical → High → Medium → Low)
+- ให้เหตุผลว่าทำไมถึงจัดลำดับแบบนั้น
+
+## 5. ภาพรวมและสรุป
+
+### 5.1 สรุปจุดแข็ง
+- ระบุสิ่งที่ออกแบบดีแล้ว
+- ชมเชยจุดที่ถูกต้องตามหลักการ
+
+### 5.2 สรุปจุดอ่อน
+- สรุปปัญหาหลักที่พบทั้งหมด
+- ย้ำจุดที่ต้องแก้ไขเร่งด่วน
+
+### 5.3 คะแนนความเหมาะสม
+- ให้คะแนนความเหมาะสมของแผนผัง (1-10 คะแนน)
+- อธิบายเกณฑ์การให้คะแนน
+
+### 5.4 แผนการปรับปรุงโดยสรุป
+- สรุปการปรับปรุงที่ต้องทำ (3-5 ข้อหลัก)
+- จัดลำดับตามความสำคัญและความเร่งด่วน
+
+**หมายเหตุสำคัญ:**
+- ห้ามวิเคราะห์ในเชิง Logical (IP Address, Routing, VLAN, Protocol, Subnet)
+- เน้นที่โครงสร้างทางกายภาพ (Physical Topology) และการไหลของข้อมูลเท่านั้น
+- ต้องวิเคราะห์ข้อมูลทุกค่าที่มีอยู่ (Bandwidth, Throughput, User Capacity) ห้ามข้าม"""
+
+
+def _split_report_prompt(prompt: str) -> Tuple[str, List[str], str]:
+    """แยก prompt ของรายงานเป็น (คำนำ, หัวข้อ "## N." ตามลำดับ, หมายเหตุท้าย prompt)"""
+    body, notes = prompt.split("\n**หมายเหตุสำคัญ:**", 1)
+    intro, *sections = re.split(r"\n(?=## \d+\. )", body)
+    return intro.strip(), [section.strip() for section in sections], "**หมายเหตุสำคัญ:**" + notes
+
+
+_REPORT_INTRO, ANALYSIS_SECTIONS, _REPORT_NOTES = _split_report_prompt(ANALYSIS_PROMPT)
+
+# Prompt ของการวิเคราะห์แบบแยกหัวข้อ: ทุกหัวข้อใช้ system prompt และข้อมูล topology เดียวกันทุก byte
+# (Ollama ใช้ KV cache ของ prefix ร่วมกันได้) ส่วนหัวข้อที่ต้องเขียนต่อท้าย user message
+SECTION_PROMPT = f"""{_REPORT_INTRO}
+
+รายงานฉบับเต็มมี {len(ANALYSIS_SECTIONS)} หัวข้อ แต่ละหัวข้อถูกเขียนแยกกันจากข้อมูลชุดเดียวกันแล้วนำมาต่อกันตามลำดับ
+ให้เขียนเฉพาะหัวข้อที่ระบุท้ายข้อมูล โดยขึ้นต้นด้วยชื่อหัวข้อเดิม ไม่ต้องเขียนบทนำหรือหัวข้ออื่น
+
+{_REPORT_NOTES}"""
+
+SECTION_INSTRUCTION = "หัวข้อที่ต้องเขียน:\n\n{section}"
+
+# Prompt สำหรับขั้น map: วิเคราะห์เฉพาะส่วนหนึ่งของแผนผังขนาดใหญ่ (ทุกส่วนใช้ system prompt เดียวกัน)
+REGION_PROMPT = """ข้อมูลที่ให้เป็นเพียงส่วนหนึ่งของแผนผังเครือข่ายขนาดใหญ่ วิเคราะห์เฉพาะส่วนนี้
+ในมิติการออกแบบและโครงสร้างทางกายภาพ (Physical/Topology) เท่านั้น แล้วสรุปเป็นข้อสั้นๆ ตามหัวข้อต่อไปนี้:
+- บทบาทของส่วนนี้และ Layer ของอุปกรณ์หลัก (Core, Distribution, Access)
+- การเชื่อมต่อผิดลำดับหรือข้าม Layer
+- จุดคอขวด, Single Point of Failure และจุดที่ขาด Redundancy
+- ความเพียงพอของ Bandwidth/Throughput เทียบกับจำนวนผู้ใช้ (ระบุตัวเลขที่มี)
+- คำแนะนำการปรับปรุงที่สำคัญที่สุด
+
+ตอบไม่เกิน 300 คำ อ้างชื่ออุปกรณ์ตามข้อมูลจริง ไม่ต้องเขียนบทนำหรือสรุปทั่วไป"""
+
+# Prompt สำหรับขั้น reduce: รวมผลรายส่วนเป็นรายงาน 5 หัวข้อเดียวกับการวิเคราะห์ปกติ
+REDUCE_PROMPT = f"""แผนผังเครือข่ายนี้มีขนาดใหญ่ จึงถูกแบ่งเป็นหลายส่วนและวิเคราะห์แยกกันไว้แล้ว
+ใช้ภาพรวม ข้อเท็จจริงที่คำนวณจากกราฟ และผลวิเคราะห์รายส่วนที่ให้ไว้ รวมเป็นรายงานฉบับเดียวของทั้งเครือข่าย
+ห้ามเขียนแยกตามส่วน ให้สังเคราะห์ปัญหาที่ซ้ำกันและจัดลำดับความสำคัญในภาพรวม
+
+{ANALYSIS_PROMPT}"""
+
+# Prompt สำหรับวิเคราะห์ซ้ำแบบ incremental: ส่งเฉพาะส่วนที่เปลี่ยนและสรุปรายงานเดิม
+INCREMENTAL_PROMPT = """ผู้ใช้แก้ไขแผนผังเครือข่ายหลังจากการวิเคราะห์ครั้งก่อน ข้อมูลที่ให้คือสรุปรายงานเดิม
+รายการการเปลี่ยนแปลง และข้อเท็จจริงที่คำนวณจากแผนผังปัจจุบัน ให้เขียนรายงานฉบับปรับปรุงแบบกระชับ
+ในมิติการออกแบบและโครงสร้างทางกายภาพ (Physical/Topology) เท่านั้น:
+
+## 1. สรุปการเปลี่ยนแปลง
+- อธิบายสิ่งที่เปลี่ยนไปและผลกระทบโดยตรง (Bandwidth, Throughput, จุดคอขวด, SPOF, Redundancy)
+
+## 2. ผลกระทบต่อข้อสรุปเดิม
+- ระบุว่าปัญหาหรือคำแนะนำใดในรายงานเดิมได้รับการแก้ไขแล้ว ยังคงอยู่ หรือเกิดปัญหาใหม่
+
+## 5. ภาพรวมและสรุป
+- สรุปจุดแข็งและจุดอ่อนของแผนผังปัจจุบัน
+- คะแนนความเหมาะสมใหม่ (1-10 คะแนน) เทียบกับคะแนนเดิม
+- แผนการปรับปรุงที่เหลือ (3-5 ข้อหลัก) เรียงตามความสำคัญ
+
+ไม่ต้องวิเคราะห์ส่วนที่ไม่ได้รับผลกระทบซ้ำ"""
+
+class OllamaResponseError(Exception):
+    """Ollama ตอบกลับไม่สำเร็จ (message เป็นข้อความภาษาไทยสำหรับแสดงผู้ใช้)
+
+    retryable = ลองซ้ำได้ (timeout, 5xx, เชื่อมต่อไม่ได้) โดยจะย้ายไป backend อื่นก่อนถ้ามี
+    """
+
+    def __init__(self, message: str, retryable: bool = False):
+        super().__init__(message)
+        self.message = message
+        self.retryable = retryable
+
 class OllamaService:
     def __init__(self):
-        self.base_url = settings.OLLAMA_BASE_URL
         # Fixed model - cannot be changed
         self.model = settings.OLLAMA_MODEL
-        # ตั้งเวลา timeout เป็นวินาที (3600 วินาที = 1 ชั่วโมง)
-        timeout_seconds = getattr(settings, "OLLAMA_TIMEOUT", 3600)
-        self.timeout = ClientTimeout(total=timeout_seconds)
-        # Reusable aiohttp session
-        self._session: Optional[aiohttp.ClientSession] = None
+        # timeout แยก connect / first byte / total (ดู http_client.request_timeout)
+        self.timeout = request_timeout()
+        self.stream_timeout = request_timeout(stream=True)
+        # "native" = /api/chat ของ Ollama (รองรับ keep_alive), "openai" = /v1/chat/completions
+        self.native_api = settings.OLLAMA_API_MODE == "native"
+        # health check ใช้ timeout สั้นแยกต่างหาก เพื่อไม่ให้ host ที่ล่มทำให้ request ค้าง
+        self.health_timeout = ClientTimeout(total=settings.OLLAMA_HEALTH_CHECK_TIMEOUT)
+        self.context_sizing = ContextSizingStats()
+        # Ollama host ทั้งหมด (แต่ละตัวมี circuit breaker และ health monitor ของตัวเอง)
+        backends = settings.OLLAMA_BACKENDS or [OllamaBackendConfig(url=settings.OLLAMA_BASE_URL)]
+        self.pool = OllamaBackendPool([
+            OllamaBackend(
+                backend.url,
+                weight=backend.weight,
+                max_concurrency=backend.max_concurrency or settings.OLLAMA_BACKEND_MAX_CONCURRENCY,
+                probe=self._probe_backend
+            )
+            for backend in backends
+        ])
+        self.base_url = self.pool.primary.url
     
     async def _get_session(self) -> aiohttp.ClientSession:
-        """Get or create aiohttp session"""
-        if self._session is None or self._session.closed:
-            self._session = aiohttp.ClientSession()
-        return self._session
+        """aiohttp session ที่ใช้ร่วมกัน (connection pool เปิด/ปิดใน lifespan ของแอป)"""
+        return await http_client.get_session()
     
     async def check_ollama_health(self) -> bool:
-        """ตรวจสอบว่า Ollama ทำงานอยู่หรือไม่"""
+        """ตรวจสอบว่า Ollama ทำงานอยู่หรือไม่ (อย่างน้อยหนึ่ง backend)"""
+        return await self.pool.check_now()
+
+    async def _probe_backend(self, backend: OllamaBackend) -> bool:
         try:
             session = await self._get_session()
             # ใช้ v1 API format สำหรับ health check
-            async with session.get(f"{self.base_url}/v1/models", timeout=self.timeout) as response:
+            async with session.get(f"{backend.url}/v1/models", timeout=self.health_timeout) as response:
                 return response.status == 200
         except Exception as e:
-            logger.error(f"การตรวจสอบสถานะของ Ollama ไม่สำเร็จ หรือ Ollama ไม่ตอบสนอง: {e}")
+            logger.error(f"การตรวจสอบสถานะของ Ollama ({backend.url}) ไม่สำเร็จ หรือ Ollama ไม่ตอบสนอง: {e}")
             return False
-    
-    
 
+    async def _acquire_backend(self, exclude: Set[OllamaBackend]) -> OllamaBackend:
+        """จอง backend ที่ว่างที่สุด ล้มเหลวทันทีถ้า circuit breaker ของทุก backend เปิดอยู่ (Ollama ล่ม)"""
+        try:
+            return await self.pool.acquire(exclude)
+        except NoBackendAvailable:
+            raise OllamaResponseError(OLLAMA_UNAVAILABLE_MESSAGE)
     
-    async def generate_response(self, prompt: str, context: Optional[Dict] = None, max_retries: int = 3) -> str:
-        """สร้างคำตอบจาก Ollama (มี retry logic)"""
+    def _build_messages(self, prompt: str, context: Optional[Dict] = None) -> Optional[List[Dict[str, str]]]:
+        """ประกอบ chat messages (คืน None ถ้า context ไม่มี nodes/edges)
+
+        ส่วนที่คงที่ (system prompt + คำสั่งวิเคราะห์) อยู่ใน system message ที่เหมือนกันทุก byte
+        ทุก request ส่วน topology ที่เปลี่ยนไปอยู่ใน user message ต่อท้าย
+        ทำให้ Ollama ใช้ KV cache ของ prefix เดิมซ้ำได้
+        """
+        messages = [
+            {
+                "role": "system",
+                "content": f"{SYSTEM_PROMPT}\n\nคำถาม: {prompt}"
+            }
+        ]
+
+        if context:
+            # เช็กว่ามี nodes และ edges จริงหรือไม่
+            if not context.get("nodes") or not context.get("edges"):
+                return None
+            # แผนผังขนาดใหญ่ใช้การสรุปแบบกระชับ (รวมอุปกรณ์ปลายทางที่เหมือนกัน) เพื่อลดจำนวน token
+            # "summary" = ข้อความ topology ที่เตรียมไว้แล้ว (ใช้ในขั้น reduce ของการวิเคราะห์แบบแบ่งส่วน)
+            context_summary = context.get("summary") or self._create_context(context, format_type=self._summary_format(context))
+
+            # Debug log เพื่อดูว่า context มีข้อมูล bandwidth/throughput/user capacity หรือไม่
+            logger.info(f"[AI CONTEXT SUMMARY] {context_summary}")
+
+            user_content = f"ข้อมูลแผนผังเครือข่าย: {context_summary}"
+            if context.get("facts"):
+                # ข้อเท็จจริงเชิงกราฟที่คำนวณไว้แล้ว (SPOF, bridge, hop, bandwidth ต่อผู้ใช้)
+                user_content += f"\n\n{format_facts(context['facts'])}"
+            if context.get("instruction"):
+                # คำสั่งเฉพาะ request (เช่นหัวข้อของการวิเคราะห์แบบแยกหัวข้อ) อยู่ท้ายสุด หลัง prefix ที่ใช้ร่วมกัน
+                user_content += f"\n\n{context['instruction']}"
+            messages.append({"role": "user", "content": user_content})
+        else:
+            messages.append({"role": "user", "content": "กรุณาตอบคำถามข้างต้น"})
+
+        return messages
+
+    def _build_payload(
+        self, messages: List[Dict[str, str]], stream: bool = False, num_predict: Optional[int] = None
+    ) -> Dict[str, Any]:
+        """สร้าง payload สำหรับ Ollama (v1 chat completions หรือ native /api/chat)"""
+        # เลือก context window ตามขนาด prompt จริง แทนการจอง 131072 ทุกครั้ง
+        # (KV cache เล็กลง = ประมวลผล prompt เร็วขึ้น และ Ollama รับงานพร้อมกันได้มากขึ้น)
+        num_predict = num_predict or settings.OLLAMA_NUM_PREDICT
+        prompt_tokens = estimate_messages_tokens(messages)
+        num_ctx = choose_num_ctx(
+            prompt_tokens,
+            num_predict,
+            settings.OLLAMA_NUM_CTX_LADDER,
+            headroom_tokens=settings.OLLAMA_NUM_CTX_HEADROOM
+        )
+        self.context_sizing.record(prompt_tokens, num_ctx)
+        logger.info(f"Estimated prompt tokens: {prompt_tokens}, num_ctx: {num_ctx}")
+
+        options = {
+            "temperature": 0.7,
+            "top_p": 0.9,
+            "num_ctx": num_ctx,
+            "num_predict": num_predict
+        }
+        if self.native_api:
+            # native API รองรับ keep_alive: ให้ model และ KV cache ของ prefix ค้างอยู่ในหน่วยความจำ
+            return {
+                "model": self.model,
+                "messages": messages,
+                "stream": stream,
+                "keep_alive": settings.OLLAMA_KEEP_ALIVE,
+                "options": options
+            }
+        payload = {
+            "model": self.model,
+            "messages": messages,
+            "stream": stream,
+            "options": {**options, "max_tokens": num_predict}
+        }
+        if stream:
+            # ให้ chunk สุดท้ายมี usage (จำนวน token) เหมือน response แบบ non-streaming
+            payload["stream_options"] = {"include_usage": True}
+        return payload
+
+    def chat_url(self, backend: OllamaBackend) -> str:
+        if self.native_api:
+            return f"{backend.url}/api/chat"
+        return f"{backend.url}/v1/chat/completions"
+
+    def _parse_completion(self, result: Dict[str, Any]) -> Optional[str]:
+        """ดึงข้อความคำตอบจาก response แบบ non-streaming"""
+        if self.native_api:
+            return (result.get("message") or {}).get("content") or None
+        # ปรับปรุงการ parse response ให้ robust กว่านี้
+        choices = result.get("choices", [])
+        if choices and len(choices) > 0:
+            return (choices[0].get("message") or {}).get("content") or None
+        return None
+
+    def _parse_stream_line(self, line: str) -> Tuple[Optional[str], bool, Optional[Dict[str, Optional[int]]]]:
+        """แปลงหนึ่งบรรทัดของ stream เป็น (ข้อความ, จบแล้วหรือไม่, usage ถ้าบรรทัดนี้มี)"""
+        if self.native_api:
+            # native API: NDJSON หนึ่ง object ต่อบรรทัด ปิดท้ายด้วย "done": true (พร้อม token และเวลา)
+            chunk = json.loads(line)
+            done = bool(chunk.get("done"))
+            return (chunk.get("message") or {}).get("content"), done, parse_usage(chunk) if done else None
+        # OpenAI-compatible SSE: แต่ละบรรทัดเป็น "data: {...}" และจบด้วย "data: [DONE]"
+        if not line.startswith("data:"):
+            return None, False, None
+        data = line[len("data:"):].strip()
+        if data == "[DONE]":
+            return None, True, None
+        chunk = json.loads(data)
+        usage = parse_usage(chunk) if chunk.get("usage") else None
+        choices = chunk.get("choices", [])
+        if choices:
+            return (choices[0].get("delta") or {}).get("content"), False, usage
+        return None, False, usage
+
+    async def request_completion(
+        self, prompt: str, context: Optional[Dict] = None, max_retries: int = 3, num_predict: Optional[int] = None,
+        usage: Optional[GenerationUsage] = None
+    ) -> str:
+        """เรียก Ollama (มี retry logic) และ raise OllamaResponseError เมื่อไม่สำเร็จ
+
+        token และเวลาของ request ที่สำเร็จถูกบันทึกเป็น metrics และสะสมลง usage (ถ้าส่งมา)
+        """
+        messages = self._build_messages(prompt, context)
+        if messages is None:
+            raise OllamaResponseError(NO_NETWORK_DATA_MESSAGE)
+
+        payload = self._build_payload(messages, num_predict=num_predict)
+
+        # failover ต่อ request: ถ้า backend หนึ่งล้มเหลว ลองซ้ำกับ backend อื่นก่อนกลับมาใช้ตัวเดิม
+        tried: Set[OllamaBackend] = set()
         for attempt in range(max_retries):
+            backend = await self._acquire_backend(tried)
+            started_at = time.monotonic()
             try:
-                # สร้าง system prompt สำหรับ network topology analysis
-                system_prompt = """คุณเป็นผู้เชี่ยวชาญด้านเครือข่ายคอมพิวเตอร์ ให้คำแนะนำเกี่ยวกับการออกแบบและวิเคราะห์แผนผังเครือข่าย 
-                ให้คำตอบเป็นภาษาไทยที่เข้าใจง่าย และให้คำแนะนำที่เป็นประโยชน์"""
+                result, completion_usage = await self._post_completion(backend, payload)
+            except OllamaResponseError as e:
+                self.pool.release(backend, False, started_at, e.message)
+                if not e.retryable or attempt == max_retries - 1:
+                    raise
+                tried.add(backend)
+                if len(tried) >= len(self.pool.backends):
+                    # ลองครบทุก backend แล้ว รอสักครู่ก่อน retry รอบใหม่
+                    tried.clear()
+                    await asyncio.sleep(1 * (attempt + 1))
+                logger.warning(f"Retrying Ollama request after failure on {backend.url} (attempt {attempt + 1})")
+                continue
+            except BaseException:
+                self.pool.release(backend, None, started_at)
+                raise
+            self.pool.release(backend, True, started_at)
+            observe_completion(self.model, completion_usage, time.monotonic() - started_at, recorder=usage)
+            return result
 
-                # สร้าง full prompt
-                full_prompt = f"{system_prompt}\n\nคำถาม: {prompt}"
-                
-                if context:
-                    # เช็กว่ามี nodes และ edges จริงหรือไม่
-                    if not context.get("nodes") or not context.get("edges"):
-                        return "ไม่พบข้อมูลเครือข่าย กรุณาสร้าง อุปกรณ์ และการเชื่อมต่อ"
-                    # ปรับปรุง: สร้าง context ที่ส่งข้อมูลครบทั้งหมด ไม่จำกัด
-                    context_summary = self._create_context(context, format_type="summary")
-                    
-                    # Debug log เพื่อดูว่า context มีข้อมูล bandwidth/throughput/user capacity หรือไม่
-                    logger.info(f"[AI CONTEXT SUMMARY] {context_summary}")
-                    
-                    full_prompt += f"\n\nข้อมูลแผนผังเครือข่าย: {context_summary}"
-
-                # ใช้ Ollama v1 chat completions API format
-                # เพิ่ม context window และ tokens เพื่อรองรับข้อมูลเยอะขึ้น
-                payload = {
-                    "model": self.model,
-                    "messages": [
-                        {
-                            "role": "user",
-                            "content": full_prompt
-                        }
-                    ],
-                    "stream": False,
-                    "options": {
-                        "temperature": 0.7,
-                        "top_p": 0.9,
-                        "max_tokens": 12000,      # เพิ่มจาก 4000 เป็น 12000
-                        "num_ctx": 131072,        # เพิ่มจาก 8192 เป็น 131072 (รองรับข้อมูลเยอะ)
-                        "num_predict": 12000     # เพิ่มจาก 4000 เป็น 12000
-                    }
-                }
+        raise OllamaResponseError("ไม่สามารถสร้างคำตอบได้หลังจากลองหลายครั้ง")
 
-                session = await self._get_session()
-                async with session.post(
-                    f"{self.base_url}/v1/chat/completions",
-                    json=payload,
-                    timeout=self.timeout
-                ) as response:
-                    if response.status == 200:
-                        result = await response.json()
-                        # ปรับปรุงการ parse response ให้ robust กว่านี้
-                        choices = result.get("choices", [])
-                        if choices and len(choices) > 0:
-                            message = choices[0].get("message", {})
-                            if "content" in message:
-                                return message.get("content", "ไม่สามารถสร้างคำตอบได้")
-                        return "ไม่สามารถสร้างคำตอบได้"
-                    else:
-                        error_text = await response.text()
-                        logger.error(f"Ollama API error (attempt {attempt + 1}): {response.status} - {error_text}")
-                        
-                        # ถ้าเป็น error ที่ไม่ควร retry (เช่น 400, 401, 403)
-                        if response.status in [400, 401, 403, 404]:
-                            return f"เกิดข้อผิดพลาดในการเชื่อมต่อกับ AI (Status: {response.status})"
-                        
-                        # ถ้าเป็น attempt สุดท้าย ให้ return error
-                        if attempt == max_retries - 1:
-                            return f"เกิดข้อผิดพลาดในการเชื่อมต่อกับ AI (Status: {response.status})"
-
-            except asyncio.TimeoutError:
-                logger.error(f"Ollama request timeout (attempt {attempt + 1})")
-                if attempt == max_retries - 1:
-                    return "การเชื่อมต่อกับ AI ใช้เวลานานเกินไป กรุณาลองใหม่อีกครั้ง"
-                # รอสักครู่ก่อน retry
-                await asyncio.sleep(1 * (attempt + 1))
-                
-            except Exception as e:
-                logger.error(f"Error generating response (attempt {attempt + 1}): {e}")
-                if attempt == max_retries - 1:
-                    return f"เกิดข้อผิดพลาดในการเชื่อมต่อกับ AI: {str(e)}"
-                # รอสักครู่ก่อน retry
-                await asyncio.sleep(1 * (attempt + 1))
-        
-        return "ไม่สามารถสร้างคำตอบได้หลังจากลองหลายครั้ง"
+    async def _post_completion(
+        self, backend: OllamaBackend, payload: Dict[str, Any]
+    ) -> Tuple[str, Dict[str, Optional[int]]]:
+        try:
+            session = await self._get_session()
+            async with session.post(
+                self.chat_url(backend),
+                json=payload,
+                timeout=self.timeout
+            ) as response:
+                if response.status == 200:
+                    result = await response.json()
+                    content = self._parse_completion(result)
+                    if content:
+                        return content, parse_usage(result)
+                    raise OllamaResponseError("ไม่สามารถสร้างคำตอบได้")
+
+                error_text = await response.text()
+                logger.error(f"Ollama API error ({backend.url}): {response.status} - {error_text}")
+                # error ที่ไม่ควร retry (เช่น 400, 401, 403)
+                raise OllamaResponseError(
+                    f"เกิดข้อผิดพลาดในการเชื่อมต่อกับ AI (Status: {response.status})",
+                    retryable=response.status not in [400, 401, 403, 404]
+                )
+
+        except OllamaResponseError:
+            raise
+
+        except asyncio.TimeoutError:
+            logger.error(f"Ollama request timeout ({backend.url})")
+            raise OllamaResponseError("การเชื่อมต่อกับ AI ใช้เวลานานเกินไป กรุณาลองใหม่อีกครั้ง", retryable=True)
+
+        except Exception as e:
+            logger.error(f"Error generating response ({backend.url}): {e}")
+            raise OllamaResponseError(f"เกิดข้อผิดพลาดในการเชื่อมต่อกับ AI: {str(e)}", retryable=True)
+
+    async def generate_response(self, prompt: str, context: Optional[Dict] = None, max_retries: int = 3) -> str:
+        """สร้างคำตอบจาก Ollama (ข้อผิดพลาดจะถูกคืนเป็นข้อความ)"""
+        try:
+            return await self.request_completion(prompt, context, max_retries)
+        except OllamaResponseError as e:
+            return e.message
+
+    async def stream_completion(
+        self, prompt: str, context: Optional[Dict] = None, num_predict: Optional[int] = None,
+        usage: Optional[GenerationUsage] = None
+    ) -> AsyncIterator[str]:
+        """เรียก Ollama แบบ streaming และ raise OllamaResponseError เมื่อไม่สำเร็จ
+
+        ย้ายไป backend อื่นได้เฉพาะก่อนได้รับ token แรก (หลังจากนั้น token บางส่วนอาจถึง client แล้ว)
+        """
+        messages = self._build_messages(prompt, context)
+        if messages is None:
+            raise OllamaResponseError(NO_NETWORK_DATA_MESSAGE)
+
+        payload = self._build_payload(messages, stream=True, num_predict=num_predict)
+        tried: Set[OllamaBackend] = set()
+        while True:
+            backend = await self._acquire_backend(tried)
+            started_at = time.monotonic()
+            first_token_at: Optional[float] = None
+            stream_info: Dict[str, Any] = {}
+            received = False
+            try:
+                async for content in self._post_stream(backend, payload, stream_info):
+                    if first_token_at is None:
+                        first_token_at = time.monotonic()
+                    received = True
+                    yield content
+            except OllamaResponseError as e:
+                self.pool.release(backend, False, started_at, e.message)
+                tried.add(backend)
+                if received or not e.retryable or len(tried) >= len(self.pool.backends):
+                    raise
+                logger.warning(f"Retrying Ollama stream on another backend after failure on {backend.url}")
+                continue
+            except BaseException:
+                self.pool.release(backend, None, started_at)
+                raise
+            self.pool.release(backend, True, started_at)
+            observe_completion(
+                self.model,
+                stream_info.get("usage") or {},
+                time.monotonic() - started_at,
+                time_to_first_token=first_token_at - started_at if first_token_at is not None else None,
+                recorder=usage
+            )
+            return
+
+    async def _post_stream(
+        self, backend: OllamaBackend, payload: Dict[str, Any], stream_info: Dict[str, Any]
+    ) -> AsyncIterator[str]:
+        """yield ข้อความทีละส่วน และเก็บ usage จาก chunk สุดท้ายไว้ใน stream_info["usage"]"""
+        try:
+            session = await self._get_session()
+            async with session.post(
+                self.chat_url(backend),
+                json=payload,
+                timeout=self.stream_timeout
+            ) as response:
+                if response.status != 200:
+                    error_text = await response.text()
+                    logger.error(f"Ollama streaming API error ({backend.url}): {response.status} - {error_text}")
+                    raise OllamaResponseError(
+                        f"เกิดข้อผิดพลาดในการเชื่อมต่อกับ AI (Status: {response.status})",
+                        retryable=response.status not in [400, 401, 403, 404]
+                    )
+
+                async for raw_line in response.content:
+                    line = raw_line.decode("utf-8").strip()
+                    if not line:
+                        continue
+                    try:
+                        content, done, chunk_usage = self._parse_stream_line(line)
+                    except json.JSONDecodeError:
+                        logger.warning(f"Skipping malformed stream chunk: {line[:200]}")
+                        continue
+                    if chunk_usage is not None:
+                        stream_info["usage"] = chunk_usage
+                    if content:
+                        yield content
+                    if done:
+                        break
+
+        except OllamaResponseError:
+            raise
+        except asyncio.TimeoutError:
+            logger.error(f"Ollama streaming request timeout ({backend.url})")
+            raise OllamaResponseError("การเชื่อมต่อกับ AI ใช้เวลานานเกินไป กรุณาลองใหม่อีกครั้ง", retryable=True)
+        except Exception as e:
+            logger.error(f"Error streaming response ({backend.url}): {e}")
+            raise OllamaResponseError(f"เกิดข้อผิดพลาดในการเชื่อมต่อกับ AI: {str(e)}", retryable=True)
+
+    async def stream_response(self, prompt: str, context: Optional[Dict] = None) -> AsyncIterator[str]:
+        """สร้างคำตอบจาก Ollama แบบ streaming (ข้อผิดพลาดจะถูกส่งออกเป็นข้อความ)"""
+        try:
+            async for chunk in self.stream_completion(prompt, context):
+                yield chunk
+        except OllamaResponseError as e:
+            yield e.message
     
+    def _summary_format(self, context: Dict) -> Literal["summary", "compact"]:
+        """เลือกรูปแบบสรุป topology ตาม TOPOLOGY_ENCODING"""
+        mode = settings.TOPOLOGY_ENCODING
+        if mode == "auto":
+            return "compact" if len(context.get("nodes", [])) >= settings.COMPACT_ENCODING_MIN_NODES else "summary"
+        return "compact" if mode == "compact" else "summary"
+
     def _create_context(
         self, 
         context_or_nodes: Union[Dict, List[Dict]], 
         edges: Optional[List[Dict]] = None, 
-        format_type: Literal["summary", "detailed"] = "summary"
+        format_type: Literal["summary", "compact", "detailed"] = "summary"
     ) -> Union[str, Dict[str, Any]]:
        
         try:
-            if format_type == "summary":
+            if format_type == "compact":
+                # ใช้กับ context dict เหมือน summary แต่รวมกลุ่มอุปกรณ์ที่ซ้ำกันภายใต้งบ token
+                context = context_or_nodes
+                return compact_topology_summary(
+                    context.get("nodes", []),
+                    context.get("edges", []),
+                    token_budget=settings.CONTEXT_TOKEN_BUDGET
+                )
+
+            elif format_type == "summary":
                 # ใช้กับ context dict (สำหรับ generate_response)
                 context = context_or_nodes
                 analysis = context.get("analysis", {})
@@ -281,7 +747,7 @@ class OllamaService:
             
         except Exception as e:
             logger.error(f"Error creating context: {e}")
-            if format_type == "summary":
+            if format_type in ("summary", "compact"):
                 # Fallback: ส่งข้อมูลแบบเต็ม
                 return json.dumps({
                     "device_count": len(context_or_nodes.get("nodes", [])),
@@ -302,141 +768,307 @@ class OllamaService:
 class NetworkTopologyAnalyzer:
     def __init__(self):
         self.ollama_service = OllamaService()
-    
-    async def get_ai_analysis(self, nodes: List[Dict], edges: List[Dict]) -> str:
-        """รับการวิเคราะห์จาก AI (ไม่รับ prompt จาก user)"""
-        if not await self.ollama_service.check_ollama_health():
-            return "ไม่สามารถเชื่อมต่อกับ Ollama ได้ กรุณาตรวจสอบว่า Ollama ทำงานอยู่ที่ http://10.80.49.111:11434"
+        self.cache = AnalysisCache()
+        self.inflight = SingleFlight()
 
-        # สร้าง context ที่มี key 'nodes' และ 'edges' ตรงกับที่ generate_response ต้องการ
-        context = {"nodes": nodes, "edges": edges}
-        prompt = """วิเคราะห์แผนผังเครือข่ายนี้อย่างครอบคลุม โดยจำกัดการวิเคราะห์เฉพาะในมิติ 
-        **การออกแบบและโครงสร้างทางกายภาพ (Physical/Topology)** เท่านั้น ไม่ต้องวิเคราะห์ในเชิง **Logical Layer, Protocol, หรือการตั้งค่า IP**  
+    @staticmethod
+    def _analysis_variant() -> str:
+        """ค่า config ที่เปลี่ยนวิธีสร้างรายงาน (เปลี่ยนแล้วจะไม่ใช้ผลใน cache ที่สร้างด้วยค่าเดิม)"""
+        return "|".join(str(value) for value in (
+            settings.ANALYSIS_MODE,
+            settings.HIERARCHICAL_MIN_NODES,
+            settings.REGION_MAX_NODES,
+            settings.TOPOLOGY_ENCODING,
+            settings.COMPACT_ENCODING_MIN_NODES,
+            settings.CONTEXT_TOKEN_BUDGET,
+        ))
 
-## 1. การจัดวางอุปกรณ์ตามหลักการ Layer ของเครือข่าย
+    def _cache_key(self, nodes: List[Dict], edges: List[Dict]) -> str:
+        return cache_key(nodes, edges, self.ollama_service.model, PROMPT_VERSION, self._analysis_variant())
 
-### 1.1 วิเคราะห์การจัดวาง Layer ปัจจุบัน
-- ระบุว่าอุปกรณ์แต่ละตัวอยู่ใน Layer ใด (Internet Edge, Core, Distribution, Access)
-- ตรวจสอบว่าการจัดวางปัจจุบันเป็นไปตามหลักการออกแบบเครือข่ายหรือไม่
-- ระบุอุปกรณ์ที่วางผิด Layer (ถ้ามี)
+    @staticmethod
+    def use_hierarchical(nodes: List[Dict]) -> bool:
+        """เลือกการวิเคราะห์แบบแบ่งส่วน (map-reduce) ตาม ANALYSIS_MODE"""
+        mode = settings.ANALYSIS_MODE
+        if mode == "auto":
+            return len(nodes) >= settings.HIERARCHICAL_MIN_NODES
+        return mode == "hierarchical"
 
-### 1.2 คำแนะนำการจัดวางที่เหมาะสม
-- **Internet Edge Layer**: แนะนำอุปกรณ์ที่ควรอยู่ชั้นนี้ (ISP, Edge Router, Firewall)
-- **Core Layer**: แนะนำอุปกรณ์ที่ควรเป็นแกนกลาง (Core Switch, Core Router)
-- **Distribution Layer**: แนะนำอุปกรณ์กระจายสัญญาณ (Distribution Switch, L3 Switch)
-- **Access Layer**: แนะนำอุปกรณ์ที่เชื่อมต่อกับ End Device (Access Switch, Wireless AP)
-- ให้เหตุผลว่าทำไมควรจัดวางแบบนั้น
+    @staticmethod
+    def use_sections() -> bool:
+        """เขียนแต่ละหัวข้อของรายงานพร้อมกัน (ANALYSIS_MODE=sectioned)"""
+        return settings.ANALYSIS_MODE == "sectioned"
 
-### 1.3 การปรับปรุงตำแหน่งอุปกรณ์
-- เสนอการย้ายอุปกรณ์ที่อยู่ผิดตำแหน่ง
-- แนะนำการเพิ่มอุปกรณ์ในแต่ละ Layer (ถ้าขาด)
+    async def _run_sections(
+        self, nodes: List[Dict], edges: List[Dict], facts: Dict[str, Any], usage: Optional[GenerationUsage] = None
+    ) -> Optional[str]:
+        """เขียนทุกหัวข้อของรายงานพร้อมกัน (จำกัดด้วย SECTION_PARALLELISM) แล้วต่อกันตามลำดับหัวข้อ
 
-## 2. การวิเคราะห์โครงสร้างและจุดบกพร่อง
+        เวลารวมใกล้เคียงหัวข้อที่ยาวที่สุดแทนผลรวมของทุกหัวข้อ เมื่อ Ollama มี parallel slots พอ
+        คืน None ถ้าหัวข้อใดล้มเหลวหรือเกิน SECTION_TIMEOUT_SECONDS (ผู้เรียกจะใช้ prompt เดียวแทน)
+        """
+        semaphore = asyncio.Semaphore(max(1, settings.SECTION_PARALLELISM))
 
-### 2.1 ตรวจสอบการเชื่อมต่อผิดลำดับ
-- **ระบุการเชื่อมต่อที่ผิดหลักการ**: เช่น PC เชื่อมตรงกับ Core Switch, Server เชื่อมกับ Access Switch
-- **ตรวจสอบ Hierarchy**: เช็คว่ามีการข้าม Layer หรือเชื่อมต่อย้อนกลับ (Backward Connection)
-- **Flat Network Problem**: ระบุถ้าเครือข่ายแบนเกินไป (ไม่มีการแบ่ง Layer)
+        async def write_section(section: str) -> str:
+            context = {
+                "nodes": nodes,
+                "edges": edges,
+                "facts": facts,
+                "instruction": SECTION_INSTRUCTION.format(section=section)
+            }
+            async with semaphore:
+                return await asyncio.wait_for(
+                    self.ollama_service.request_completion(
+                        SECTION_PROMPT, context, num_predict=settings.SECTION_NUM_PREDICT, usage=usage
+                    ),
+                    settings.SECTION_TIMEOUT_SECONDS
+                )
 
-### 2.2 ระบุจุดคอขวด (Bottleneck)
-- **Traffic Concentration**: ระบุจุดที่ Traffic มารวมกันมากเกินไป
-- **Bandwidth Mismatch**: ชี้ให้เห็นจุดที่ bandwidth ไม่สมดุลกัน
-- **Overloaded Device**: ระบุอุปกรณ์ที่อาจรับภาระมากเกินไป
-- **ISP Connection**: ประเมินว่า bandwidth จาก ISP เพียงพอหรือเป็นจุดคอขวด
+        tasks = [asyncio.ensure_future(write_section(section)) for section in ANALYSIS_SECTIONS]
+        try:
+            results = await asyncio.gather(*tasks)
+        except (OllamaResponseError, asyncio.TimeoutError) as e:
+            reason = e.message if isinstance(e, OllamaResponseError) else "timeout"
+            logger.warning(f"Sectioned analysis failed ({reason}), falling back to a single prompt")
+            return None
+        finally:
+            # หัวข้อที่ยังทำงานอยู่ไม่มีประโยชน์แล้วเมื่อหัวข้อหนึ่งล้มเหลว
+            for task in tasks:
+                task.cancel()
+        return "\n\n".join(result.strip() for result in results)
 
-### 2.3 การไหลของข้อมูล (Data Flow)
-- ติดตามเส้นทางข้อมูลจาก End Device → Access → Distribution → Core → ISP
-- ระบุเส้นทางที่ไม่มีประสิทธิภาพหรือเส้นทางอ้อม
-- ประเมินความซับซ้อนของการเชื่อมต่อ
+    async def _map_regions(
+        self, nodes: List[Dict], edges: List[Dict], facts: Dict[str, Any], usage: Optional[GenerationUsage] = None
+    ) -> Dict[str, Any]:
+        """ขั้น map: วิเคราะห์แต่ละส่วนพร้อมกัน (จำกัดด้วย REGION_PARALLELISM) แล้วคืน context สำหรับขั้น reduce
 
-### 2.4 จุดเสี่ยงอื่นๆ
-- **Single Point of Failure (SPOF)**: ระบุจุดที่ถ้าขาดแล้วเครือข่ายล่ม
-- **Lack of Redundancy**: ชี้ให้เห็นจุดที่ขาด Backup Path
-- **Security Gap**: ระบุจุดที่อาจเกิดช่องโหว่ด้านความปลอดภัย
+        ส่วนที่วิเคราะห์ไม่สำเร็จจะถูกระบุไว้ในรายงาน ถ้าล้มเหลวทุกส่วนจะ raise OllamaResponseError
+        """
+        regions = partition_topology(nodes, edges, settings.REGION_MAX_NODES)
+        semaphore = asyncio.Semaphore(max(1, settings.REGION_PARALLELISM))
+        logger.info(f"Hierarchical analysis: {len(nodes)} devices in {len(regions)} regions")
 
-## 3. การตรวจสอบความเพียงพอของ Bandwidth และ Throughput
+        async def analyze_region(region: Dict[str, Any]) -> Union[str, OllamaResponseError]:
+            async with semaphore:
+                try:
+                    return await self.ollama_service.request_completion(
+                        REGION_PROMPT,
+                        {"nodes": region["nodes"], "edges": region["edges"]},
+                        num_predict=settings.REGION_NUM_PREDICT,
+                        usage=usage
+                    )
+                except OllamaResponseError as e:
+                    logger.warning(f"Region analysis failed ({region['name']}): {e.message}")
+                    return e
 
-### 3.1 การวิเคราะห์ ISP Bandwidth (ถ้ามี ISP)
-- **บังคับวิเคราะห์**: ต้องระบุค่า Bandwidth จาก ISP
-- คำนวณว่า Bandwidth จาก ISP เพียงพอต่อผู้ใช้ทั้งหมดหรือไม่
-- เปรียบเทียบ ISP Bandwidth กับความต้องการรวมของ End User
+        results = await asyncio.gather(*(analyze_region(region) for region in regions))
+        failures = [result for result in results if isinstance(result, OllamaResponseError)]
+        if len(failures) == len(results):
+            raise failures[0]
 
-### 3.2 การวิเคราะห์ Throughput ของอุปกรณ์
-- **บังคับวิเคราะห์**: ต้องระบุค่า Max Throughput ของทุกอุปกรณ์ที่มีข้อมูล
-- ตรวจสอบว่า Throughput ของ Edge Device รองรับ ISP Bandwidth เต็มที่หรือไม่
-- ประเมิน Throughput ของ Core/Distribution Switch ว่าเพียงพอหรือไม่
-- ระบุอุปกรณ์ที่ Throughput ไม่เพียงพอต่อ Traffic ที่ต้องรับ
+        device_types: Dict[str, int] = {}
+        for node in nodes:
+            device_type = node.get("data", {}).get("deviceType", "Unknown")
+            device_types[device_type] = device_types.get(device_type, 0) + 1
+        summary_parts = [
+            f"จำนวนอุปกรณ์: {len(nodes)}",
+            f"จำนวนการเชื่อมต่อ: {len(edges)}",
+            f"ประเภทอุปกรณ์: {', '.join(f'{k}: {v}' for k, v in device_types.items())}",
+            f"แบ่งการวิเคราะห์เป็น {len(regions)} ส่วน",
+            "",
+            "ผลวิเคราะห์รายส่วน:",
+        ]
+        for index, (region, result) in enumerate(zip(regions, results), start=1):
+            summary_parts.append(f"\n### ส่วนที่ {index}: {region['name']} ({len(region['nodes'])} อุปกรณ์)")
+            if isinstance(result, OllamaResponseError):
+                summary_parts.append("(วิเคราะห์ส่วนนี้ไม่สำเร็จ)")
+            else:
+                summary_parts.append(result.strip())
 
-### 3.3 การวิเคราะห์ Bandwidth ของสายเชื่อมต่อ
-- **บังคับวิเคราะห์**: ต้องระบุค่า Bandwidth ของทุกเส้นทางที่มีข้อมูล
-- ตรวจสอบความสมดุลของ Bandwidth ในแต่ละ Layer
-- ระบุเส้นทางที่ Bandwidth ต่ำเกินไป (Underprovisioned)
-- ระบุเส้นทางที่ Bandwidth สูงเกินไป (Overprovisioned)
+        return {"nodes": nodes, "edges": edges, "facts": facts, "summary": "\n".join(summary_parts)}
+    
+    def _diff_previous(self, nodes: List[Dict], edges: List[Dict], previous) -> Optional[Dict[str, Any]]:
+        """เทียบกับผลวิเคราะห์เต็มครั้งล่าสุดของ project (คืน None ถ้าไม่มี snapshot หรือปิด incremental)"""
+        if previous is None or not previous.topology_snapshot or not settings.INCREMENTAL_ANALYSIS_ENABLED:
+            return None
+        return diff_topology(previous.topology_snapshot, nodes, edges)
 
-### 3.4 การประเมินความเพียงพอตามจำนวนผู้ใช้
-- **บังคับวิเคราะห์**: ต้องระบุจำนวน User Capacity ของทุก PC ที่มีข้อมูล
-- คำนวณ Bandwidth ต่อ User (เฉลี่ย)
-- ประเมินว่า Bandwidth ต่อคนเพียงพอต่อการใช้งานทั่วไปหรือไม่
-- แนะนำค่า Bandwidth ที่เหมาะสมตามจำนวนผู้ใช้
+    def incremental_base(self, nodes: List[Dict], edges: List[Dict], previous) -> Optional[int]:
+        """id ของ previous ถ้าการวิเคราะห์ topology นี้เป็นแบบ incremental (บันทึกเป็น base_analysis_id) ไม่งั้น None"""
+        diff = self._diff_previous(nodes, edges, previous)
+        return previous.id if should_use_incremental(diff, settings.INCREMENTAL_MAX_CHANGE_RATIO) else None
 
-### 3.5 สรุปปัญหา Bandwidth/Throughput
-- สรุปจุดที่ Bandwidth/Throughput ไม่เพียงพอ
-- ให้คำแนะนำการแก้ไข (อัพเกรด, เพิ่มสาย, เปลี่ยนอุปกรณ์)
+    async def _scheduled(self, key: str, ticket: Optional[AnalysisTicket], fn) -> str:
+        """รอคิวของ scheduler ก่อนส่งงานไป Ollama (ข้ามคิวเมื่อ topology เดียวกันกำลังวิเคราะห์อยู่แล้ว)"""
+        if ticket is None or self.inflight.in_flight(key):
+            return await self.inflight.do(key, fn)
+        release = await ticket.acquire_slot()
+        if self.inflight.in_flight(key):
+            # ระหว่างรอคิวมีงาน topology เดียวกันเริ่มแล้ว: คืนช่องและรอผลร่วมกัน
+            release()
+            return await self.inflight.do(key, fn)
+        # ช่องผูกกับงานที่ส่งไป Ollama ไม่ใช่ request นี้: ผู้เริ่มหลุดไปแต่ยังมีผู้รอ งานยังนับใน ANALYSIS_MAX_CONCURRENT
+        return await self.inflight.do(key, fn, on_done=release)
 
-## 4. คำแนะนำการปรับปรุงแผนผัง
+    async def analyze(
+        self, nodes: List[Dict], edges: List[Dict], facts: Optional[Dict[str, Any]] = None, previous=None,
+        ticket: Optional[AnalysisTicket] = None, usage: Optional[GenerationUsage] = None,
+        progress: Optional[AnalysisProgress] = None
+    ) -> str:
+        """รับการวิเคราะห์จาก AI (ไม่รับ prompt จาก user) และ raise OllamaResponseError เมื่อไม่สำเร็จ
 
-### 4.1 การเพิ่ม Firewall และอุปกรณ์รักษาความปลอดภัย
-- **ถ้ายังไม่มี Firewall**: แนะนำให้เพิ่มและระบุตำแหน่งที่เหมาะสม (หลัง ISP หรือหน้า Core)
-- **ถ้ามี Firewall แล้ว**: ประเมินว่าอยู่ในตำแหน่งที่ถูกต้องหรือไม่
-- แนะนำการเพิ่มอุปกรณ์เสริม (IDS/IPS, UTM, WAF) พร้อมตำแหน่งที่เหมาะสม
-- เสนอการสร้าง DMZ สำหรับ Server ที่ต้องเปิดให้ภายนอกเข้าถึง
+        facts คือผลของ graph_analysis.analyze_topology (คำนวณให้ถ้าไม่ส่งมา)
+        previous คือการวิเคราะห์เต็มครั้งล่าสุดที่มี topology_snapshot ของ project เดียวกัน (crud.get_latest_analysis_snapshot)
+        ถ้าเปลี่ยนไม่เกิน INCREMENTAL_MAX_CHANGE_RATIO จะส่งเฉพาะส่วนที่เปลี่ยนพร้อมสรุปรายงานเดิม
+        (ผู้เรียกบันทึก base_analysis_id = incremental_base(...) ให้ผลนั้นไม่ถูกใช้เป็นฐานครั้งถัดไป)
+        ticket จาก analysis_scheduler.admit ใช้รอคิวแบบ fair ระหว่างผู้ใช้ (cache hit ไม่ต้องรอ)
+        usage สะสม token และเวลาที่ Ollama ใช้ (ว่างเมื่อใช้ผลจาก cache หรือรอผลร่วมกับ request อื่น)
+        progress (ถ้ามี) ทำให้รายงานถูก stream จาก Ollama และบันทึกข้อความที่สร้างได้ลง DB ระหว่างทาง
+        """
+        key = self._cache_key(nodes, edges)
+        cached = await run_in_db_thread(self.cache.get, key)
+        if cached is not None:
+            logger.info(f"Analysis cache hit ({key[:12]})")
+            return cached
 
-### 4.2 การปรับโครงสร้างให้เหมาะสมยิ่งขึ้น
-- **Layer Adjustment**: แนะนำการปรับโครงสร้าง Layer ให้ชัดเจนขึ้น
-- **Connection Restructure**: แนะนำการเปลี่ยนเส้นทางการเชื่อมต่อให้ถูกต้อง
-- **Device Upgrade**: แนะนำอุปกรณ์ที่ควรอัพเกรด
-- **Device Addition**: แนะนำอุปกรณ์ที่ควรเพิ่มเติม
+        diff = self._diff_previous(nodes, edges, previous)
+        if diff is not None and diff["change_count"] == 0:
+            logger.info(f"Topology unchanged since analysis {previous.id}, reusing its result")
+            return previous.analysis_result
 
-### 4.3 การเพิ่ม Redundancy และ High Availability
-- แนะนำการเพิ่ม Redundant Path สำหรับ Critical Link
-- เสนอ Dual ISP หรือ Backup Internet Connection
-- แนะนำการใช้ Link Aggregation หรือ Port Channeling
-- เสนอ Backup Device สำหรับอุปกรณ์สำคัญ
+        if facts is None:
+            facts = analyze_topology(nodes, edges)
+        if should_use_incremental(diff, settings.INCREMENTAL_MAX_CHANGE_RATIO):
+            logger.info(f"Incremental analysis against {previous.id}: {diff['change_count']} changes")
+            incremental = (diff, previous.analysis_result)
+            return await self._scheduled(
+                f"{key}:{previous.id}", ticket, lambda: self._run_analysis(key, nodes, edges, facts, incremental, usage, progress)
+            )
+        # topology เดียวกันที่กำลังวิเคราะห์อยู่จะรอผลจาก Ollama ร่วมกัน (แต่ละ route ยังบันทึกประวัติของตัวเอง)
+        return await self._scheduled(
+            key, ticket, lambda: self._run_analysis(key, nodes, edges, facts, usage=usage, progress=progress)
+        )
 
-### 4.4 การขยายเครือข่ายในอนาคต
-- แนะนำวิธีการขยายเครือข่ายเมื่อมี User เพิ่มขึ้น
-- เสนอการเตรียม Scalability
-- แนะนำการอัพเกรดที่ควรทำในระยะยาว
+    async def get_ai_analysis(
+        self, nodes: List[Dict], edges: List[Dict], facts: Optional[Dict[str, Any]] = None, previous=None,
+        ticket: Optional[AnalysisTicket] = None
+    ) -> str:
+        """รับการวิเคราะห์จาก AI (ข้อผิดพลาดจะถูกคืนเป็นข้อความ)"""
+        try:
+            return await self.analyze(nodes, edges, facts=facts, previous=previous, ticket=ticket)
+        except OllamaResponseError as e:
+            return e.message
 
-### 4.5 สรุปลำดับความสำคัญของการปรับปรุง
-- จัดลำดับความสำคัญ (Critical → High → Medium → Low)
-- ให้เหตุผลว่าทำไมถึงจัดลำดับแบบนั้น
+    async def _prepare(
+        self, nodes: List[Dict], edges: List[Dict], facts: Dict[str, Any], incremental: Optional[Tuple] = None,
+        usage: Optional[GenerationUsage] = None
+    ) -> Tuple[str, Dict[str, Any], Optional[int]]:
+        """เลือก prompt/context/num_predict: incremental, แบ่งส่วน (map-reduce) หรือ prompt เดียว"""
+        if incremental is not None:
+            diff, previous_report = incremental
+            context = {
+                "nodes": nodes,
+                "edges": edges,
+                "facts": facts,
+                "summary": previous_analysis_context(diff, previous_report)
+            }
+            return INCREMENTAL_PROMPT, context, settings.INCREMENTAL_NUM_PREDICT
+        if self.use_hierarchical(nodes):
+            return REDUCE_PROMPT, await self._map_regions(nodes, edges, facts, usage), None
+        # สร้าง context ที่มี key 'nodes' และ 'edges' ตรงกับที่ generate_response ต้องการ
+        return ANALYSIS_PROMPT, {"nodes": nodes, "edges": edges, "facts": facts}, None
 
-## 5. ภาพรวมและสรุป
+    async def _run_analysis(
+        self, key: str, nodes: List[Dict], edges: List[Dict], facts: Dict[str, Any], incremental: Optional[Tuple] = None,
+        usage: Optional[GenerationUsage] = None, progress: Optional[AnalysisProgress] = None
+    ) -> str:
+        # ไม่ต้อง health check ก่อนทุก request: circuit breaker ใน OllamaService จะ fail fast เมื่อ Ollama ล่ม
+        started_at = time.monotonic()
+        response = None
+        if incremental is None and self.use_sections():
+            # หัวข้อสั้นและจำกัดเวลาด้วย SECTION_TIMEOUT_SECONDS จึงไม่ checkpoint ระหว่างทาง
+            response = await self._run_sections(nodes, edges, facts, usage)
+        if response is None:
+            prompt, context, num_predict = await self._prepare(nodes, edges, facts, incremental, usage)
+            if progress is None:
+                response = await self.ollama_service.request_completion(
+                    prompt, context, num_predict=num_predict, usage=usage
+                )
+            else:
+                # stream รายงานจาก Ollama เพื่อ checkpoint ข้อความที่สร้างได้ (ไม่หายทั้งหมดถ้า process หยุดกลางทาง)
+                parts = []
+                async for chunk in self.ollama_service.stream_completion(
+                    prompt, context, num_predict=num_predict, usage=usage
+                ):
+                    parts.append(chunk)
+                    await progress.append(chunk)
+                response = "".join(parts)
+                if not response:
+                    raise OllamaResponseError("ไม่สามารถสร้างคำตอบได้")
+        analysis_duration_seconds.observe(time.monotonic() - started_at, model=self.ollama_service.model)
+        # ผลแบบ incremental ขึ้นกับรายงานเดิม จึงไม่เก็บใน cache ของ topology
+        if incremental is None:
+            await run_in_db_thread(self.cache.put, key, self.ollama_service.model, PROMPT_VERSION, response)
+        return response
 
-### 5.1 สรุปจุดแข็ง
-- ระบุสิ่งที่ออกแบบดีแล้ว
-- ชมเชยจุดที่ถูกต้องตามหลักการ
+    async def stream_analysis(
+        self, nodes: List[Dict], edges: List[Dict], facts: Optional[Dict[str, Any]] = None, previous=None,
+        ticket: Optional[AnalysisTicket] = None, usage: Optional[GenerationUsage] = None
+    ) -> AsyncIterator[str]:
+        """รับการวิเคราะห์จาก AI แบบ streaming และ raise OllamaResponseError เมื่อไม่สำเร็จ"""
+        key = self._cache_key(nodes, edges)
+        cached = await run_in_db_thread(self.cache.get, key)
+        if cached is not None:
+            logger.info(f"Analysis cache hit ({key[:12]})")
+            yield cached
+            return
 
-### 5.2 สรุปจุดอ่อน
-- สรุปปัญหาหลักที่พบทั้งหมด
-- ย้ำจุดที่ต้องแก้ไขเร่งด่วน
+        diff = self._diff_previous(nodes, edges, previous)
+        if diff is not None and diff["change_count"] == 0:
+            logger.info(f"Topology unchanged since analysis {previous.id}, reusing its result")
+            yield previous.analysis_result
+            return
 
-### 5.3 คะแนนความเหมาะสม
-- ให้คะแนนความเหมาะสมของแผนผัง (1-10 คะแนน)
-- อธิบายเกณฑ์การให้คะแนน
+        if facts is None:
+            facts = analyze_topology(nodes, edges)
+        incremental = None
+        if should_use_incremental(diff, settings.INCREMENTAL_MAX_CHANGE_RATIO):
+            logger.info(f"Incremental analysis against {previous.id}: {diff['change_count']} changes")
+            incremental = (diff, previous.analysis_result)
 
-### 5.4 แผนการปรับปรุงโดยสรุป
-- สรุปการปรับปรุงที่ต้องทำ (3-5 ข้อหลัก)
-- จัดลำดับตามความสำคัญและความเร่งด่วน
+        # แบบแบ่งส่วน: ขั้น map ไม่ stream (ผลรายส่วนเป็นข้อมูลภายใน) แล้ว stream เฉพาะรายงานจากขั้น reduce
+        # แบบแยกหัวข้อ: ส่งรายงานทั้งฉบับเมื่อทุกหัวข้อเสร็จ (ถ้าไม่สำเร็จจึง stream จาก prompt เดียว)
+        parts = []
+        async with ticket.slot() if ticket is not None else nullcontext():
+            started_at = time.monotonic()
+            report = None
+            if incremental is None and self.use_sections():
+                report = await self._run_sections(nodes, edges, facts, usage)
+            if report is not None:
+                parts.append(report)
+                yield report
+            else:
+                prompt, context, num_predict = await self._prepare(nodes, edges, facts, incremental, usage)
+                async for chunk in self.ollama_service.stream_completion(
+                    prompt, context, num_predict=num_predict, usage=usage
+                ):
+                    parts.append(chunk)
+                    yield chunk
+            analysis_duration_seconds.observe(time.monotonic() - started_at, model=self.ollama_service.model)
 
-**หมายเหตุสำคัญ:**
-- ห้ามวิเคราะห์ในเชิง Logical (IP Address, Routing, VLAN, Protocol, Subnet)
-- เน้นที่โครงสร้างทางกายภาพ (Physical Topology) และการไหลของข้อมูลเท่านั้น
-- ต้องวิเคราะห์ข้อมูลทุกค่าที่มีอยู่ (Bandwidth, Throughput, User Capacity) ห้ามข้าม"""
+        if parts and incremental is None:
+            await run_in_db_thread(self.cache.put, key, self.ollama_service.model, PROMPT_VERSION, "".join(parts))
 
-        response = await self.ollama_service.generate_response(prompt, context)
-        return response
+    async def stream_ai_analysis(
+        self, nodes: List[Dict], edges: List[Dict], facts: Optional[Dict[str, Any]] = None, previous=None,
+        ticket: Optional[AnalysisTicket] = None
+    ) -> AsyncIterator[str]:
+        """รับการวิเคราะห์จาก AI แบบ streaming (ข้อผิดพลาดจะถูกส่งออกเป็นข้อความ)"""
+        try:
+            async for chunk in self.stream_analysis(nodes, edges, facts=facts, previous=previous, ticket=ticket):
+                yield chunk
+        except OllamaResponseError as e:
+            yield e.message
 
 # Global instance
 analyzer = NetworkTopologyAnalyzer()
\ No newline at end of file
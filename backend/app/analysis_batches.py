@@ -0,0 +1,61 @@
+import logging
+from typing import List, Optional
+
+from . import crud, models, schemas
+from .analysis_jobs import AnalysisJobQueue
+
+logger = logging.getLogger(__name__)
+
+
+def create_batch(
+    db, requested_by: Optional[int], owner_id: Optional[int] = None, project_ids: Optional[List[int]] = None
+) -> models.AIAnalysisBatch:
+    """สร้าง batch วิเคราะห์ซ้ำ project ที่เลือก (project_ids) หรือทุก project ของ owner_id
+
+    อ่านเฉพาะ id ของ project จาก DB ทีละชุด ส่วน diagram_data ถูกอ่านตอน worker เริ่มแต่ละงาน
+    """
+    projects = crud.iter_project_ids(db, owner_id=owner_id, project_ids=project_ids)
+    batch = crud.create_analysis_batch(db, requested_by, projects)
+    logger.info(f"Created analysis batch {batch.id} with {batch.total_jobs} projects")
+    return batch
+
+
+def submit_batch(db, queue: AnalysisJobQueue, batch_id: int) -> int:
+    """รับ lease ของงานค้างใน batch แล้วส่งงาน queued เข้าคิว (อ่าน id ทีละชุด) คืนจำนวนงานที่ส่ง
+
+    งานที่ process อื่นยังถือ lease อยู่ (เช่น batch_analyze.py ที่ทำ batch เดียวกัน) ไม่ถูกส่ง
+    """
+    queue.lease(db, batch_id=batch_id)
+    submitted = 0
+    for (job_id,) in crud.iter_leased_job_ids(db, queue.worker_id, batch_id=batch_id):
+        queue.submit(job_id)
+        submitted += 1
+    return submitted
+
+
+def resume_batch(db, queue: AnalysisJobQueue, batch_id: int, requeue_statuses: List[str]) -> int:
+    """ทำ batch ต่อจากที่ค้าง: งานสถานะใน requeue_statuses (เช่น failed) กลับเป็น queued แล้วส่งงาน queued เข้าคิว
+
+    งาน running ที่ process เดิมหยุดไปถูกรับต่อเมื่อ lease หมดอายุ (submit_batch)
+
+    งานที่อยู่ในคิวของ process นี้อยู่แล้วอาจถูกส่งซ้ำได้ worker จะข้ามงานที่ถูกรับไปแล้ว
+    """
+    if requeue_statuses:
+        crud.requeue_batch_jobs(db, batch_id, requeue_statuses)
+    return submit_batch(db, queue, batch_id)
+
+
+def batch_status(db, batch: models.AIAnalysisBatch) -> schemas.AIAnalysisBatch:
+    counts = crud.count_batch_jobs_by_status(db, batch.id)
+    finished = counts.get("completed", 0) + counts.get("failed", 0)
+    return schemas.AIAnalysisBatch(
+        batch_id=batch.id,
+        total=batch.total_jobs,
+        queued=counts.get("queued", 0),
+        running=counts.get("running", 0),
+        completed=counts.get("completed", 0),
+        failed=counts.get("failed", 0),
+        progress=round(finished / batch.total_jobs, 3) if batch.total_jobs else 1.0,
+        done=finished >= batch.total_jobs,
+        created_at=batch.created_at
+    )
@@ -0,0 +1,175 @@
+import json
+import hashlib
+import logging
+from datetime import timedelta
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import func
+
+from . import models
+from .config import settings
+from .database import SessionLocal
+from .models import bangkok_now
+
+logger = logging.getLogger(__name__)
+
+# ฟิลด์ที่ OllamaService._create_context อ่านจริง (ฟิลด์อื่น เช่น position จะไม่มีผลต่อ cache key)
+NODE_DATA_FIELDS = ("label", "deviceType", "maxThroughput", "throughputUnit", "userCapacity", "deviceRole")
+EDGE_DATA_FIELDS = ("bandwidth", "bandwidthUnit")
+
+
+def topology_digest(nodes: List[Dict], edges: List[Dict]) -> str:
+    """Canonical sha256 ของ topology โดยใช้เฉพาะฟิลด์ที่มีผลต่อ prompt
+
+    ลำดับของ nodes/edges ไม่มีผล (เรียงก่อน hash)
+    """
+    canonical_nodes = sorted(
+        (
+            {
+                "id": node.get("id"),
+                **{field: (node.get("data") or {}).get(field) for field in NODE_DATA_FIELDS}
+            }
+            for node in nodes
+        ),
+        key=lambda n: json.dumps(n, sort_keys=True, ensure_ascii=False, default=str)
+    )
+    canonical_edges = sorted(
+        (
+            {
+                "source": edge.get("source"),
+                "target": edge.get("target"),
+                **{field: (edge.get("data") or {}).get(field) for field in EDGE_DATA_FIELDS}
+            }
+            for edge in edges
+        ),
+        key=lambda e: json.dumps(e, sort_keys=True, ensure_ascii=False, default=str)
+    )
+    encoded = json.dumps(
+        {"nodes": canonical_nodes, "edges": canonical_edges},
+        sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str
+    )
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+def cache_key(nodes: List[Dict], edges: List[Dict], model: str, prompt_version: str, variant: str = "") -> str:
+    """Cache key = topology digest + model + prompt version + variant (ค่า config ที่เปลี่ยนรูปแบบ prompt/รายงาน)"""
+    raw = f"{topology_digest(nodes, edges)}|{model}|{prompt_version}|{variant}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class AnalysisCache:
+    """Cache ผลการวิเคราะห์ใน SQLite (ตาราง ai_analysis_cache) พร้อม TTL และ LRU eviction"""
+
+    def __init__(
+        self,
+        enabled: bool = settings.ANALYSIS_CACHE_ENABLED,
+        ttl_seconds: int = settings.ANALYSIS_CACHE_TTL_SECONDS,
+        max_entries: int = settings.ANALYSIS_CACHE_MAX_ENTRIES
+    ):
+        self.enabled = enabled
+        self.ttl = timedelta(seconds=ttl_seconds)
+        self.max_entries = max_entries
+        # ตัวนับของ process นี้ (รีเซ็ตเมื่อ restart; hit_count ราย entry อยู่ใน DB)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[str]:
+        """คืนผลวิเคราะห์ที่ cache ไว้ หรือ None ถ้าไม่มี/หมดอายุ"""
+        if not self.enabled:
+            return None
+        db = SessionLocal()
+        try:
+            entry = db.query(models.AIAnalysisCache)\
+                .filter(models.AIAnalysisCache.cache_key == key)\
+                .filter(models.AIAnalysisCache.expires_at > bangkok_now())\
+                .first()
+            if entry is None:
+                self.misses += 1
+                return None
+            entry.hit_count = (entry.hit_count or 0) + 1
+            entry.last_accessed_at = bangkok_now()
+            db.commit()
+            self.hits += 1
+            return entry.analysis_result
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Analysis cache lookup failed: {e}")
+            self.misses += 1
+            return None
+        finally:
+            db.close()
+
+    def put(self, key: str, model: str, prompt_version: str, analysis_result: str) -> None:
+        """บันทึกผลวิเคราะห์ลง cache แล้ว evict entry ที่หมดอายุ/เกินขนาด"""
+        if not self.enabled:
+            return
+        db = SessionLocal()
+        try:
+            now = bangkok_now()
+            db.merge(models.AIAnalysisCache(
+                cache_key=key,
+                model_used=model,
+                prompt_version=prompt_version,
+                analysis_result=analysis_result,
+                hit_count=0,
+                created_at=now,
+                expires_at=now + self.ttl,
+                last_accessed_at=now
+            ))
+            db.commit()
+            self._evict(db)
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Analysis cache store failed: {e}")
+        finally:
+            db.close()
+
+    def _evict(self, db) -> None:
+        expired = db.query(models.AIAnalysisCache)\
+            .filter(models.AIAnalysisCache.expires_at <= bangkok_now())\
+            .delete(synchronize_session=False)
+
+        overflow = 0
+        count = db.query(func.count(models.AIAnalysisCache.cache_key)).scalar() or 0
+        if count > self.max_entries:
+            # LRU: ลบ entry ที่ไม่ได้ใช้นานที่สุด
+            stale_keys = [
+                row.cache_key for row in db.query(models.AIAnalysisCache.cache_key)
+                .order_by(models.AIAnalysisCache.last_accessed_at.asc())
+                .limit(count - self.max_entries)
+            ]
+            overflow = db.query(models.AIAnalysisCache)\
+                .filter(models.AIAnalysisCache.cache_key.in_(stale_keys))\
+                .delete(synchronize_session=False)
+
+        db.commit()
+        self.evictions += expired + overflow
+
+    def clear(self) -> int:
+        """ลบ cache ทั้งหมด คืนจำนวน entry ที่ลบ"""
+        db = SessionLocal()
+        try:
+            count = db.query(models.AIAnalysisCache).delete(synchronize_session=False)
+            db.commit()
+            return count
+        finally:
+            db.close()
+
+    def stats(self) -> Dict[str, Any]:
+        db = SessionLocal()
+        try:
+            entries = db.query(func.count(models.AIAnalysisCache.cache_key)).scalar() or 0
+        finally:
+            db.close()
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "entries": entries,
+            "max_entries": self.max_entries,
+            "ttl_seconds": int(self.ttl.total_seconds()),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+        }
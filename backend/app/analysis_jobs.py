@@ -0,0 +1,230 @@
+import os
+import time
+import uuid
+import socket
+import asyncio
+import logging
+from datetime import timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from . import crud, models, schemas
+from .config import settings
+from .db_executor import run_db
+from .models import bangkok_now
+from .ai_service import OllamaResponseError, analyzer
+from .incremental_analysis import topology_snapshot
+from .analysis_scheduler import analysis_scheduler
+from .ollama_metrics import GenerationUsage
+from .analysis_progress import AnalysisProgress
+
+logger = logging.getLogger(__name__)
+
+
+class AnalysisJobQueue:
+    """คิวงานวิเคราะห์แบบ asynchronous พร้อม worker pool จำกัดจำนวน
+
+    งานถูกเก็บในตาราง ai_analysis_jobs ก่อนเข้าคิว in-memory เสมอ พร้อม lease ของคิวนี้ (worker_id)
+    ซึ่งต่ออายุทุก ANALYSIS_JOB_LEASE_SECONDS / 3 วินาที เมื่อ restart งานที่ค้าง (queued/running) จะถูกนำกลับเข้าคิวใน start()
+    เฉพาะงานที่ lease หมดอายุแล้ว งานที่ process อื่น (เช่น batch_analyze.py) ยังทำอยู่จึงไม่ถูกทำซ้ำ
+    worker รับงานด้วยการเปลี่ยนสถานะ queued -> running แบบ atomic งานที่ถูกส่งเข้าคิวซ้ำจึงทำเพียงครั้งเดียว
+    """
+
+    def __init__(self, worker_count: int = settings.ANALYSIS_WORKER_COUNT):
+        self.worker_count = max(1, worker_count)
+        self.worker_id = f"{socket.gethostname()[:40]}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._queue: Optional[asyncio.Queue] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._workers: List[asyncio.Task] = []
+        self._heartbeat: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        return bool(self._workers)
+
+    async def start(self, requeue: bool = True) -> None:
+        """เริ่ม worker (requeue=False ใช้กับ CLI ที่ทำเฉพาะงานที่ submit เอง)"""
+        if self.running:
+            return
+        self._queue = asyncio.Queue()
+        self._loop = asyncio.get_running_loop()
+
+        if requeue:
+            pending = await run_db(self._requeue_unfinished)
+            for job_id in pending:
+                self._queue.put_nowait(job_id)
+            if pending:
+                logger.info(f"Re-queued {len(pending)} unfinished analysis jobs")
+
+        self._heartbeat = asyncio.create_task(self._renew_leases(), name="analysis-job-leases")
+        self._workers = [
+            asyncio.create_task(self._worker(i), name=f"analysis-worker-{i}")
+            for i in range(self.worker_count)
+        ]
+        logger.info(f"Started {self.worker_count} analysis workers ({self.worker_id})")
+
+    async def stop(self) -> None:
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        if self._heartbeat is not None:
+            self._heartbeat.cancel()
+            await asyncio.gather(self._heartbeat, return_exceptions=True)
+            self._heartbeat = None
+        # งานที่ยังค้างในคิวนี้ให้ process อื่น (หรือ process นี้หลัง restart) รับต่อได้ทันทีไม่ต้องรอ lease หมดอายุ
+        await run_db(crud.release_analysis_job_leases, self.worker_id)
+
+    @staticmethod
+    def lease_expires_at():
+        return bangkok_now() + timedelta(seconds=settings.ANALYSIS_JOB_LEASE_SECONDS)
+
+    def lease(self, db, batch_id: Optional[int] = None) -> int:
+        """รับ lease ของงานค้างที่ไม่มี process อื่นถืออยู่ (ทั้งหมด หรือเฉพาะ batch_id) คืนจำนวนงาน"""
+        return crud.lease_unfinished_analysis_jobs(db, self.worker_id, self.lease_expires_at(), batch_id=batch_id)
+
+    def _requeue_unfinished(self, db) -> List[int]:
+        # งาน running ที่ lease หมดอายุ (ถูกขัดจังหวะจาก restart) กลับเป็น queued แล้วเริ่มใหม่
+        self.lease(db)
+        return [job_id for (job_id,) in crud.iter_leased_job_ids(db, self.worker_id)]
+
+    async def _renew_leases(self) -> None:
+        interval = settings.ANALYSIS_JOB_LEASE_SECONDS / 3
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await run_db(crud.renew_analysis_job_leases, self.worker_id, self.lease_expires_at())
+            except Exception as e:
+                logger.error(f"Renewing analysis job leases failed: {e}")
+
+    async def enqueue(self, request: schemas.AIAnalysisRequest, user_id: int):
+        """บันทึกงานลง DB (พร้อม lease ของคิวนี้) แล้วเข้าคิว คืน job (ORM object)"""
+        job = await run_db(
+            crud.create_analysis_job, request, user_id,
+            lease_owner=self.worker_id, lease_expires_at=self.lease_expires_at()
+        )
+        self.submit(job.id)
+        return job
+
+    def submit(self, job_id: int) -> None:
+        """ส่งงานที่บันทึกใน DB แล้ว (สถานะ queued และคิวนี้ถือ lease) เข้าคิว
+
+        เรียกจาก DB thread ได้ (เช่น submit_batch ผ่าน run_db) โดยส่งต่อให้ event loop ของคิว
+        """
+        if self._queue is None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        if loop is self._loop:
+            self._queue.put_nowait(job_id)
+        else:
+            self._loop.call_soon_threadsafe(self._queue.put_nowait, job_id)
+
+    async def join(self) -> None:
+        """รอจนงานที่อยู่ในคิวทำเสร็จทั้งหมด"""
+        if self._queue is not None:
+            await self._queue.join()
+
+    async def _worker(self, index: int) -> None:
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self._run_job(job_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Analysis worker {index} crashed on job {job_id}: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def _run_job(self, job_id: int) -> None:
+        job = await run_db(crud.get_analysis_job, job_id)
+        if job is None or not await run_db(crud.claim_analysis_job, job_id, self.worker_id):
+            return
+
+        start_time = time.time()
+        usage = GenerationUsage()
+        progress = None
+        try:
+            nodes, edges = await run_db(self._job_topology, job)
+            previous = await run_db(crud.get_latest_analysis_snapshot, job.user_id, job.project_id)
+            progress = await AnalysisProgress.start(
+                job.user_id, analyzer.ollama_service.model, len(nodes), job.project_id
+            )
+            # งานในคิวผ่าน rate limit ตอน enqueue แล้ว จึงไม่จำกัดจำนวนงานค้างซ้ำ แต่ยังรอคิวแบบ fair ร่วมกับ route อื่น
+            with analysis_scheduler.admit(job.user_id, enforce_pending=False) as ticket:
+                try:
+                    analysis_result = await analyzer.analyze(
+                        nodes, edges, previous=previous, ticket=ticket, usage=usage, progress=progress
+                    )
+                    snapshot, analysis_status = topology_snapshot(nodes, edges), "completed"
+                    base_analysis_id = analyzer.incremental_base(nodes, edges, previous)
+                except OllamaResponseError as e:
+                    analysis_result, snapshot, analysis_status, base_analysis_id = e.message, None, "failed", None
+            execution_time = int(time.time() - start_time - ticket.queue_wait_seconds)
+            analysis_history = schemas.AIAnalysisHistoryCreate(
+                model_used=analyzer.ollama_service.model,
+                total_device_count=len(nodes),
+                analysis_result=analysis_result,
+                status=analysis_status,
+                execution_time_seconds=execution_time,
+                queue_wait_seconds=round(ticket.queue_wait_seconds, 3),
+                project_id=job.project_id,
+                topology_snapshot=snapshot,
+                base_analysis_id=base_analysis_id,
+                **usage.history_fields()
+            )
+            db_analysis = await progress.finish(analysis_history)
+            # Ollama ตอบ error: งานเป็น failed ด้วย (retry ของ batch เลือกจากสถานะงาน) แต่ยังชี้ไปที่แถวประวัติ
+            await run_db(
+                crud.update_analysis_job, job_id,
+                status=analysis_status,
+                error=analysis_result if analysis_status == "failed" else None,
+                analysis_id=db_analysis.id,
+                finished_at=bangkok_now()
+            )
+        except asyncio.CancelledError:
+            # shutdown ระหว่างทำงาน: คืนสถานะเป็น queued เพื่อให้ทำต่อหลัง restart (stop() คืน lease ให้)
+            # ข้อความที่ได้แล้วเก็บไว้ในแถวประวัติสถานะ interrupted
+            await run_db(crud.update_analysis_job, job_id, status="queued", started_at=None)
+            if progress is not None:
+                await progress.abort()
+            raise
+        except Exception as e:
+            if progress is not None:
+                await progress.abort("failed")
+            logger.error(f"Analysis job {job_id} failed: {e}")
+            await run_db(crud.update_analysis_job, job_id, status="failed", error=str(e), finished_at=bangkok_now())
+
+    @staticmethod
+    def _job_topology(db, job: models.AIAnalysisJob) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+        """nodes/edges ของงาน: งานของ batch อ่าน diagram_data ล่าสุดของ project (โหลดทีละ project)"""
+        if job.batch_id is None:
+            data = job.request_data
+        else:
+            project = db.query(models.Project).filter(models.Project.id == job.project_id).first()
+            if project is None:
+                raise ValueError("Project not found")
+            data = project.diagram_data or {}
+            if not data.get("nodes"):
+                raise ValueError("Project has no diagram data")
+        return data.get("nodes", []), data.get("edges", [])
+
+
+def job_status(db, job) -> schemas.AIAnalysisJob:
+    return schemas.AIAnalysisJob(
+        job_id=job.id,
+        status=job.status,
+        queue_position=crud.get_analysis_job_queue_position(db, job),
+        project_id=job.project_id,
+        analysis_id=job.analysis_id,
+        error=job.error,
+        created_at=job.created_at,
+        started_at=job.started_at,
+        finished_at=job.finished_at
+    )
+
+
+# Global instance
+job_queue = AnalysisJobQueue()
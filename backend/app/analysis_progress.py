@@ -0,0 +1,139 @@
+import time
+import asyncio
+import logging
+from datetime import timedelta
+from typing import List, Optional
+
+from . import crud, models, schemas
+from .config import settings
+from .database import SessionLocal
+from .db_executor import run_db, run_in_db_thread
+
+logger = logging.getLogger(__name__)
+
+# แถว running ที่ไม่มี checkpoint/heartbeat นานเกินจำนวนรอบนี้ ถือว่าไม่มี process ทำต่อแล้ว
+STALE_CHECKPOINTS = 6
+
+
+class AnalysisProgress:
+    """แถว ai_analysis_history ของการวิเคราะห์ที่กำลังทำงาน
+
+    สร้างแถวสถานะ running ก่อนส่งงานไป Ollama แล้วต่อท้ายข้อความที่สร้างได้เป็นช่วง ๆ
+    (ทุก ANALYSIS_CHECKPOINT_SECONDS วินาที หรือเมื่อสะสมครบ ANALYSIS_CHECKPOINT_CHARS ตัวอักษร)
+    ระหว่างที่ยังไม่มีข้อความ (รอคิว, รอ token แรก) heartbeat แตะ updated_at ทุก ANALYSIS_CHECKPOINT_SECONDS วินาที
+    ถ้า process หยุดกลางทาง แถวที่ไม่ถูกแตะนานเกิน STALE_CHECKPOINTS รอบจะถูกเปลี่ยนเป็น interrupted
+    โดยยังเก็บข้อความที่ได้ไว้ (แถวของ process อื่นที่ยังทำงานอยู่ เช่น batch_analyze.py จึงไม่ถูกแตะ)
+    """
+
+    def __init__(self, analysis_id: int, user_id: int):
+        self.analysis_id = analysis_id
+        self.user_id = user_id
+        self.checkpoints = 0
+        self._buffer: List[str] = []
+        self._buffered_chars = 0
+        self._flushed_at = time.monotonic()
+        self._heartbeat: Optional[asyncio.Task] = None
+
+    @classmethod
+    async def start(
+        cls, user_id: int, model_used: str, total_device_count: int, project_id: Optional[int] = None
+    ) -> "AnalysisProgress":
+        analysis = await run_db(crud.create_analysis_history, schemas.AIAnalysisHistoryCreate(
+            model_used=model_used,
+            total_device_count=total_device_count,
+            analysis_result="",
+            status="running",
+            project_id=project_id
+        ), user_id)
+        progress = cls(analysis.id, user_id)
+        progress._heartbeat = asyncio.create_task(progress._keep_alive(), name=f"analysis-{analysis.id}-heartbeat")
+        return progress
+
+    async def _keep_alive(self) -> None:
+        while True:
+            await asyncio.sleep(settings.ANALYSIS_CHECKPOINT_SECONDS)
+            try:
+                if not await run_db(crud.touch_running_analysis, self.analysis_id):
+                    return
+            except Exception as e:
+                logger.warning(f"Heartbeat of analysis {self.analysis_id} failed: {e}")
+
+    def _stop_heartbeat(self) -> None:
+        if self._heartbeat is not None:
+            self._heartbeat.cancel()
+            self._heartbeat = None
+
+    async def append(self, text: str) -> None:
+        self._buffer.append(text)
+        self._buffered_chars += len(text)
+        if (
+            self._buffered_chars >= settings.ANALYSIS_CHECKPOINT_CHARS
+            or time.monotonic() - self._flushed_at >= settings.ANALYSIS_CHECKPOINT_SECONDS
+        ):
+            await self.flush()
+
+    async def flush(self) -> None:
+        """เขียนข้อความที่สะสมไว้ลง DB (ล้มเหลวแล้วแค่ log ไม่ให้การวิเคราะห์ล้มตาม)
+
+        รอให้เขียนเสร็จก่อนรับข้อความถัดไป ลำดับของ checkpoint จึงไม่สลับกันแม้ DB thread pool มีหลาย thread
+        """
+        if not self._buffer:
+            return
+        text = "".join(self._buffer)
+        self._buffer = []
+        self._buffered_chars = 0
+        self._flushed_at = time.monotonic()
+        try:
+            await run_db(crud.append_analysis_text, self.analysis_id, text)
+            self.checkpoints += 1
+        except Exception as e:
+            logger.warning(f"Checkpoint of analysis {self.analysis_id} failed: {e}")
+
+    async def finish(self, analysis: schemas.AIAnalysisHistoryCreate) -> models.AIAnalysisHistory:
+        """บันทึกผลสุดท้าย (ข้อความเต็ม เวลา token) ทับแถวที่สร้างไว้"""
+        self._stop_heartbeat()
+        self._buffer = []
+        return await run_db(crud.update_analysis_history, self.analysis_id, analysis)
+
+    async def discard(self) -> None:
+        """client ยกเลิกเอง: ลบแถวทิ้ง (ไม่บันทึกประวัติของการวิเคราะห์ที่ไม่มีใครรอผล)"""
+        self._stop_heartbeat()
+        self._buffer = []
+        await run_db(crud.delete_analysis_history, self.analysis_id, self.user_id)
+
+    async def abort(self, status: str = "interrupted") -> None:
+        """หยุดกลางทาง (shutdown = interrupted, error ที่ไม่คาดคิด = failed) โดยเก็บข้อความที่ได้แล้วไว้"""
+        self._stop_heartbeat()
+        await self.flush()
+        await run_db(crud.update_running_analysis_status, self.analysis_id, status)
+
+
+def stale_after_seconds() -> float:
+    return settings.ANALYSIS_CHECKPOINT_SECONDS * STALE_CHECKPOINTS
+
+
+def recover_interrupted_analyses() -> int:
+    """แถว running ที่ค้างจาก process ที่หยุดไปแล้ว (ไม่มี checkpoint/heartbeat นานเกิน stale_after_seconds) เป็น interrupted
+
+    เรียกตอนเริ่มระบบและเป็นระยะ (watch_interrupted_analyses) แถวที่ process อื่นยังเขียนอยู่ เช่น batch_analyze.py
+    หรือ uvicorn worker อื่น ถูกแตะทุก ANALYSIS_CHECKPOINT_SECONDS วินาทีจึงไม่ถูกเปลี่ยน
+    """
+    stale_before = models.bangkok_now() - timedelta(seconds=stale_after_seconds())
+    db = SessionLocal()
+    try:
+        count = crud.mark_analyses_interrupted(db, stale_before)
+    finally:
+        db.close()
+    if count:
+        logger.warning(f"Marked {count} unfinished analyses as interrupted (partial text kept)")
+    return count
+
+
+async def watch_interrupted_analyses() -> None:
+    """ตรวจแถว running ที่ค้างเป็นระยะ (process ที่ตายหลังจาก process นี้เริ่มทำงาน)"""
+    while True:
+        await asyncio.sleep(stale_after_seconds())
+        try:
+            await run_in_db_thread(recover_interrupted_analyses)
+        except Exception as e:
+            logger.error(f"Recovering interrupted analyses failed: {e}")
@@ -0,0 +1,281 @@
+import math
+import time
+import asyncio
+import logging
+from collections import defaultdict, deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable, Deque, Dict, Optional, Tuple
+
+from fastapi import HTTPException, status
+
+from .config import settings
+from .ollama_metrics import queue_wait_seconds
+
+logger = logging.getLogger(__name__)
+
+# น้ำหนักของเวลาทำงานล่าสุดใน EWMA (ใช้ประมาณ Retry-After เมื่อคิวของผู้ใช้เต็ม)
+SERVICE_TIME_EWMA_ALPHA = 0.3
+
+
+class RateLimitExceeded(Exception):
+    """ผู้ใช้ส่งงานวิเคราะห์เกินโควตา (routes แปลงเป็น HTTP 429 พร้อม Retry-After)"""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.message = message
+        self.retry_after = max(1, retry_after)
+
+
+class TokenBucket:
+    """token bucket ต่อผู้ใช้: เติม rate_per_minute token ต่อนาที เก็บได้สูงสุด burst"""
+
+    def __init__(self, rate_per_minute: float, burst: int):
+        self.rate = max(rate_per_minute, 0.0) / 60.0
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def retry_after(self) -> float:
+        """วินาทีที่ต้องรอจนได้ token ถัดไป (0 = มี token พร้อมใช้)"""
+        self._refill()
+        if self.tokens >= 1:
+            return 0.0
+        if self.rate <= 0:
+            return float("inf")
+        return (1 - self.tokens) / self.rate
+
+    def take(self) -> None:
+        self._refill()
+        self.tokens -= 1
+
+
+class AnalysisTicket:
+    """สิทธิ์วิเคราะห์หนึ่งครั้งของผู้ใช้ (ได้จาก AnalysisScheduler.admit)
+
+    ใช้เป็น context manager ครอบทั้ง request เพื่อคืนโควตาคิวของผู้ใช้เสมอ
+    ส่วน slot() จะถูกเรียกโดย analyzer เฉพาะเมื่อต้องส่งงานไป Ollama จริง (cache hit ไม่ต้องรอคิว)
+    """
+
+    def __init__(self, scheduler: "AnalysisScheduler", user_id: int):
+        self.scheduler = scheduler
+        self.user_id = user_id
+        self.queue_wait_seconds = 0.0
+        self._closed = False
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator["AnalysisTicket"]:
+        release = await self.acquire_slot()
+        try:
+            yield self
+        finally:
+            release()
+
+    async def acquire_slot(self) -> Callable[[], None]:
+        """รอจนได้ช่องทำงาน คืนฟังก์ชันคืนช่อง (เรียกซ้ำได้)
+
+        ใช้แทน slot() เมื่อช่องต้องอยู่นานกว่า request ของผู้ขอ เช่นงาน single-flight ที่ยังทำต่อให้ผู้รอคนอื่น
+        """
+        waited = await self.scheduler._acquire(self.user_id)
+        self.queue_wait_seconds += waited
+        queue_wait_seconds.observe(waited, model=settings.OLLAMA_MODEL)
+        started_at = time.monotonic()
+        released = False
+
+        def release() -> None:
+            nonlocal released
+            if not released:
+                released = True
+                self.scheduler._release(self.user_id, time.monotonic() - started_at)
+
+        return release
+
+    def close(self) -> None:
+        if not self._closed:
+            self._closed = True
+            self.scheduler._leave(self.user_id)
+
+    def __enter__(self) -> "AnalysisTicket":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+class AnalysisScheduler:
+    """จัดลำดับงานวิเคราะห์ที่ส่งไป Ollama อย่างเป็นธรรมระหว่างผู้ใช้
+
+    - admit(): ตรวจ token bucket และจำนวนงานค้างต่อผู้ใช้ เกินแล้ว raise RateLimitExceeded
+    - slot(): รอจนได้ช่องทำงาน (รวมทั้งระบบไม่เกิน ANALYSIS_MAX_CONCURRENT และต่อผู้ใช้ไม่เกิน
+      ANALYSIS_USER_MAX_CONCURRENT) โดยเลือกผู้ใช้ที่ได้รับบริการไปแล้วต่อน้ำหนักน้อยที่สุดก่อน
+      (weighted fair queueing) งานของผู้ใช้คนเดียวกันเรียงตามลำดับที่มาถึง
+    """
+
+    def __init__(self):
+        self._running_total = 0
+        self._running: Dict[int, int] = defaultdict(int)
+        self._pending: Dict[int, int] = defaultdict(int)
+        # virtual time ต่อผู้ใช้: จำนวนงานที่ได้รับบริการ / น้ำหนัก
+        self._served: Dict[int, float] = defaultdict(float)
+        self._waiting: Dict[int, Deque[Tuple[int, asyncio.Future]]] = {}
+        self._buckets: Dict[int, TokenBucket] = {}
+        self._seq = 0
+        self._service_seconds: Optional[float] = None
+        self.admitted = 0
+        self.rejected = 0
+
+    @staticmethod
+    def weight(user_id: int) -> float:
+        return max(settings.ANALYSIS_USER_WEIGHTS.get(user_id, 1.0), 0.01)
+
+    def admit(self, user_id: int, enforce_pending: bool = True) -> AnalysisTicket:
+        """รับงานของผู้ใช้เข้าระบบ หรือ raise RateLimitExceeded ถ้าเกินโควตา
+
+        enforce_pending=False ใช้กับงานที่เข้าคิวถาวรแล้ว (job queue) ซึ่งไม่ควรถูกปฏิเสธซ้ำ
+        """
+        if enforce_pending and self._pending.get(user_id, 0) >= settings.ANALYSIS_USER_MAX_PENDING:
+            self.rejected += 1
+            raise RateLimitExceeded(
+                f"มีงานวิเคราะห์ของคุณรออยู่แล้ว {self._pending[user_id]} งาน กรุณารอให้งานเดิมเสร็จก่อน",
+                math.ceil(self._service_seconds or 1)
+            )
+        if enforce_pending:
+            self.check_rate(user_id)
+        self._pending[user_id] += 1
+        self.admitted += 1
+        return AnalysisTicket(self, user_id)
+
+    def check_rate(self, user_id: int) -> None:
+        """ใช้ token ของผู้ใช้หนึ่งครั้ง หรือ raise RateLimitExceeded ถ้าหมด"""
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            bucket = self._buckets[user_id] = TokenBucket(
+                settings.ANALYSIS_RATE_PER_MINUTE, settings.ANALYSIS_RATE_BURST
+            )
+        wait = bucket.retry_after()
+        if wait > 0:
+            self.rejected += 1
+            retry_after = math.ceil(wait) if math.isfinite(wait) else 60
+            raise RateLimitExceeded(
+                f"ส่งงานวิเคราะห์บ่อยเกินไป กรุณาลองใหม่ในอีก {retry_after} วินาที", retry_after
+            )
+        bucket.take()
+
+    def _leave(self, user_id: int) -> None:
+        self._pending[user_id] -= 1
+        if self._pending[user_id] <= 0:
+            del self._pending[user_id]
+
+    def _can_run(self, user_id: int) -> bool:
+        return (
+            self._running_total < max(1, settings.ANALYSIS_MAX_CONCURRENT)
+            and self._running.get(user_id, 0) < max(1, settings.ANALYSIS_USER_MAX_CONCURRENT)
+        )
+
+    def _is_active(self, user_id: int) -> bool:
+        return self._running.get(user_id, 0) > 0 or bool(self._waiting.get(user_id))
+
+    def _start(self, user_id: int) -> None:
+        self._running_total += 1
+        self._running[user_id] += 1
+        self._served[user_id] += 1 / self.weight(user_id)
+
+    async def _acquire(self, user_id: int) -> float:
+        """รอจนได้ช่องทำงาน คืนเวลาที่รอในคิว (วินาที)"""
+        if not self._is_active(user_id):
+            # ผู้ใช้ที่ว่างมานานไม่ได้เครดิตสะสม: เริ่มที่ virtual time ต่ำสุดของผู้ใช้ที่กำลังใช้งานอยู่
+            active = [self._served[u] for u in set(self._running) | set(self._waiting) if self._is_active(u)]
+            if active:
+                self._served[user_id] = max(self._served[user_id], min(active))
+            else:
+                # ระบบว่าง: เริ่มรอบใหม่ ไม่ต้องจำประวัติการใช้งานเก่า
+                self._served.clear()
+
+        if not self._waiting and self._can_run(user_id):
+            self._start(user_id)
+            return 0.0
+
+        queued_at = time.monotonic()
+        future = asyncio.get_running_loop().create_future()
+        self._seq += 1
+        self._waiting.setdefault(user_id, deque()).append((self._seq, future))
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # ได้ช่องแล้วแต่ถูกยกเลิกพร้อมกัน ต้องคืนช่องให้คนถัดไป
+                self._release(user_id, None)
+            else:
+                queue = self._waiting.get(user_id)
+                if queue is not None:
+                    self._waiting[user_id] = deque(item for item in queue if item[1] is not future)
+                    if not self._waiting[user_id]:
+                        del self._waiting[user_id]
+            raise
+        waited = time.monotonic() - queued_at
+        logger.info(f"Analysis for user {user_id} waited {waited:.1f}s in queue")
+        return waited
+
+    def _dispatch(self) -> None:
+        """ให้ช่องว่างแก่ผู้ใช้ที่มี virtual time ต่ำสุด (เท่ากันแล้วดูลำดับที่มาถึง)"""
+        while True:
+            candidates = [user_id for user_id, queue in self._waiting.items() if queue and self._can_run(user_id)]
+            if not candidates:
+                return
+            user_id = min(candidates, key=lambda u: (self._served[u], self._waiting[u][0][0]))
+            queue = self._waiting[user_id]
+            _, future = queue.popleft()
+            if not queue:
+                del self._waiting[user_id]
+            if future.cancelled():
+                continue
+            self._start(user_id)
+            future.set_result(None)
+
+    def _release(self, user_id: int, service_seconds: Optional[float]) -> None:
+        self._running_total -= 1
+        self._running[user_id] -= 1
+        if self._running[user_id] <= 0:
+            del self._running[user_id]
+        if service_seconds is not None:
+            self._service_seconds = service_seconds if self._service_seconds is None else (
+                SERVICE_TIME_EWMA_ALPHA * service_seconds + (1 - SERVICE_TIME_EWMA_ALPHA) * self._service_seconds
+            )
+        self._dispatch()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_concurrent": settings.ANALYSIS_MAX_CONCURRENT,
+            "user_max_concurrent": settings.ANALYSIS_USER_MAX_CONCURRENT,
+            "running": self._running_total,
+            "queued": sum(len(queue) for queue in self._waiting.values()),
+            "queued_by_user": {user_id: len(queue) for user_id, queue in self._waiting.items()},
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "avg_service_seconds": round(self._service_seconds, 1) if self._service_seconds is not None else None
+        }
+
+
+# Global instance
+analysis_scheduler = AnalysisScheduler()
+
+
+def too_many_requests(error: RateLimitExceeded) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        detail=error.message,
+        headers={"Retry-After": str(error.retry_after)}
+    )
+
+
+def admit_analysis(user_id: int) -> AnalysisTicket:
+    """admit สำหรับ route วิเคราะห์: เกินโควตาแล้วตอบ 429 พร้อม Retry-After"""
+    try:
+        return analysis_scheduler.admit(user_id)
+    except RateLimitExceeded as e:
+        raise too_many_requests(e)
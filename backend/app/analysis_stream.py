@@ -0,0 +1,128 @@
+import json
+import time
+import asyncio
+import logging
+from contextlib import aclosing
+from typing import Any, AsyncIterator, Dict
+
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+
+from . import crud, schemas
+from .db_executor import run_db
+from .ai_service import OllamaResponseError, analyzer
+from .graph_analysis import analyze_topology
+from .incremental_analysis import topology_snapshot
+from .analysis_scheduler import AnalysisTicket, admit_analysis
+from .ollama_metrics import GenerationUsage
+from .analysis_progress import AnalysisProgress
+from .client_disconnect import cancel_on_disconnect
+
+logger = logging.getLogger(__name__)
+
+
+def _ndjson(event: Dict[str, Any]) -> bytes:
+    return (json.dumps(event, ensure_ascii=False, default=str) + "\n").encode("utf-8")
+
+
+async def _analysis_events(
+    request: schemas.AIAnalysisRequest, user_id: int, ticket: AnalysisTicket, http_request: Request
+) -> AsyncIterator[bytes]:
+    """ส่ง token จาก Ollama เป็น NDJSON แล้วบันทึกประวัติเมื่อ stream จบ
+
+    แถวประวัติ (running) ถูกสร้างก่อนเริ่มและบันทึกข้อความเป็นช่วง ๆ ระหว่าง stream
+    ถ้า client หลุดกลางทาง request ไปยัง Ollama จะถูกยกเลิกและลบแถวนั้นทิ้ง
+
+    Event ที่ส่งออก (หนึ่ง JSON ต่อบรรทัด):
+    - {"type": "facts", "facts": {...}} (ข้อเท็จจริงเชิงกราฟ ส่งก่อน token แรก)
+    - {"type": "token", "content": "..."}
+    - {"type": "done", "status": "completed", "analysis_id": 1, "execution_time_seconds": 42, "queue_wait_seconds": 0.0,
+       "usage": {"prompt_tokens": ..., "completion_tokens": ..., "time_to_first_token_ms": ..., ...}}
+      status คือสถานะที่บันทึกในประวัติ: "failed" เมื่อ Ollama ตอบ error (token ที่ส่งไปคือข้อความผิดพลาด)
+    - {"type": "error", "detail": "..."}
+    """
+    start_time = time.time()
+    usage = GenerationUsage()
+    parts = []
+    progress = None
+    try:
+        facts = analyze_topology(request.nodes, request.edges)
+        yield _ndjson({"type": "facts", "facts": facts})
+
+        previous = await run_db(crud.get_latest_analysis_snapshot, user_id, request.project_id)
+        progress = await AnalysisProgress.start(
+            user_id, analyzer.ollama_service.model, len(request.nodes), request.project_id
+        )
+
+        snapshot, analysis_status = topology_snapshot(request.nodes, request.edges), "completed"
+        base_analysis_id = analyzer.incremental_base(request.nodes, request.edges, previous)
+        try:
+            async with cancel_on_disconnect(http_request), aclosing(analyzer.stream_analysis(
+                request.nodes, request.edges, facts=facts, previous=previous, ticket=ticket, usage=usage
+            )) as stream:
+                async for chunk in stream:
+                    parts.append(chunk)
+                    await progress.append(chunk)
+                    yield _ndjson({"type": "token", "content": chunk})
+        except OllamaResponseError as e:
+            # แสดงข้อความผิดพลาดเป็นเนื้อหาเหมือนเดิม แต่ไม่เก็บ snapshot (ไม่ใช่ผลวิเคราะห์ที่สำเร็จ)
+            parts.append(e.message)
+            snapshot, analysis_status, base_analysis_id = None, "failed", None
+            yield _ndjson({"type": "token", "content": e.message})
+
+        queue_wait = round(ticket.queue_wait_seconds, 3)
+        execution_time = int(time.time() - start_time - ticket.queue_wait_seconds)
+        analysis_history = schemas.AIAnalysisHistoryCreate(
+            model_used=analyzer.ollama_service.model,
+            total_device_count=len(request.nodes),
+            analysis_result="".join(parts),
+            status=analysis_status,
+            execution_time_seconds=execution_time,
+            queue_wait_seconds=queue_wait,
+            project_id=request.project_id,
+            topology_snapshot=snapshot,
+            base_analysis_id=base_analysis_id,
+            **usage.history_fields()
+        )
+        db_analysis = await progress.finish(analysis_history)
+        analysis_id = db_analysis.id
+
+        yield _ndjson({
+            "type": "done",
+            "status": analysis_status,
+            "analysis_id": analysis_id,
+            "execution_time_seconds": execution_time,
+            "queue_wait_seconds": queue_wait,
+            "usage": usage.history_fields()
+        })
+    except asyncio.CancelledError:
+        logger.info(f"Streaming analysis cancelled after {len(parts)} chunks (client disconnected), not saved")
+        if progress is not None:
+            await progress.discard()
+        raise
+    except Exception as e:
+        logger.error(f"Streaming analysis failed: {e}")
+        if progress is not None:
+            await progress.abort("failed")
+        yield _ndjson({"type": "error", "detail": f"Analysis failed: {str(e)}"})
+    finally:
+        ticket.close()
+
+
+def streaming_analysis_response(
+    request: schemas.AIAnalysisRequest, user_id: int, http_request: Request
+) -> StreamingResponse:
+    """สร้าง StreamingResponse แบบ NDJSON สำหรับ route วิเคราะห์ (ตอบ 429 ก่อนเริ่ม stream ถ้าเกินโควตา)"""
+    ticket = admit_analysis(user_id)
+    return StreamingResponse(
+        _analysis_events(request, user_id, ticket, http_request),
+        media_type="application/x-ndjson",
+        headers={
+            "Cache-Control": "no-cache",
+            # ปิด buffering ของ reverse proxy (nginx) เพื่อให้ token ถึง client ทันที
+            "X-Accel-Buffering": "no"
+        },
+        # คืนโควตาแม้ body จะไม่ถูกเริ่มเลย (close เรียกซ้ำได้)
+        background=BackgroundTask(ticket.close)
+    )
@@ -7,7 +7,7 @@ from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy.orm import Session
 from . import models, schemas
-from .database import get_db
+from .db_executor import run_db
 from .config import settings
 import hashlib
 import logging
@@ -87,24 +87,26 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
 def get_user(db: Session, email: str):
     return db.query(models.User).filter(models.User.email == email).first()
 
-def authenticate_user(db: Session, email: str, password: str):
-    user = get_user(db, email)
-    if not user:
-        return False
+def check_user_password(user: models.User, password: str) -> bool:
+    """ตรวจรหัสผ่านกับ hash ของ user (ใช้ CPU นาน: route แบบ async ต้องเรียกผ่าน run_in_threadpool)"""
     try:
-        if not verify_password(password, user.hashed_password):
-            return False
+        return verify_password(password, user.hashed_password)
     except UnknownHashError as e:
         # Hash format ไม่รู้จัก (เช่น bcrypt hash แต่ bcrypt backend ไม่พร้อม)
-        logger.warning(f"Unknown hash format for user {email}: {e}")
+        logger.warning(f"Unknown hash format for user {user.email}: {e}")
         return False
     except Exception as e:
         # Error อื่นๆ ในการ verify password
-        logger.error(f"Password verification error for user {email}: {e}")
+        logger.error(f"Password verification error for user {user.email}: {e}")
+        return False
+
+def authenticate_user(db: Session, email: str, password: str):
+    user = get_user(db, email)
+    if not user or not check_user_password(user, password):
         return False
     return user
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+async def get_current_user(token: str = Depends(oauth2_scheme)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -118,7 +120,7 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
         token_data = schemas.TokenData(email=email)
     except JWTError:
         raise credentials_exception
-    user = get_user(db, email=token_data.email)
+    user = await run_db(get_user, email=token_data.email)
     if user is None:
         raise credentials_exception
     return user
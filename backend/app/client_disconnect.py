@@ -0,0 +1,64 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, TypeVar
+
+from fastapi import Request
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# status แบบ nginx สำหรับ log เมื่อ client ปิดการเชื่อมต่อก่อน (client ไม่ได้รับ response นี้)
+CLIENT_CLOSED_REQUEST = 499
+
+
+class ClientDisconnected(Exception):
+    """client ปิดการเชื่อมต่อก่อนได้ผลลัพธ์ งานที่ค้างอยู่ถูกยกเลิกแล้ว"""
+
+
+async def run_until_disconnected(request: Request, awaitable: Awaitable[T]) -> T:
+    """รอผลของ awaitable พร้อมตรวจว่า client ยังเชื่อมต่ออยู่ทุก DISCONNECT_POLL_SECONDS
+
+    FastAPI ไม่ยกเลิก route แบบ non-streaming เมื่อ client หลุด จึงต้องตรวจเอง
+    ถ้า client หลุดจะยกเลิกงาน (ซึ่งยกเลิก request ไปยัง Ollama ต่อ) แล้ว raise ClientDisconnected
+    """
+    task = asyncio.ensure_future(awaitable)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=settings.DISCONNECT_POLL_SECONDS)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                logger.info(f"Client disconnected from {request.url.path}, cancelling analysis")
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+                raise ClientDisconnected()
+    except asyncio.CancelledError:
+        # route ถูกยกเลิกเอง (เช่น server shutdown) ต้องยกเลิกงานด้วย
+        task.cancel()
+        raise
+
+
+@asynccontextmanager
+async def cancel_on_disconnect(request: Request) -> AsyncIterator[None]:
+    """ยกเลิก task ปัจจุบันเมื่อ client หลุด สำหรับ body ของ StreamingResponse
+
+    Starlette ตรวจพบการหลุดเองเฉพาะกับ server ที่ใช้ ASGI spec < 2.4 (ใหม่กว่านั้นรู้ตอนเขียน token ถัดไป)
+    ซึ่งไม่พอสำหรับช่วงที่ไม่มี token ส่งออกนาน เช่นรอคิวหรือขั้น map ของการวิเคราะห์แบบแบ่งส่วน
+    """
+    task = asyncio.current_task()
+
+    async def watch() -> None:
+        while not await request.is_disconnected():
+            await asyncio.sleep(settings.DISCONNECT_POLL_SECONDS)
+        logger.info(f"Client disconnected from {request.url.path}, cancelling stream")
+        task.cancel()
+
+    watcher = asyncio.create_task(watch())
+    try:
+        yield
+    finally:
+        watcher.cancel()
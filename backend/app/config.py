@@ -1,7 +1,27 @@
+from typing import Dict, List, Literal, Optional
+from pydantic import BaseModel
 from pydantic_settings import BaseSettings
 
+class OllamaBackendConfig(BaseModel):
+    url: str
+    weight: float = 1.0  # สัดส่วนงานเทียบกับ backend อื่น (เช่น GPU แรงกว่าให้ 2)
+    max_concurrency: Optional[int] = None  # ไม่ระบุ = OLLAMA_BACKEND_MAX_CONCURRENCY
+
 class Settings(BaseSettings):
     DATABASE_URL: str = "sqlite:///./network_topology.db"
+    DB_THREAD_POOL_SIZE: int = 4  # thread ที่รัน query/commit ของ route แบบ async (ไม่บล็อก event loop)
+    # connection pool ของ engine (ควรมากกว่า DB_THREAD_POOL_SIZE เผื่อ threadpool ของ FastAPI และ CLI)
+    DB_POOL_SIZE: int = 10
+    DB_POOL_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT_SECONDS: int = 30
+    # Storage profile ของ SQLite: "tuned" = ตั้ง pragma ด้านล่างทุก connection, "default" = ค่าเดิมของ SQLite
+    SQLITE_PROFILE: Literal["tuned", "default"] = "tuned"
+    SQLITE_JOURNAL_MODE: Literal["WAL", "DELETE", "TRUNCATE", "PERSIST"] = "WAL"
+    SQLITE_SYNCHRONOUS: Literal["OFF", "NORMAL", "FULL", "EXTRA"] = "NORMAL"
+    SQLITE_BUSY_TIMEOUT_MS: int = 5000  # รอ lock ของการเขียนก่อนตอบ "database is locked"
+    SQLITE_MMAP_SIZE: int = 256 * 1024 * 1024  # bytes
+    SQLITE_CACHE_SIZE: int = -64000  # ค่าลบ = KiB (64 MB ต่อ connection)
+    SQLITE_TEMP_STORE: Literal["DEFAULT", "FILE", "MEMORY"] = "MEMORY"
     SECRET_KEY: str = "your-secret-key-here"
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 480  # 8 ชั่วโมง - พอสำหรับ dev/testing
@@ -9,7 +29,80 @@ class Settings(BaseSettings):
     # Ollama Configuration
     OLLAMA_BASE_URL: str = "http://10.80.49.111:11434"
     OLLAMA_MODEL: str = "gpt-oss:latest"  # Fixed model, cannot be changed
-    OLLAMA_TIMEOUT: int = 3600  # 60 minutes timeout
+    OLLAMA_TIMEOUT: int = 3600  # 60 minutes timeout (ทั้ง request)
+    OLLAMA_CONNECT_TIMEOUT: int = 10  # เปิด TCP connection ไปยัง Ollama
+    OLLAMA_FIRST_BYTE_TIMEOUT: int = 600  # streaming: รอ token แรก/ช่วงที่ stream เงียบได้นานสุด
+    OLLAMA_HEALTH_CHECK_INTERVAL: int = 15  # วินาทีระหว่างการ probe ใน background
+    OLLAMA_HEALTH_CHECK_TIMEOUT: int = 5  # timeout ของ probe (แยกจาก OLLAMA_TIMEOUT)
+    OLLAMA_BREAKER_FAILURE_THRESHOLD: int = 3  # ล้มเหลวติดกันกี่ครั้งจึงเปิด circuit
+    OLLAMA_BREAKER_RECOVERY_SECONDS: int = 30  # รอกี่วินาทีก่อนให้ request ทดลองผ่าน
+    OLLAMA_NUM_PREDICT: int = 12000  # จำนวน token สูงสุดของคำตอบ
+    # ขนาด num_ctx ที่เลือกได้ (เลือกขั้นเล็กสุดที่พอสำหรับ prompt + คำตอบ + headroom)
+    OLLAMA_NUM_CTX_LADDER: List[int] = [8192, 16384, 32768, 65536, 131072]
+    OLLAMA_NUM_CTX_HEADROOM: int = 1024
+    # "openai" = /v1/chat/completions, "native" = /api/chat (รองรับ keep_alive และ options ครบ)
+    OLLAMA_API_MODE: Literal["openai", "native"] = "openai"
+    OLLAMA_KEEP_ALIVE: str = "30m"  # ใช้กับ native API เท่านั้น
+    # หลาย Ollama host (JSON) เช่น [{"url": "http://gpu1:11434", "weight": 2}, {"url": "http://gpu2:11434"}]
+    # ว่าง = ใช้ OLLAMA_BASE_URL ตัวเดียว
+    OLLAMA_BACKENDS: List[OllamaBackendConfig] = []
+    OLLAMA_BACKEND_MAX_CONCURRENCY: int = 4  # request ที่ส่งไปแต่ละ host พร้อมกันได้สูงสุด
+
+    # HTTP connection pool (aiohttp TCPConnector) ที่ใช้ร่วมกันทั้งแอป
+    HTTP_POOL_LIMIT: int = 100
+    HTTP_POOL_LIMIT_PER_HOST: int = 20
+    HTTP_KEEPALIVE_SECONDS: int = 60
+    HTTP_DNS_TTL_SECONDS: int = 300
+
+    # รูปแบบข้อมูล topology ใน prompt: "full" = ทุกบรรทัด, "compact" = รวมกลุ่มอุปกรณ์ที่ซ้ำกัน,
+    # "auto" = ใช้ compact เมื่อมีอุปกรณ์ตั้งแต่ COMPACT_ENCODING_MIN_NODES ขึ้นไป
+    TOPOLOGY_ENCODING: Literal["full", "compact", "auto"] = "auto"
+    COMPACT_ENCODING_MIN_NODES: int = 50
+    CONTEXT_TOKEN_BUDGET: int = 8000  # งบ token ของข้อมูล topology แบบ compact
+
+    # การวิเคราะห์แบบแบ่งส่วน (map-reduce) สำหรับแผนผังขนาดใหญ่: "single" = prompt เดียว,
+    # "hierarchical" = แบ่งส่วนเสมอ, "auto" = แบ่งส่วนเมื่อมีอุปกรณ์ตั้งแต่ HIERARCHICAL_MIN_NODES ขึ้นไป
+    # "sectioned" = เขียน 5 หัวข้อของรายงานพร้อมกันเป็น request แยก (ต้องตั้ง OLLAMA_NUM_PARALLEL ที่ Ollama)
+    ANALYSIS_MODE: Literal["single", "sectioned", "hierarchical", "auto"] = "auto"
+    HIERARCHICAL_MIN_NODES: int = 300
+    REGION_MAX_NODES: int = 80  # จำนวนอุปกรณ์สูงสุดต่อส่วน
+    REGION_PARALLELISM: int = 2  # จำนวนส่วนที่ส่งไป Ollama พร้อมกัน
+    REGION_NUM_PREDICT: int = 1500  # คำตอบของแต่ละส่วนสั้นกว่ารายงานหลักมาก
+    SECTION_PARALLELISM: int = 5  # หัวข้อที่ส่งไป Ollama พร้อมกัน (ไม่เกิน OLLAMA_BACKEND_MAX_CONCURRENCY ต่อ host)
+    SECTION_NUM_PREDICT: int = 4000  # จำนวน token สูงสุดต่อหัวข้อ
+    SECTION_TIMEOUT_SECONDS: float = 600.0  # หัวข้อใดเกินเวลานี้จะกลับไปใช้ prompt เดียว
+
+    # วิเคราะห์ซ้ำแบบ incremental: ส่งเฉพาะส่วนที่เปลี่ยนจากการวิเคราะห์ครั้งล่าสุดของ project
+    # ถ้าสัดส่วนที่เปลี่ยน (เทียบกับจำนวนอุปกรณ์+การเชื่อมต่อเดิม) เกิน INCREMENTAL_MAX_CHANGE_RATIO จะวิเคราะห์ใหม่ทั้งหมด
+    INCREMENTAL_ANALYSIS_ENABLED: bool = True
+    INCREMENTAL_MAX_CHANGE_RATIO: float = 0.2
+    INCREMENTAL_NUM_PREDICT: int = 4000
+
+    # AI Analysis Cache (เก็บผลวิเคราะห์ของ topology เดิมไว้ใน DB)
+    ANALYSIS_CACHE_ENABLED: bool = True
+    ANALYSIS_CACHE_TTL_SECONDS: int = 7 * 24 * 3600  # 7 วัน
+    ANALYSIS_CACHE_MAX_ENTRIES: int = 500
+
+    # Analysis Job Queue (จำนวน worker = จำนวนงานที่ส่งไป Ollama พร้อมกันได้)
+    ANALYSIS_WORKER_COUNT: int = 1
+    # lease ของงานในคิว: process ที่ถืองานต่ออายุทุก 1/3 ของช่วงนี้ งานของ process ที่ตายไปจะถูกรับต่อหลัง lease หมดอายุ
+    ANALYSIS_JOB_LEASE_SECONDS: int = 60
+
+    # Scheduler ของงานวิเคราะห์: แบ่งช่องส่งงานไป Ollama อย่างเป็นธรรมระหว่างผู้ใช้ (weighted fair queueing)
+    ANALYSIS_MAX_CONCURRENT: int = 2  # งานวิเคราะห์ที่ส่งไป Ollama พร้อมกันทั้งระบบ
+    ANALYSIS_USER_MAX_CONCURRENT: int = 1  # งานที่ทำพร้อมกันได้ต่อผู้ใช้ (ที่เหลือรอคิว)
+    ANALYSIS_USER_MAX_PENDING: int = 3  # งานที่รอ+กำลังทำต่อผู้ใช้ เกินนี้ตอบ 429
+    ANALYSIS_RATE_PER_MINUTE: float = 6.0  # token bucket ต่อผู้ใช้
+    ANALYSIS_RATE_BURST: int = 3
+    ANALYSIS_USER_WEIGHTS: Dict[int, float] = {}  # น้ำหนักต่อ user id (ค่าเริ่มต้น 1.0) เช่น {"1": 2.0}
+    # ตรวจทุกกี่วินาทีว่า client ยังรอผลวิเคราะห์อยู่ (หลุดแล้วยกเลิกงานที่ Ollama)
+    DISCONNECT_POLL_SECONDS: float = 1.0
+    # บันทึกข้อความที่สร้างได้ลง ai_analysis_history ระหว่างวิเคราะห์ (ไม่หายถ้า process restart กลางทาง)
+    # เขียนเมื่อครบ ANALYSIS_CHECKPOINT_SECONDS วินาที หรือสะสมครบ ANALYSIS_CHECKPOINT_CHARS ตัวอักษร
+    ANALYSIS_CHECKPOINT_SECONDS: float = 5.0
+    ANALYSIS_CHECKPOINT_CHARS: int = 2000
+    # รายการประวัติแบบ summary ส่งเฉพาะข้อความส่วนต้นเท่านี้ (ข้อความเต็มอ่านจาก GET /api/analysis-history/{id})
+    HISTORY_EXCERPT_CHARS: int = 200
 
     class Config:
         env_file = ".env"
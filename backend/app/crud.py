@@ -1,11 +1,13 @@
-from sqlalchemy.orm import Session, joinedload
-from sqlalchemy import func, desc, and_
+from sqlalchemy.orm import Session, joinedload, load_only, with_expression
+from sqlalchemy import func, desc, and_, or_
 from typing import List, Optional, Dict, Any
 from datetime import datetime, timedelta
 import json
 
 from . import models, schemas
 from .auth import get_password_hash
+from .config import settings
+from .pagination import Keyset, keyset_page
 
 # User CRUD
 def get_user(db: Session, user_id: int):
@@ -41,6 +43,11 @@ def get_projects(db: Session, user_id: int, skip: int = 0, limit: int = 100):
         .filter(models.Project.owner_id == user_id)\
         .offset(skip).limit(limit).all()
 
+def get_projects_page(db: Session, user_id: int, after: Optional[Keyset] = None, limit: int = 100):
+    """project เรียงตามเวลาสร้าง (เก่า -> ใหม่) ต่อจาก cursor after คืนได้ถึง limit + 1 แถว"""
+    query = db.query(models.Project).filter(models.Project.owner_id == user_id)
+    return keyset_page(query, models.Project, after, limit)
+
 def get_user_projects(db: Session, owner_id: int, skip: int = 0, limit: int = 100):
     """Alias for backward compatibility"""
     return get_projects(db, owner_id, skip, limit)
@@ -105,16 +112,50 @@ def delete_project(db: Session, project_id: int, owner_id: int):
     return False
 
 # AI Analysis History CRUD
-def get_analysis_history(db: Session, user_id: int, project_id: Optional[int] = None, skip: int = 0, limit: int = 100):
+# คอลัมน์ของรายการประวัติ: ไม่โหลด topology_snapshot และไม่ join Project (diagram_data ทั้งก้อน)
+HISTORY_LIST_COLUMNS = (
+    models.AIAnalysisHistory.id,
+    models.AIAnalysisHistory.user_id,
+    models.AIAnalysisHistory.project_id,
+    models.AIAnalysisHistory.model_used,
+    models.AIAnalysisHistory.total_device_count,
+    models.AIAnalysisHistory.status,
+    models.AIAnalysisHistory.execution_time_seconds,
+    models.AIAnalysisHistory.queue_wait_seconds,
+    models.AIAnalysisHistory.prompt_tokens,
+    models.AIAnalysisHistory.completion_tokens,
+    models.AIAnalysisHistory.time_to_first_token_ms,
+    models.AIAnalysisHistory.tokens_per_second,
+    models.AIAnalysisHistory.created_at,
+)
+
+def _history_list_query(db: Session, user_id: int, project_id: Optional[int], summary: bool):
+    """summary=True: แทน analysis_result ด้วย analysis_excerpt (HISTORY_EXCERPT_CHARS ตัวอักษรแรก ตัดใน SQL)"""
     query = db.query(models.AIAnalysisHistory)\
-        .options(joinedload(models.AIAnalysisHistory.project))\
         .filter(models.AIAnalysisHistory.user_id == user_id)
-    
+
     if project_id:
         query = query.filter(models.AIAnalysisHistory.project_id == project_id)
-    
+
+    if summary:
+        excerpt = func.substr(models.AIAnalysisHistory.analysis_result, 1, settings.HISTORY_EXCERPT_CHARS)
+        return query.options(
+            load_only(*HISTORY_LIST_COLUMNS),
+            with_expression(models.AIAnalysisHistory.analysis_excerpt, excerpt)
+        )
+    return query.options(load_only(*HISTORY_LIST_COLUMNS, models.AIAnalysisHistory.analysis_result))
+
+def get_analysis_history(db: Session, user_id: int, project_id: Optional[int] = None, skip: int = 0, limit: int = 100,
+                         summary: bool = False):
+    query = _history_list_query(db, user_id, project_id, summary)
     return query.order_by(desc(models.AIAnalysisHistory.created_at)).offset(skip).limit(limit).all()
 
+def get_analysis_history_page(db: Session, user_id: int, project_id: Optional[int] = None,
+                              after: Optional[Keyset] = None, limit: int = 100, summary: bool = False):
+    """ประวัติเรียงจากล่าสุด ต่อจาก cursor after คืนได้ถึง limit + 1 แถว"""
+    query = _history_list_query(db, user_id, project_id, summary)
+    return keyset_page(query, models.AIAnalysisHistory, after, limit, descending=True)
+
 def create_analysis_history(db: Session, analysis: schemas.AIAnalysisHistoryCreate, user_id: int):
     analysis_data = analysis.dict()
     db_analysis = models.AIAnalysisHistory(**analysis_data, user_id=user_id)
@@ -123,9 +164,69 @@ def create_analysis_history(db: Session, analysis: schemas.AIAnalysisHistoryCrea
     db.refresh(db_analysis)
     return db_analysis
 
+def update_analysis_history(db: Session, analysis_id: int, analysis: schemas.AIAnalysisHistoryCreate):
+    """เขียนผลสุดท้ายทับแถวที่สร้างไว้ตอนเริ่มวิเคราะห์ (สถานะ running)"""
+    db.query(models.AIAnalysisHistory)\
+        .filter(models.AIAnalysisHistory.id == analysis_id)\
+        .update(analysis.dict(), synchronize_session=False)
+    db.commit()
+    return db.query(models.AIAnalysisHistory).filter(models.AIAnalysisHistory.id == analysis_id).first()
+
+def append_analysis_text(db: Session, analysis_id: int, text: str):
+    """ต่อท้ายข้อความที่สร้างได้ของการวิเคราะห์ที่ยังทำงานอยู่ (checkpoint)"""
+    db.query(models.AIAnalysisHistory)\
+        .filter(and_(models.AIAnalysisHistory.id == analysis_id, models.AIAnalysisHistory.status == "running"))\
+        .update(
+            {models.AIAnalysisHistory.analysis_result: models.AIAnalysisHistory.analysis_result + text},
+            synchronize_session=False
+        )
+    db.commit()
+
+def update_running_analysis_status(db: Session, analysis_id: int, status: str):
+    db.query(models.AIAnalysisHistory)\
+        .filter(and_(models.AIAnalysisHistory.id == analysis_id, models.AIAnalysisHistory.status == "running"))\
+        .update({"status": status}, synchronize_session=False)
+    db.commit()
+
+def touch_running_analysis(db: Session, analysis_id: int) -> bool:
+    """heartbeat ของการวิเคราะห์ที่ยังทำงานอยู่ (คืน False ถ้าแถวไม่ใช่ running แล้ว)"""
+    touched = db.query(models.AIAnalysisHistory)\
+        .filter(and_(models.AIAnalysisHistory.id == analysis_id, models.AIAnalysisHistory.status == "running"))\
+        .update({"updated_at": models.bangkok_now()}, synchronize_session=False)
+    db.commit()
+    return touched == 1
+
+def mark_analyses_interrupted(db: Session, stale_before: datetime) -> int:
+    """แถว running ที่ไม่ถูกแตะตั้งแต่ stale_before (process ที่ทำอยู่หยุดกลางทาง) เปลี่ยนเป็น interrupted คืนจำนวนแถว"""
+    count = db.query(models.AIAnalysisHistory)\
+        .filter(and_(
+            models.AIAnalysisHistory.status == "running",
+            or_(models.AIAnalysisHistory.updated_at.is_(None), models.AIAnalysisHistory.updated_at < stale_before)
+        ))\
+        .update({"status": "interrupted"}, synchronize_session=False)
+    db.commit()
+    return count
+
+def get_latest_analysis_snapshot(db: Session, user_id: int, project_id: Optional[int]):
+    """การวิเคราะห์เต็มที่สำเร็จครั้งล่าสุดของ project ที่มี topology_snapshot (ฐานของ incremental re-analysis)
+
+    ไม่นับผลแบบ incremental (base_analysis_id): ทุกครั้งเทียบกับรายงานเต็มฉบับเดียวกัน
+    การเปลี่ยนแปลงสะสมจึงเกิน INCREMENTAL_MAX_CHANGE_RATIO ได้ และวิเคราะห์เต็มใหม่เมื่อถึงจุดนั้น
+    """
+    if project_id is None:
+        return None
+    return db.query(models.AIAnalysisHistory)\
+        .filter(and_(
+            models.AIAnalysisHistory.user_id == user_id,
+            models.AIAnalysisHistory.project_id == project_id,
+            models.AIAnalysisHistory.topology_snapshot.isnot(None),
+            models.AIAnalysisHistory.base_analysis_id.is_(None)
+        ))\
+        .order_by(desc(models.AIAnalysisHistory.created_at), desc(models.AIAnalysisHistory.id))\
+        .first()
+
 def get_analysis_by_id(db: Session, analysis_id: int, user_id: int):
     return db.query(models.AIAnalysisHistory)\
-        .options(joinedload(models.AIAnalysisHistory.project))\
         .filter(and_(models.AIAnalysisHistory.id == analysis_id, models.AIAnalysisHistory.user_id == user_id))\
         .first()
 
@@ -147,12 +248,185 @@ def delete_all_analysis_history(db: Session, user_id: int, project_id: Optional[
     db.commit()
     return count
 
+# AI Analysis Job CRUD
+def create_analysis_job(db: Session, request: schemas.AIAnalysisRequest, user_id: int,
+                        lease_owner: Optional[str] = None, lease_expires_at: Optional[datetime] = None):
+    db_job = models.AIAnalysisJob(
+        user_id=user_id,
+        project_id=request.project_id,
+        status="queued",
+        request_data={"nodes": request.nodes, "edges": request.edges},
+        lease_owner=lease_owner,
+        lease_expires_at=lease_expires_at
+    )
+    db.add(db_job)
+    db.commit()
+    db.refresh(db_job)
+    return db_job
+
+def get_analysis_job(db: Session, job_id: int, user_id: Optional[int] = None, load_analysis: bool = False):
+    query = db.query(models.AIAnalysisJob).filter(models.AIAnalysisJob.id == job_id)
+    if load_analysis:
+        # โหลดผลวิเคราะห์พร้อมกัน (job ถูกใช้หลังปิด session จึง lazy load ไม่ได้)
+        query = query.options(joinedload(models.AIAnalysisJob.analysis))
+    if user_id is not None:
+        query = query.filter(models.AIAnalysisJob.user_id == user_id)
+    return query.first()
 
+def get_analysis_job_queue_position(db: Session, job: models.AIAnalysisJob):
+    """ลำดับในคิว (1 = งานถัดไป) หรือ None ถ้าไม่ได้อยู่ในคิว"""
+    if job.status != "queued":
+        return None
+    ahead = db.query(func.count(models.AIAnalysisJob.id))\
+        .filter(and_(models.AIAnalysisJob.status == "queued", models.AIAnalysisJob.id < job.id))\
+        .scalar()
+    return ahead + 1
+
+def update_analysis_job(db: Session, job_id: int, **fields):
+    db.query(models.AIAnalysisJob).filter(models.AIAnalysisJob.id == job_id).update(fields)
+    db.commit()
+
+def claim_analysis_job(db: Session, job_id: int, owner: str) -> bool:
+    """เปลี่ยนงาน queued ที่ owner ถือ lease เป็น running (คืน False ถ้ามี worker อื่นรับงานนี้ไปแล้ว)"""
+    claimed = db.query(models.AIAnalysisJob)\
+        .filter(and_(
+            models.AIAnalysisJob.id == job_id,
+            models.AIAnalysisJob.status == "queued",
+            models.AIAnalysisJob.lease_owner == owner
+        ))\
+        .update({"status": "running", "started_at": models.bangkok_now()}, synchronize_session=False)
+    db.commit()
+    return claimed == 1
+
+# AI Analysis Job leases: API server และ batch_analyze.py ใช้ตารางงานเดียวกัน
+# process รับงานได้เฉพาะงานที่ไม่มี lease หรือ lease หมดอายุแล้ว (process เดิมหยุดไปโดยไม่ได้คืนงาน)
+def _analysis_job_lease_expired():
+    return or_(
+        models.AIAnalysisJob.lease_owner.is_(None),
+        models.AIAnalysisJob.lease_expires_at.is_(None),
+        models.AIAnalysisJob.lease_expires_at < models.bangkok_now()
+    )
+
+def lease_unfinished_analysis_jobs(db: Session, owner: str, expires_at: datetime,
+                                   batch_id: Optional[int] = None) -> int:
+    """รับ lease ของงานที่ยังไม่เสร็จ (ทั้งหมด หรือเฉพาะ batch_id) ที่ไม่มี process อื่นถืออยู่
+
+    งาน running ที่ lease หมดอายุถูกขัดจังหวะกลางทาง จึงกลับเป็น queued ก่อน
+    งานที่ process อื่นยังต่ออายุ lease อยู่ (เช่น batch_analyze.py ที่กำลังทำงาน) ถูกข้าม คืนจำนวนงานที่ได้ lease
+    """
+    Job = models.AIAnalysisJob
+    scope = [Job.batch_id == batch_id] if batch_id is not None else []
+    db.query(Job)\
+        .filter(and_(Job.status == "running", _analysis_job_lease_expired(), *scope))\
+        .update({"status": "queued", "started_at": None}, synchronize_session=False)
+    leased = db.query(Job)\
+        .filter(and_(Job.status == "queued", or_(_analysis_job_lease_expired(), Job.lease_owner == owner), *scope))\
+        .update({"lease_owner": owner, "lease_expires_at": expires_at}, synchronize_session=False)
+    db.commit()
+    return leased
+
+def iter_leased_job_ids(db: Session, owner: str, batch_id: Optional[int] = None, chunk_size: int = 500):
+    """id ของงาน queued ที่ owner ถือ lease (ทีละ chunk ตามลำดับ id)"""
+    query = db.query(models.AIAnalysisJob.id)\
+        .filter(and_(models.AIAnalysisJob.status == "queued", models.AIAnalysisJob.lease_owner == owner))
+    if batch_id is not None:
+        query = query.filter(models.AIAnalysisJob.batch_id == batch_id)
+    return query.order_by(models.AIAnalysisJob.id).yield_per(chunk_size)
+
+def renew_analysis_job_leases(db: Session, owner: str, expires_at: datetime) -> int:
+    """ต่ออายุ lease ของงาน queued/running ทั้งหมดที่ owner ถืออยู่"""
+    renewed = db.query(models.AIAnalysisJob)\
+        .filter(and_(
+            models.AIAnalysisJob.lease_owner == owner,
+            models.AIAnalysisJob.status.in_(["queued", "running"])
+        ))\
+        .update({"lease_expires_at": expires_at}, synchronize_session=False)
+    db.commit()
+    return renewed
+
+def release_analysis_job_leases(db: Session, owner: str) -> int:
+    """คืน lease ของงาน queued ที่ owner ถืออยู่ (ปิดคิว) ให้ process อื่นรับต่อได้ทันที"""
+    released = db.query(models.AIAnalysisJob)\
+        .filter(and_(models.AIAnalysisJob.lease_owner == owner, models.AIAnalysisJob.status == "queued"))\
+        .update({"lease_owner": None, "lease_expires_at": None}, synchronize_session=False)
+    db.commit()
+    return released
+
+# AI Analysis Batch CRUD
+def iter_project_ids(db: Session, owner_id: Optional[int] = None, project_ids: Optional[List[int]] = None,
+                     chunk_size: int = 500):
+    """(project id, owner id) ทีละ chunk ตามลำดับ id โดยไม่โหลด diagram_data"""
+    query = db.query(models.Project.id, models.Project.owner_id)
+    if owner_id is not None:
+        query = query.filter(models.Project.owner_id == owner_id)
+    if project_ids is not None:
+        query = query.filter(models.Project.id.in_(project_ids))
+    return query.order_by(models.Project.id).yield_per(chunk_size)
+
+def create_analysis_batch(db: Session, user_id: Optional[int], projects, chunk_size: int = 500):
+    """สร้าง batch พร้อมงานหนึ่งงานต่อ project (projects = iterable ของ (project id, owner id))
+
+    เพิ่มงานเป็นชุดละ chunk_size แถว จึงไม่ต้องถือรายการ project ทั้งหมดไว้ในหน่วยความจำ
+    """
+    batch = models.AIAnalysisBatch(user_id=user_id, total_jobs=0)
+    db.add(batch)
+    db.flush()
+    rows = []
+    for project_id, owner_id in projects:
+        rows.append({
+            "batch_id": batch.id,
+            "user_id": owner_id,
+            "project_id": project_id,
+            "status": "queued",
+            "request_data": {},
+            "created_at": models.bangkok_now()
+        })
+        if len(rows) >= chunk_size:
+            db.bulk_insert_mappings(models.AIAnalysisJob, rows)
+            batch.total_jobs += len(rows)
+            rows = []
+    if rows:
+        db.bulk_insert_mappings(models.AIAnalysisJob, rows)
+        batch.total_jobs += len(rows)
+    db.commit()
+    db.refresh(batch)
+    return batch
+
+def get_analysis_batch(db: Session, batch_id: int, user_id: Optional[int] = None):
+    query = db.query(models.AIAnalysisBatch).filter(models.AIAnalysisBatch.id == batch_id)
+    if user_id is not None:
+        query = query.filter(models.AIAnalysisBatch.user_id == user_id)
+    return query.first()
+
+def count_batch_jobs_by_status(db: Session, batch_id: int) -> Dict[str, int]:
+    rows = db.query(models.AIAnalysisJob.status, func.count(models.AIAnalysisJob.id))\
+        .filter(models.AIAnalysisJob.batch_id == batch_id)\
+        .group_by(models.AIAnalysisJob.status)\
+        .all()
+    return {status: count for status, count in rows}
+
+def requeue_batch_jobs(db: Session, batch_id: int, statuses: List[str]) -> int:
+    """คืนงานของ batch ที่จบแล้วด้วยสถานะใน statuses (เช่น failed) กลับเป็น queued แบบไม่มี lease (ใช้ resume)
+
+    งาน running ไม่ส่งผ่านที่นี่: process ที่ทำงานนั้นอาจยังอยู่ lease_unfinished_analysis_jobs รับต่อเมื่อ lease หมดอายุ
+    """
+    count = db.query(models.AIAnalysisJob)\
+        .filter(and_(models.AIAnalysisJob.batch_id == batch_id, models.AIAnalysisJob.status.in_(statuses)))\
+        .update(
+            {"status": "queued", "started_at": None, "finished_at": None, "error": None,
+             "lease_owner": None, "lease_expires_at": None},
+            synchronize_session=False
+        )
+    db.commit()
+    return count
 
 # Legacy functions for backward compatibility
 def update_user_password(db: Session, user_id: int, new_password: str):
     """Update user password"""
-    hashed_password = get_password_hash(new_password)
+    return set_user_password_hash(db, user_id, get_password_hash(new_password))
+
+def set_user_password_hash(db: Session, user_id: int, hashed_password: str):
+    """เขียน hash ที่คำนวณไว้แล้ว (route แบบ async hash นอก DB thread pool)"""
     db.query(models.User).filter(models.User.id == user_id).update({
         'hashed_password': hashed_password
     })
@@ -1,11 +1,67 @@
-from sqlalchemy import create_engine
+from typing import Any, Dict
+from sqlalchemy import create_engine, event
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from .config import settings
 
 SQLALCHEMY_DATABASE_URL = settings.DATABASE_URL
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
+
+def sqlite_pragmas(profile: str = settings.SQLITE_PROFILE) -> Dict[str, Any]:
+    """pragma ที่ตั้งให้ทุก connection ของ SQLite ตาม storage profile
+
+    "default" = ค่าเดิมของ SQLite (rollback journal, synchronous=FULL, ไม่มี busy timeout)
+    "tuned" = WAL ให้อ่านระหว่างมีการเขียนได้, synchronous=NORMAL (ปลอดภัยกับ WAL ยกเว้นไฟดับ
+    อาจเสีย transaction ล่าสุด), busy_timeout รอ lock แทนการ error "database is locked" ทันที
+    """
+    if profile == "default":
+        return {}
+    return {
+        "journal_mode": settings.SQLITE_JOURNAL_MODE,
+        "synchronous": settings.SQLITE_SYNCHRONOUS,
+        "busy_timeout": settings.SQLITE_BUSY_TIMEOUT_MS,
+        "mmap_size": settings.SQLITE_MMAP_SIZE,
+        "cache_size": settings.SQLITE_CACHE_SIZE,
+        "temp_store": settings.SQLITE_TEMP_STORE,
+    }
+
+
+def create_db_engine(url: str = SQLALCHEMY_DATABASE_URL, profile: str = settings.SQLITE_PROFILE):
+    """สร้าง engine พร้อม connection pool สำหรับหลาย thread (DB thread pool, CLI) และ pragma ของ SQLite"""
+    if not url.startswith("sqlite"):
+        return create_engine(
+            url,
+            pool_size=settings.DB_POOL_SIZE,
+            max_overflow=settings.DB_POOL_MAX_OVERFLOW,
+            pool_timeout=settings.DB_POOL_TIMEOUT_SECONDS,
+            pool_pre_ping=True
+        )
+
+    options: Dict[str, Any] = {}
+    if ":memory:" not in url and url.rstrip("/") not in ("sqlite:", "sqlite+pysqlite:"):
+        # ไฟล์ SQLite ใช้ QueuePool (connection ถูกส่งต่อระหว่าง thread ได้ตั้งแต่ SQLAlchemy 2.0)
+        options.update(
+            pool_size=settings.DB_POOL_SIZE,
+            max_overflow=settings.DB_POOL_MAX_OVERFLOW,
+            pool_timeout=settings.DB_POOL_TIMEOUT_SECONDS
+        )
+    engine = create_engine(url, **options)
+
+    pragmas = sqlite_pragmas(profile)
+    if pragmas:
+        @event.listens_for(engine, "connect")
+        def _apply_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            try:
+                for name, value in pragmas.items():
+                    cursor.execute(f"PRAGMA {name}={value}")
+            finally:
+                cursor.close()
+
+    return engine
+
+
+engine = create_db_engine()
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
@@ -15,4 +71,4 @@ def get_db():
     try:
         yield db
     finally:
-        db.close() 
\ No newline at end of file
+        db.close()
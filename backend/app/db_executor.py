@@ -0,0 +1,65 @@
+import asyncio
+import functools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional, TypeVar
+
+from .config import settings
+from .database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class DatabaseExecutor:
+    """thread pool ขนาดจำกัดสำหรับงาน DB แบบ sync (SQLAlchemy Session) ของ route ที่เป็น async
+
+    การ commit diagram_data ขนาดใหญ่หรือรอ lock ของ SQLite จึงไม่หยุด event loop
+    (stream token, health check และ request อื่นยังทำงานต่อได้)
+    จำนวน thread = DB_THREAD_POOL_SIZE ไม่ควรเกินขนาด connection pool ของ engine
+    """
+
+    def __init__(self, max_workers: int = settings.DB_THREAD_POOL_SIZE):
+        self.max_workers = max(1, max_workers)
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        # สร้างเมื่อใช้ครั้งแรก (และสร้างใหม่ได้หลัง shutdown เช่นงานที่ยังค้างตอนปิดระบบ)
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="db")
+        return self._executor
+
+    async def call(self, fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """เรียก fn ที่จัดการ session เองใน DB thread"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._get_executor(), functools.partial(fn, *args, **kwargs))
+
+    async def run(self, fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """เรียก fn(db, *args, **kwargs) ใน DB thread ด้วย session ใหม่ที่ปิดใน thread เดียวกัน
+
+        ORM object ที่คืนมาถูก detach แล้ว: อ่านได้เฉพาะ attribute ที่โหลดไว้ (relationship ต้องโหลดใน fn)
+        """
+        return await self.call(self._with_session, fn, args, kwargs)
+
+    @staticmethod
+    def _with_session(fn: Callable[..., T], args, kwargs) -> T:
+        db = SessionLocal()
+        try:
+            return fn(db, *args, **kwargs)
+        except BaseException:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+
+# Global instance
+db_executor = DatabaseExecutor()
+run_db = db_executor.run
+run_in_db_thread = db_executor.call
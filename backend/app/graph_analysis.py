@@ -0,0 +1,398 @@
+from collections import deque
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from .topology_encoding import format_mbps, to_mbps
+
+# จำนวนรายการสูงสุดต่อหัวข้อที่ใส่ลงใน prompt (facts ที่คืนใน response ยังครบทุกรายการ)
+MAX_PROMPT_ITEMS = 20
+
+
+class TopologyGraph:
+    """Adjacency list แบบไม่มีทิศของ topology สร้างครั้งเดียวจาก nodes/edges ของ request"""
+
+    def __init__(self, nodes: List[Dict], edges: List[Dict]):
+        self.data: Dict[Any, Dict[str, Any]] = {}
+        for node in nodes:
+            self.data[node.get("id")] = node.get("data") or {}
+        self.adj: Dict[Any, List[Any]] = {node_id: [] for node_id in self.data}
+        # bandwidth (Mbps) ของแต่ละคู่; parallel edges นับรวมกัน
+        self.link_mbps: Dict[Tuple[Any, Any], Optional[float]] = {}
+        self.link_count: Dict[Tuple[Any, Any], int] = {}
+        for edge in edges:
+            source, target = edge.get("source"), edge.get("target")
+            if source not in self.adj or target not in self.adj or source == target:
+                continue
+            key = self.pair(source, target)
+            data = edge.get("data") or {}
+            mbps = to_mbps(data.get("bandwidth"), data.get("bandwidthUnit"))
+            if key not in self.link_count:
+                self.adj[source].append(target)
+                self.adj[target].append(source)
+                self.link_count[key] = 0
+                self.link_mbps[key] = None
+            self.link_count[key] += 1
+            if mbps is not None:
+                self.link_mbps[key] = (self.link_mbps[key] or 0.0) + mbps
+
+    @staticmethod
+    def pair(a: Any, b: Any) -> Tuple[Any, Any]:
+        return (a, b) if str(a) <= str(b) else (b, a)
+
+    def label(self, node_id: Any) -> str:
+        return str(self.data.get(node_id, {}).get("label", node_id))
+
+    def device_type(self, node_id: Any) -> str:
+        return str(self.data.get(node_id, {}).get("deviceType", "Unknown"))
+
+    def users(self, node_id: Any) -> int:
+        try:
+            return int(self.data.get(node_id, {}).get("userCapacity") or 0)
+        except (TypeError, ValueError):
+            return 0
+
+    def is_isp(self, node_id: Any) -> bool:
+        return self.device_type(node_id).lower() == "isp"
+
+
+def connected_components(graph: TopologyGraph) -> List[List[Any]]:
+    seen: Set[Any] = set()
+    components = []
+    for start in graph.adj:
+        if start in seen:
+            continue
+        seen.add(start)
+        component = [start]
+        queue = deque([start])
+        while queue:
+            current = queue.popleft()
+            for neighbor in graph.adj[current]:
+                if neighbor not in seen:
+                    seen.add(neighbor)
+                    component.append(neighbor)
+                    queue.append(neighbor)
+        components.append(component)
+    return components
+
+
+def articulation_points_and_bridges(graph: TopologyGraph) -> Tuple[List[Any], List[Tuple[Any, Any]]]:
+    """Tarjan (iterative DFS) หา articulation points (SPOF อุปกรณ์) และ bridges (SPOF สาย) ใน O(V+E)
+
+    parallel edges ระหว่างคู่เดียวกันถือเป็น redundancy จึงไม่นับเป็น bridge
+    """
+    disc: Dict[Any, int] = {}
+    low: Dict[Any, int] = {}
+    points: Set[Any] = set()
+    bridges: List[Tuple[Any, Any]] = []
+    timer = 0
+
+    for root in graph.adj:
+        if root in disc:
+            continue
+        disc[root] = low[root] = timer
+        timer += 1
+        root_children = 0
+        # stack ของ (node, parent, iterator ของเพื่อนบ้าน)
+        stack = [(root, None, iter(graph.adj[root]))]
+        while stack:
+            node, parent, neighbors = stack[-1]
+            advanced = False
+            for neighbor in neighbors:
+                if neighbor == parent:
+                    continue
+                if neighbor in disc:
+                    low[node] = min(low[node], disc[neighbor])
+                    continue
+                disc[neighbor] = low[neighbor] = timer
+                timer += 1
+                if node == root:
+                    root_children += 1
+                stack.append((neighbor, node, iter(graph.adj[neighbor])))
+                advanced = True
+                break
+            if advanced:
+                continue
+            stack.pop()
+            if parent is not None:
+                low[parent] = min(low[parent], low[node])
+                if low[node] > disc[parent] and graph.link_count[graph.pair(parent, node)] == 1:
+                    bridges.append((parent, node))
+                if parent != root and low[node] >= disc[parent]:
+                    points.add(parent)
+        if root_children > 1:
+            points.add(root)
+
+    ordered_points = [node_id for node_id in graph.adj if node_id in points]
+    return ordered_points, bridges
+
+
+def _isp_forest(graph: TopologyGraph, isps: List[Any]) -> Tuple[Dict[Any, int], Dict[Any, Any], List[Any]]:
+    """BFS หลายจุดเริ่มจาก ISP: คืน (hop depth, parent ใน BFS tree, ลำดับการเยี่ยม)"""
+    depth: Dict[Any, int] = {}
+    parent: Dict[Any, Any] = {}
+    order: List[Any] = []
+    queue = deque()
+    for isp in isps:
+        depth[isp] = 0
+        queue.append(isp)
+    while queue:
+        current = queue.popleft()
+        order.append(current)
+        for neighbor in graph.adj[current]:
+            if neighbor not in depth:
+                depth[neighbor] = depth[current] + 1
+                parent[neighbor] = current
+                queue.append(neighbor)
+    return depth, parent, order
+
+
+def analyze_topology(nodes: List[Dict], edges: List[Dict]) -> Dict[str, Any]:
+    """คำนวณข้อเท็จจริงเชิงกราฟของ topology (ทั้งหมด O(V+E))
+
+    ผลลัพธ์เป็น dict ที่ serialize เป็น JSON ได้ ใช้ทั้งใส่ใน prompt และคืนใน response
+    """
+    graph = TopologyGraph(nodes, edges)
+    components = connected_components(graph)
+    points, bridges = articulation_points_and_bridges(graph)
+    isps = [node_id for node_id in graph.adj if graph.is_isp(node_id)]
+    depth, tree_parent, order = _isp_forest(graph, isps)
+
+    facts: Dict[str, Any] = {
+        "device_count": len(graph.adj),
+        "link_count": len(graph.link_count),
+        "components": [sorted(graph.label(n) for n in component) for component in components],
+        "articulation_points": [
+            {"id": n, "label": graph.label(n), "device_type": graph.device_type(n)} for n in points
+        ],
+        "bridges": [
+            {"from": graph.label(a), "to": graph.label(b)} for a, b in bridges
+        ],
+        "isp_nodes": [graph.label(n) for n in isps],
+        "hop_depth": {graph.label(n): d for n, d in depth.items()},
+        "max_hop_depth": max(depth.values()) if depth else None,
+        "unreachable_from_isp": [graph.label(n) for n in graph.adj if isps and n not in depth],
+        "links": [],
+        "isp_uplink": None,
+    }
+    if not isps:
+        return facts
+
+    # รวมจำนวนผู้ใช้ใน subtree (ย้อนลำดับ BFS = ลูกก่อนพ่อ)
+    downstream_users = {node_id: graph.users(node_id) for node_id in depth}
+    downstream_devices = {node_id: 1 for node_id in depth}
+    for node_id in reversed(order):
+        parent = tree_parent.get(node_id)
+        if parent is not None:
+            downstream_users[parent] += downstream_users[node_id]
+            downstream_devices[parent] += downstream_devices[node_id]
+
+    # bandwidth รวมของสายที่ต่อลงไปจากแต่ละอุปกรณ์ (ใช้หา oversubscription)
+    child_link_mbps: Dict[Any, float] = {}
+    for child, parent in tree_parent.items():
+        mbps = graph.link_mbps.get(graph.pair(parent, child))
+        if mbps:
+            child_link_mbps[parent] = child_link_mbps.get(parent, 0.0) + mbps
+
+    links = []
+    for child in order:
+        parent = tree_parent.get(child)
+        if parent is None:
+            continue
+        mbps = graph.link_mbps.get(graph.pair(parent, child))
+        users = downstream_users[child]
+        below = child_link_mbps.get(child)
+        links.append({
+            "from": graph.label(parent),
+            "to": graph.label(child),
+            "bandwidth_mbps": mbps,
+            "downstream_devices": downstream_devices[child],
+            "downstream_users": users,
+            "mbps_per_user": round(mbps / users, 2) if mbps and users else None,
+            "downstream_link_mbps": below,
+            "oversubscription": round(below / mbps, 2) if mbps and below else None,
+        })
+    facts["links"] = links
+
+    isp_mbps = sum(
+        graph.link_mbps.get(graph.pair(isp, neighbor)) or 0.0
+        for isp in isps for neighbor in graph.adj[isp]
+    )
+    total_users = sum(graph.users(node_id) for node_id in graph.adj)
+    facts["isp_uplink"] = {
+        "bandwidth_mbps": isp_mbps or None,
+        "total_users": total_users,
+        "mbps_per_user": round(isp_mbps / total_users, 2) if isp_mbps and total_users else None,
+    }
+    return facts
+
+
+def format_facts(facts: Dict[str, Any]) -> str:
+    """แปลง facts เป็นข้อความกระชับสำหรับใส่ใน prompt"""
+    lines = [
+        "ข้อเท็จจริงที่คำนวณจากกราฟแล้ว (ถูกต้องแน่นอน ใช้ได้ทันทีไม่ต้องคำนวณซ้ำ):",
+        f"- จำนวนกลุ่มที่เชื่อมถึงกัน (connected components): {len(facts['components'])}",
+    ]
+    if len(facts["components"]) > 1:
+        for component in facts["components"][:MAX_PROMPT_ITEMS]:
+            lines.append(f"  - {', '.join(component[:MAX_PROMPT_ITEMS])}")
+
+    points = facts["articulation_points"]
+    lines.append(
+        "- อุปกรณ์ที่เป็น Single Point of Failure (articulation point): "
+        + (", ".join(f"{p['label']} ({p['device_type']})" for p in points[:MAX_PROMPT_ITEMS]) if points else "ไม่มี")
+    )
+    bridges = facts["bridges"]
+    lines.append(
+        f"- สายที่ไม่มีเส้นทางสำรอง (bridge) {len(bridges)} เส้น"
+        + (": " + ", ".join(f"{b['from']}-{b['to']}" for b in bridges[:MAX_PROMPT_ITEMS]) if bridges else "")
+        + (" ..." if len(bridges) > MAX_PROMPT_ITEMS else "")
+    )
+
+    if not facts["isp_nodes"]:
+        lines.append("- ไม่พบอุปกรณ์ ISP ในแผนผัง")
+        return "\n".join(lines)
+
+    lines.append(f"- ISP: {', '.join(facts['isp_nodes'])}, จำนวน hop สูงสุดจาก ISP: {facts['max_hop_depth']}")
+    if facts["unreachable_from_isp"]:
+        lines.append(f"- อุปกรณ์ที่ไปไม่ถึง ISP: {', '.join(facts['unreachable_from_isp'][:MAX_PROMPT_ITEMS])}")
+
+    uplink = facts["isp_uplink"]
+    if uplink and uplink["bandwidth_mbps"]:
+        line = f"- Bandwidth จาก ISP รวม {format_mbps(uplink['bandwidth_mbps'])} สำหรับผู้ใช้ {uplink['total_users']} คน"
+        if uplink["mbps_per_user"] is not None:
+            line += f" (~{uplink['mbps_per_user']} Mbps/คน)"
+        lines.append(line)
+
+    # แสดงเฉพาะสายที่มีข้อมูลและน่าสนใจที่สุด (oversubscription สูง หรือ bandwidth ต่อคนต่ำ)
+    interesting = [link for link in facts["links"] if link["bandwidth_mbps"] and (link["downstream_users"] or link["oversubscription"])]
+    interesting.sort(key=lambda link: (-(link["oversubscription"] or 0), link["mbps_per_user"] or float("inf")))
+    if interesting:
+        lines.append("- Bandwidth ของสายเทียบกับความต้องการด้านล่าง (เรียงจากเสี่ยงมากไปน้อย):")
+        for link in interesting[:MAX_PROMPT_ITEMS]:
+            detail = f"  - {link['from']} -> {link['to']}: {format_mbps(link['bandwidth_mbps'])}"
+            detail += f", อุปกรณ์ด้านล่าง {link['downstream_devices']}, ผู้ใช้ด้านล่าง {link['downstream_users']}"
+            if link["mbps_per_user"] is not None:
+                detail += f" (~{link['mbps_per_user']} Mbps/คน)"
+            if link["oversubscription"]:
+                detail += f", สายขาลงรวม {format_mbps(link['downstream_link_mbps'])} (oversubscription {link['oversubscription']}:1)"
+            lines.append(detail)
+    return "\n".join(lines)
+
+
+def _tree_from_root(graph: TopologyGraph, root: Any) -> Tuple[Dict[Any, List[Any]], Dict[Any, int]]:
+    """BFS tree จาก root: คืน (children ของแต่ละ node, ขนาด subtree)"""
+    _, parent, order = _isp_forest(graph, [root])
+    children: Dict[Any, List[Any]] = {node_id: [] for node_id in order}
+    for node_id in order:
+        if node_id in parent:
+            children[parent[node_id]].append(node_id)
+    size = {node_id: 1 for node_id in order}
+    for node_id in reversed(order):
+        if node_id in parent:
+            size[parent[node_id]] += size[node_id]
+    return children, size
+
+
+def partition_topology(nodes: List[Dict], edges: List[Dict], max_region_nodes: int) -> List[Dict[str, Any]]:
+    """แบ่ง topology เป็นส่วน (region) สำหรับการวิเคราะห์แบบ map-reduce
+
+    - connected component ที่เล็กพอเป็นหนึ่งส่วน
+    - component ใหญ่ใช้ BFS tree จาก ISP (หรืออุปกรณ์ที่มีการเชื่อมต่อมากที่สุด) แล้วไล่ลงจากบนสุด
+      จนเจอ subtree ที่ไม่เกิน max_region_nodes (เช่น distribution switch กับอุปกรณ์ด้านล่าง)
+      subtree เล็กๆ ใต้อุปกรณ์เดียวกันถูกรวมเป็นส่วนเดียวจนเต็ม max_region_nodes
+    - อุปกรณ์ด้านบนที่ถูกแตกออก (core/edge) กับสายที่ข้ามระหว่างส่วน รวมเป็นส่วน "โครงข่ายหลัก"
+
+    แต่ละส่วนคืน {"name", "nodes", "edges"} โดย nodes/edges เป็น dict เดิมจาก request
+    ส่วนย่อยมีอุปกรณ์แม่ (uplink) ติดไปด้วยเพื่อให้เห็น bandwidth ขาขึ้น
+    """
+    graph = TopologyGraph(nodes, edges)
+    node_by_id = {node.get("id"): node for node in nodes}
+    max_region_nodes = max(2, max_region_nodes)
+
+    regions: List[Dict[str, Any]] = []  # {"name", "members", "uplink"}
+    backbone: Set[Any] = set()
+
+    for index, component in enumerate(connected_components(graph), start=1):
+        if len(component) <= max_region_nodes:
+            regions.append({"name": f"กลุ่มที่ {index}", "members": list(component), "uplink": None})
+            continue
+        isps = [node_id for node_id in component if graph.is_isp(node_id)]
+        root = isps[0] if isps else max(component, key=lambda node_id: len(graph.adj[node_id]))
+        children, size = _tree_from_root(graph, root)
+
+        stack = [root]
+        while stack:
+            node_id = stack.pop()
+            backbone.add(node_id)
+            pack: List[Any] = []
+            pack_size = 0
+
+            def flush():
+                if not pack:
+                    return
+                names = ", ".join(graph.label(child) for child in pack[:3]) + (", ..." if len(pack) > 3 else "")
+                members = []
+                for child in pack:
+                    members.extend(_subtree(children, child))
+                regions.append({"name": f"{graph.label(node_id)} -> {names}", "members": members, "uplink": node_id})
+
+            for child in children[node_id]:
+                if size[child] > max_region_nodes:
+                    stack.append(child)
+                    continue
+                if pack_size + size[child] > max_region_nodes:
+                    flush()
+                    pack, pack_size = [], 0
+                pack.append(child)
+                pack_size += size[child]
+            flush()
+
+    region_of: Dict[Any, int] = {}
+    for index, region in enumerate(regions):
+        for node_id in region["members"]:
+            region_of[node_id] = index
+
+    result = []
+    for index, region in enumerate(regions):
+        members = set(region["members"])
+        scope = members | ({region["uplink"]} if region["uplink"] is not None else set())
+        region_edges = [
+            edge for edge in edges
+            if edge.get("source") in scope and edge.get("target") in scope
+            and (edge.get("source") in members or edge.get("target") in members)
+        ]
+        ordered = [node_id for node_id in graph.adj if node_id in scope]
+        result.append({
+            "name": region["name"],
+            "nodes": [node_by_id[node_id] for node_id in ordered],
+            "edges": region_edges,
+        })
+
+    if backbone:
+        # สายทุกเส้นที่ไม่ได้อยู่ภายในส่วนเดียว: สายระหว่างอุปกรณ์หลัก, สาย uplink ลงไปยังแต่ละส่วน
+        # และสายที่ข้ามระหว่างส่วน (เช่น redundant link)
+        backbone_edges = []
+        scope = set(backbone)
+        for edge in edges:
+            source, target = edge.get("source"), edge.get("target")
+            if source not in graph.adj or target not in graph.adj:
+                continue
+            if source in region_of and region_of.get(target) == region_of[source]:
+                continue
+            backbone_edges.append(edge)
+            scope.update((source, target))
+        result.insert(0, {
+            "name": "โครงข่ายหลัก (Core/Backbone)",
+            "nodes": [node_by_id[node_id] for node_id in graph.adj if node_id in scope],
+            "edges": backbone_edges,
+        })
+    return result
+
+
+def _subtree(children: Dict[Any, List[Any]], root: Any) -> List[Any]:
+    members = []
+    stack = [root]
+    while stack:
+        node_id = stack.pop()
+        members.append(node_id)
+        stack.extend(children[node_id])
+    return members
@@ -0,0 +1,182 @@
+import asyncio
+import logging
+import weakref
+from typing import Any, Dict, Optional
+
+import aiohttp
+from aiohttp import ClientTimeout
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+
+def request_timeout(stream: bool = False) -> ClientTimeout:
+    """timeout ของ request ไปยัง Ollama แยกเป็น connect / first byte / total
+
+    แบบ streaming ใช้ sock_read เป็น first-byte timeout (ครอบคลุมการรอ token แรกและช่วงที่ stream เงียบ)
+    แบบ non-streaming ได้ response ครั้งเดียวเมื่อสร้างคำตอบเสร็จ จึงจำกัดแค่ connect และ total
+    """
+    return ClientTimeout(
+        total=settings.OLLAMA_TIMEOUT,
+        sock_connect=settings.OLLAMA_CONNECT_TIMEOUT,
+        sock_read=settings.OLLAMA_FIRST_BYTE_TIMEOUT if stream else None
+    )
+
+
+class CountingTCPConnector(aiohttp.TCPConnector):
+    """TCPConnector ที่นับ connection ที่เปิดอยู่/กำลังใช้/idle จาก public API เท่านั้น
+
+    ทุก connection ที่ connect() ส่งออกไปถูกจำไว้แบบ weak reference:
+    open = protocol ที่ยังต่ออยู่ (is_connected), in use = Connection ที่ยังไม่ release (closed = False)
+    connection ที่ถูกปิด (keep-alive หมดอายุ, server ปิด, connector ปิด) หลุดจากการนับเองโดยไม่ต้องอ่าน state ภายในของ aiohttp
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._protocols: "weakref.WeakSet[Any]" = weakref.WeakSet()
+        self._handed_out: "weakref.WeakSet[Any]" = weakref.WeakSet()
+
+    async def connect(self, req, traces, timeout):
+        connection = await super().connect(req, traces, timeout)
+        self._handed_out.add(connection)
+        if connection.protocol is not None:
+            self._protocols.add(connection.protocol)
+        return connection
+
+    def connection_counts(self) -> Dict[str, int]:
+        open_connections = sum(1 for protocol in list(self._protocols) if protocol.is_connected())
+        in_use = sum(1 for connection in list(self._handed_out) if not connection.closed)
+        return {
+            "open_connections": open_connections,
+            "in_use_connections": in_use,
+            "idle_connections": max(open_connections - in_use, 0),
+        }
+
+
+class HTTPClient:
+    """aiohttp ClientSession ที่ใช้ร่วมกันทั้งแอป (เปิด/ปิดใน lifespan ของ FastAPI)
+
+    TCPConnector จำกัดจำนวน connection ทั้งหมดและต่อ host, เก็บ connection ไว้ใช้ซ้ำ (keep-alive)
+    และ cache DNS ตาม HTTP_DNS_TTL_SECONDS
+    """
+
+    def __init__(self):
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._connector: Optional[CountingTCPConnector] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.sessions_opened = 0
+        # นับผ่าน TraceConfig (public API ของ aiohttp) ตลอดอายุ process
+        self.requests = 0
+        self.connections_created = 0
+        self.connections_reused = 0
+        self.waiting_requests = 0
+
+    def _trace_config(self) -> aiohttp.TraceConfig:
+        trace = aiohttp.TraceConfig()
+
+        async def on_request_start(session, context, params):
+            self.requests += 1
+
+        async def on_connection_create_end(session, context, params):
+            self.connections_created += 1
+
+        async def on_connection_reuseconn(session, context, params):
+            self.connections_reused += 1
+
+        async def on_connection_queued_start(session, context, params):
+            self.waiting_requests += 1
+
+        async def on_connection_queued_end(session, context, params):
+            self.waiting_requests -= 1
+
+        trace.on_request_start.append(on_request_start)
+        trace.on_connection_create_end.append(on_connection_create_end)
+        trace.on_connection_reuseconn.append(on_connection_reuseconn)
+        trace.on_connection_queued_start.append(on_connection_queued_start)
+        trace.on_connection_queued_end.append(on_connection_queued_end)
+        return trace
+
+    async def open(self) -> None:
+        if self._session is not None and not self._session.closed:
+            return
+        self._connector = CountingTCPConnector(
+            limit=settings.HTTP_POOL_LIMIT,
+            limit_per_host=settings.HTTP_POOL_LIMIT_PER_HOST,
+            keepalive_timeout=settings.HTTP_KEEPALIVE_SECONDS,
+            ttl_dns_cache=settings.HTTP_DNS_TTL_SECONDS,
+        )
+        self._session = aiohttp.ClientSession(
+            connector=self._connector, timeout=request_timeout(), trace_configs=[self._trace_config()]
+        )
+        self._loop = asyncio.get_running_loop()
+        self.sessions_opened += 1
+        logger.info(
+            f"HTTP client pool opened (limit={settings.HTTP_POOL_LIMIT}, "
+            f"per_host={settings.HTTP_POOL_LIMIT_PER_HOST})"
+        )
+
+    async def close(self) -> None:
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+        self._connector = None
+        self._loop = None
+
+    async def _close_stale(self) -> None:
+        """ปิด session ที่สร้างใน event loop อื่นก่อนเปิดใหม่ (ไม่ให้ connection และ connector ค้าง)"""
+        session, loop = self._session, self._loop
+        self._session = None
+        self._connector = None
+        self._loop = None
+        if session is None or session.closed:
+            return
+        if loop is not None and loop.is_running():
+            # loop เดิมยังทำงานอยู่ใน thread อื่น: ปิดใน loop ของมันเอง
+            asyncio.run_coroutine_threadsafe(session.close(), loop)
+            return
+        try:
+            # loop เดิมจบแล้ว: connector ถูก mark closed และทิ้ง connection (loop ที่ปิดแล้วไม่มี transport ให้ปิดต่อ)
+            await session.close()
+        except RuntimeError as e:
+            logger.warning(f"Could not close HTTP client session of a stopped event loop: {e}")
+
+    async def get_session(self) -> aiohttp.ClientSession:
+        """คืน session ของ event loop ปัจจุบัน
+
+        ถ้ายังไม่ได้เปิด (เช่นใช้จาก script/benchmark ที่ไม่ผ่าน lifespan) หรือถูกสร้างใน loop อื่น
+        จะปิด session เดิมแล้วเปิดใหม่ใน loop ปัจจุบันแทน
+        """
+        if self._session is None or self._session.closed:
+            await self.open()
+        elif self._loop is not asyncio.get_running_loop():
+            logger.warning("HTTP client session belongs to another event loop, reopening")
+            await self._close_stale()
+            await self.open()
+        return self._session
+
+    def metrics(self) -> Dict[str, Any]:
+        connector = self._connector
+        counters = {
+            "sessions_opened": self.sessions_opened,
+            "requests": self.requests,
+            "connections_created": self.connections_created,
+            # connection ที่ใช้ซ้ำจาก keep-alive แทนการเปิดใหม่
+            "connections_reused": self.connections_reused,
+            "waiting_requests": self.waiting_requests,
+        }
+        if connector is None or connector.closed:
+            return {"open": False, **counters}
+        return {
+            "open": True,
+            **counters,
+            **connector.connection_counts(),
+            "limit": connector.limit,
+            "limit_per_host": connector.limit_per_host,
+            "keepalive_seconds": settings.HTTP_KEEPALIVE_SECONDS,
+            "dns_ttl_seconds": settings.HTTP_DNS_TTL_SECONDS
+        }
+
+
+# Global instance
+http_client = HTTPClient()
@@ -0,0 +1,134 @@
+from typing import Any, Dict, List, Optional
+
+from .analysis_cache import EDGE_DATA_FIELDS, NODE_DATA_FIELDS
+
+# ความยาวสูงสุดของสรุปรายงานเดิมที่ส่งกลับไปใน prompt
+PREVIOUS_SUMMARY_MAX_CHARS = 4000
+# หัวข้อสรุปของรายงาน 5 หัวข้อ (ANALYSIS_PROMPT) ใช้ตัดเอาเฉพาะภาพรวมของรายงานเดิม
+SUMMARY_HEADING = "## 5."
+
+
+def _edge_keys(edges: List[Dict]) -> List[str]:
+    """key ของ edge: ใช้ id ถ้ามี ไม่งั้นใช้ source->target (parallel edges ต่อท้ายด้วย #n)"""
+    keys = []
+    seen: Dict[str, int] = {}
+    for edge in edges:
+        base = str(edge.get("id") or f"{edge.get('source')}->{edge.get('target')}")
+        seen[base] = seen.get(base, 0) + 1
+        keys.append(base if seen[base] == 1 else f"{base}#{seen[base]}")
+    return keys
+
+
+def topology_snapshot(nodes: List[Dict], edges: List[Dict]) -> Dict[str, Any]:
+    """เก็บเฉพาะฟิลด์ที่มีผลต่อการวิเคราะห์ (เหมือน cache key) สำหรับบันทึกคู่กับประวัติการวิเคราะห์"""
+    return {
+        "nodes": {
+            str(node.get("id")): {field: (node.get("data") or {}).get(field) for field in NODE_DATA_FIELDS}
+            for node in nodes
+        },
+        "edges": {
+            key: {
+                "source": str(edge.get("source")),
+                "target": str(edge.get("target")),
+                **{field: (edge.get("data") or {}).get(field) for field in EDGE_DATA_FIELDS}
+            }
+            for key, edge in zip(_edge_keys(edges), edges)
+        }
+    }
+
+
+def _changed_fields(old: Dict[str, Any], new: Dict[str, Any]) -> Dict[str, List[Any]]:
+    return {field: [old.get(field), new.get(field)] for field in new if old.get(field) != new.get(field)}
+
+
+def diff_topology(previous: Dict[str, Any], nodes: List[Dict], edges: List[Dict]) -> Dict[str, Any]:
+    """เทียบ topology ปัจจุบันกับ snapshot ครั้งก่อน คืนอุปกรณ์/การเชื่อมต่อที่เพิ่ม ลบ และแก้ไข
+
+    change_ratio = จำนวนรายการที่เปลี่ยน / จำนวนอุปกรณ์และการเชื่อมต่อเดิม
+    """
+    current = topology_snapshot(nodes, edges)
+    old_nodes, new_nodes = previous.get("nodes", {}), current["nodes"]
+    old_edges, new_edges = previous.get("edges", {}), current["edges"]
+
+    def label(node_id: str) -> str:
+        data = new_nodes.get(node_id) or old_nodes.get(node_id) or {}
+        return str(data.get("label") or node_id)
+
+    def describe_edge(edge: Dict[str, Any]) -> Dict[str, Any]:
+        return {"from": label(edge["source"]), "to": label(edge["target"]), "bandwidth": edge.get("bandwidth"),
+                "bandwidthUnit": edge.get("bandwidthUnit")}
+
+    diff: Dict[str, Any] = {
+        "added_nodes": [
+            {"label": label(n), "deviceType": new_nodes[n].get("deviceType")} for n in new_nodes if n not in old_nodes
+        ],
+        "removed_nodes": [
+            {"label": label(n), "deviceType": old_nodes[n].get("deviceType")} for n in old_nodes if n not in new_nodes
+        ],
+        "changed_nodes": [],
+        "added_edges": [describe_edge(new_edges[e]) for e in new_edges if e not in old_edges],
+        "removed_edges": [describe_edge(old_edges[e]) for e in old_edges if e not in new_edges],
+        "changed_edges": [],
+    }
+    for node_id, data in new_nodes.items():
+        if node_id in old_nodes:
+            changes = _changed_fields(old_nodes[node_id], data)
+            if changes:
+                diff["changed_nodes"].append({"label": label(node_id), "changes": changes})
+    for key, data in new_edges.items():
+        if key in old_edges:
+            changes = _changed_fields(old_edges[key], data)
+            if changes:
+                diff["changed_edges"].append({**describe_edge(data), "changes": changes})
+
+    change_count = sum(len(diff[k]) for k in diff)
+    diff["change_count"] = change_count
+    diff["change_ratio"] = change_count / max(1, len(old_nodes) + len(old_edges))
+    return diff
+
+
+def format_diff(diff: Dict[str, Any]) -> str:
+    """แปลงผล diff เป็นข้อความสำหรับ prompt"""
+
+    def edge_text(edge: Dict[str, Any]) -> str:
+        text = f"{edge['from']} -> {edge['to']}"
+        if edge.get("bandwidth"):
+            text += f" [{edge['bandwidth']} {edge.get('bandwidthUnit') or ''}".rstrip() + "]"
+        return text
+
+    def changes_text(changes: Dict[str, List[Any]]) -> str:
+        return ", ".join(f"{field}: {old if old is not None else '-'} -> {new if new is not None else '-'}"
+                         for field, (old, new) in changes.items())
+
+    lines = ["การเปลี่ยนแปลงจากการวิเคราะห์ครั้งก่อน:"]
+    if diff["added_nodes"]:
+        lines.append("- เพิ่มอุปกรณ์: " + ", ".join(f"{n['label']} ({n['deviceType']})" for n in diff["added_nodes"]))
+    if diff["removed_nodes"]:
+        lines.append("- ลบอุปกรณ์: " + ", ".join(f"{n['label']} ({n['deviceType']})" for n in diff["removed_nodes"]))
+    for node in diff["changed_nodes"]:
+        lines.append(f"- แก้ไขอุปกรณ์ {node['label']}: {changes_text(node['changes'])}")
+    if diff["added_edges"]:
+        lines.append("- เพิ่มการเชื่อมต่อ: " + ", ".join(edge_text(e) for e in diff["added_edges"]))
+    if diff["removed_edges"]:
+        lines.append("- ลบการเชื่อมต่อ: " + ", ".join(edge_text(e) for e in diff["removed_edges"]))
+    for edge in diff["changed_edges"]:
+        lines.append(f"- แก้ไขการเชื่อมต่อ {edge['from']} -> {edge['to']}: {changes_text(edge['changes'])}")
+    return "\n".join(lines)
+
+
+def report_summary(report: str, max_chars: int = PREVIOUS_SUMMARY_MAX_CHARS) -> str:
+    """ตัดเอาเฉพาะส่วนภาพรวม/สรุป (หัวข้อ 5) ของรายงานเดิม ถ้าไม่พบหัวข้อใช้ส่วนต้นของรายงาน"""
+    start = report.find(SUMMARY_HEADING)
+    summary = report[start:] if start != -1 else report
+    if len(summary) > max_chars:
+        summary = summary[:max_chars] + "\n..."
+    return summary.strip()
+
+
+def previous_analysis_context(diff: Dict[str, Any], previous_report: str) -> str:
+    """ข้อความ context ของ incremental prompt: สรุปรายงานเดิม + รายการเปลี่ยนแปลง"""
+    return f"สรุปรายงานการวิเคราะห์ครั้งก่อน:\n{report_summary(previous_report)}\n\n{format_diff(diff)}"
+
+
+def should_use_incremental(diff: Optional[Dict[str, Any]], max_change_ratio: float) -> bool:
+    return diff is not None and 0 < diff["change_count"] and diff["change_ratio"] <= max_change_ratio
@@ -1,13 +1,41 @@
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from .routers import auth, ai, enhanced_api
 from .database import engine
 from . import models
+from .analysis_jobs import job_queue
+from .analysis_progress import recover_interrupted_analyses, watch_interrupted_analyses
+from .ai_service import analyzer
+from .http_client import http_client
+from .db_executor import db_executor
+from .ollama_metrics import render_metrics
 
 # Create database tables
 models.Base.metadata.create_all(bind=engine)
 
-app = FastAPI(title="Network Topology API", version="1.0.0")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # เปิด connection pool ก่อน background task ที่เรียก Ollama และปิดหลังสุด
+    await http_client.open()
+    analyzer.ollama_service.pool.start()
+    # ผลวิเคราะห์ที่ค้างจาก process ก่อน (restart/crash) เก็บเป็น interrupted ก่อน worker เริ่มงานใหม่
+    # เฉพาะแถวที่ไม่มี heartbeat แล้ว และตรวจซ้ำเป็นระยะระหว่างทำงาน
+    recover_interrupted_analyses()
+    recovery = asyncio.create_task(watch_interrupted_analyses())
+    await job_queue.start()
+    try:
+        yield
+    finally:
+        recovery.cancel()
+        await job_queue.stop()
+        await analyzer.ollama_service.pool.stop()
+        await http_client.close()
+        db_executor.shutdown()
+
+app = FastAPI(title="Network Topology API", version="1.0.0", lifespan=lifespan)
 
 # CORS middleware
 app.add_middleware(
@@ -43,6 +71,11 @@ app.include_router(enhanced_api.router, prefix="/api", tags=["enhanced-api"])
 def read_root():
     return {"message": "Network Topology API is running"}
 
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """Prometheus metrics: เวลารอคิว, latency, time to first token และ token ของ Ollama แยกตาม model"""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
 @app.get("/health")
 def health_check():
     """Health check endpoint with database status"""
@@ -1,5 +1,5 @@
-from sqlalchemy import Column, Integer, String, DateTime, Text, ForeignKey, Boolean, JSON, UniqueConstraint, CheckConstraint
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, String, DateTime, Text, ForeignKey, Boolean, Float, JSON, UniqueConstraint, CheckConstraint, Index
+from sqlalchemy.orm import relationship, query_expression
 from sqlalchemy.sql import func
 from .database import Base
 
@@ -39,6 +39,8 @@ class Project(Base):
     # Constraints
     __table_args__ = (
         UniqueConstraint('owner_id', 'name', name='unique_project_per_user'),
+        # รายการ project แบบ cursor เรียงตามเวลาสร้าง
+        Index("ix_projects_owner_created", "owner_id", "created_at"),
     )
     
     # Relationships
@@ -58,9 +60,85 @@ class AIAnalysisHistory(Base):
     model_used = Column(String(100), nullable=False)
     total_device_count = Column(Integer, nullable=False)
     analysis_result = Column(Text, nullable=False)
-    execution_time_seconds = Column(Integer, nullable=True)
+    # running -> completed | failed, หรือ interrupted (process หยุดกลางทาง เก็บข้อความที่สร้างได้ไว้)
+    status = Column(String(20), nullable=False, default="completed")
+    execution_time_seconds = Column(Integer, nullable=True)  # เวลาสร้างคำตอบ (ไม่รวมเวลารอคิว)
+    queue_wait_seconds = Column(Float, nullable=True)  # เวลารอคิวของ scheduler ก่อนส่งไป Ollama
+    # token และเวลาที่ Ollama รายงาน (รวมทุก request ของการวิเคราะห์, ว่างเมื่อใช้ผลจาก cache)
+    prompt_tokens = Column(Integer, nullable=True)
+    completion_tokens = Column(Integer, nullable=True)
+    load_duration_ms = Column(Integer, nullable=True)
+    prompt_eval_duration_ms = Column(Integer, nullable=True)
+    eval_duration_ms = Column(Integer, nullable=True)
+    time_to_first_token_ms = Column(Integer, nullable=True)
+    tokens_per_second = Column(Float, nullable=True)
+    # topology ที่ใช้วิเคราะห์ (เฉพาะฟิลด์ที่มีผลต่อ prompt) เก็บเฉพาะการวิเคราะห์ที่สำเร็จ ใช้ทำ incremental re-analysis
+    topology_snapshot = Column(JSON(none_as_null=True), nullable=True)
+    # ผลแบบ incremental: การวิเคราะห์เต็มที่ใช้เป็นฐาน (รายงานไม่ครบ 5 หัวข้อ จึงไม่ใช้เป็นฐานของครั้งถัดไป)
+    base_analysis_id = Column(Integer, ForeignKey("ai_analysis_history.id", ondelete="SET NULL"), nullable=True)
     created_at = Column(DateTime(timezone=True), default=bangkok_now)
+    # เขียนล่าสุด (checkpoint / heartbeat ของ AnalysisProgress) แถว running ที่ไม่ถูกแตะนานเกินไปไม่มี process ทำต่อแล้ว
+    updated_at = Column(DateTime(timezone=True), default=bangkok_now, onupdate=bangkok_now)
+    # ส่วนต้นของ analysis_result โหลดเฉพาะ query รายการแบบ summary (crud._history_list_query)
+    analysis_excerpt = query_expression()
+    
+    # ประวัติของผู้ใช้ (ทั้งหมด / ราย project) เรียงตามเวลาล่าสุด อ่านจาก index ได้โดยไม่ต้อง sort
+    __table_args__ = (
+        Index("ix_ai_analysis_history_user_created", "user_id", "created_at"),
+        Index("ix_ai_analysis_history_user_project_created", "user_id", "project_id", "created_at"),
+        Index("ix_ai_analysis_history_project_id", "project_id"),  # cascade เมื่อลบ project
+        Index("ix_ai_analysis_history_status_updated", "status", "updated_at"),  # หาแถว running ที่ค้าง
+    )
     
     # Relationships
     user = relationship("User", back_populates="ai_analyses")
-    project = relationship("Project", back_populates="ai_analyses")
\ No newline at end of file
+    project = relationship("Project", back_populates="ai_analyses")
+
+class AIAnalysisJob(Base):
+    __tablename__ = "ai_analysis_jobs"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    project_id = Column(Integer, ForeignKey("projects.id"), nullable=True)
+    # งานของ batch (วิเคราะห์ซ้ำทั้ง project) ไม่เก็บ topology: อ่าน diagram_data ของ project ตอนเริ่มทำงาน
+    batch_id = Column(Integer, ForeignKey("ai_analysis_batches.id", ondelete="CASCADE"), nullable=True, index=True)
+    # queued -> running -> completed | failed
+    status = Column(String(20), nullable=False, default="queued", index=True)
+    request_data = Column(JSON, nullable=False)  # {"nodes": [...], "edges": [...]} (งานของ batch เป็น {})
+    analysis_id = Column(Integer, ForeignKey("ai_analysis_history.id", ondelete="SET NULL"), nullable=True)
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime(timezone=True), default=bangkok_now)
+    started_at = Column(DateTime(timezone=True), nullable=True)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+    # process (AnalysisJobQueue.worker_id) ที่ถืองาน queued/running นี้อยู่ ต่ออายุเป็นระยะจนกว่าจะปิดคิว
+    # process อื่น (API server ที่ restart, batch_analyze.py) รับงานได้เมื่อ lease หมดอายุเท่านั้น
+    lease_owner = Column(String(64), nullable=True)
+    lease_expires_at = Column(DateTime(timezone=True), nullable=True)
+    
+    # Relationships
+    analysis = relationship("AIAnalysisHistory")
+    batch = relationship("AIAnalysisBatch", back_populates="jobs")
+
+class AIAnalysisBatch(Base):
+    __tablename__ = "ai_analysis_batches"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=True)  # ผู้สั่ง (None = สั่งจาก CLI)
+    total_jobs = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime(timezone=True), default=bangkok_now)
+    
+    # Relationships
+    jobs = relationship("AIAnalysisJob", back_populates="batch", passive_deletes=True)
+
+class AIAnalysisCache(Base):
+    __tablename__ = "ai_analysis_cache"
+    
+    # sha256 ของ topology (ฟิลด์ที่ใช้สร้าง prompt) + model + prompt version
+    cache_key = Column(String(64), primary_key=True)
+    model_used = Column(String(100), nullable=False)
+    prompt_version = Column(String(20), nullable=False)
+    analysis_result = Column(Text, nullable=False)
+    hit_count = Column(Integer, default=0, nullable=False)
+    created_at = Column(DateTime(timezone=True), default=bangkok_now)
+    expires_at = Column(DateTime(timezone=True), nullable=False, index=True)
+    last_accessed_at = Column(DateTime(timezone=True), default=bangkok_now, index=True)
@@ -0,0 +1,155 @@
+import time
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from .models import bangkok_now
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitBreaker:
+    """Circuit breaker สำหรับ Ollama (closed -> open -> half_open -> closed)
+
+    - closed: ส่ง request ได้ตามปกติ นับความล้มเหลวติดกัน
+    - open: ล้มเหลวติดกันครบ failure_threshold แล้ว ปฏิเสธทันทีจนครบ recovery_seconds
+    - half_open: ให้ request ทดลองผ่านได้ทีละหนึ่ง ถ้าสำเร็จกลับเป็น closed ถ้าล้มเหลวกลับเป็น open
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int, recovery_seconds: float):
+        self.failure_threshold = max(1, failure_threshold)
+        self.recovery_seconds = recovery_seconds
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self.last_state_change = bangkok_now()
+        # metrics
+        self.total_successes = 0
+        self.total_failures = 0
+        self.rejected = 0
+        self.times_opened = 0
+
+    def _transition(self, state: str) -> None:
+        if state == self.state:
+            return
+        logger.warning(f"Ollama circuit breaker: {self.state} -> {state}")
+        self.state = state
+        self.last_state_change = bangkok_now()
+        if state == self.OPEN:
+            self._opened_at = time.monotonic()
+            self.times_opened += 1
+
+    def available(self) -> bool:
+        """ตรวจว่าจะยอมให้ request ผ่านหรือไม่ โดยไม่เปลี่ยนสถานะ (ใช้เลือก backend)"""
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN:
+            return time.monotonic() - self._opened_at >= self.recovery_seconds
+        return not self._trial_in_flight
+
+    def allow_request(self) -> bool:
+        if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.recovery_seconds:
+            self._transition(self.HALF_OPEN)
+
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.HALF_OPEN and not self._trial_in_flight:
+            self._trial_in_flight = True
+            return True
+        self.rejected += 1
+        return False
+
+    def record_success(self) -> None:
+        self.total_successes += 1
+        self.consecutive_failures = 0
+        self._trial_in_flight = False
+        self._transition(self.CLOSED)
+
+    def record_failure(self) -> None:
+        self.total_failures += 1
+        self.consecutive_failures += 1
+        self._trial_in_flight = False
+        if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            self._transition(self.OPEN)
+
+    def release(self) -> None:
+        """คืนสิทธิ์ trial เมื่อ request ถูกยกเลิกโดยไม่ทราบผล"""
+        self._trial_in_flight = False
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "failure_threshold": self.failure_threshold,
+            "recovery_seconds": self.recovery_seconds,
+            "total_successes": self.total_successes,
+            "total_failures": self.total_failures,
+            "rejected": self.rejected,
+            "times_opened": self.times_opened,
+            "last_state_change": self.last_state_change
+        }
+
+
+class OllamaHealthMonitor:
+    """ตรวจสอบสถานะ Ollama เป็นระยะใน background และเก็บผลล่าสุดไว้ให้ route อ่าน"""
+
+    def __init__(self, probe: Callable[[], Awaitable[bool]], breaker: CircuitBreaker, interval_seconds: float):
+        self._probe = probe
+        self.breaker = breaker
+        self.interval_seconds = interval_seconds
+        self.healthy: Optional[bool] = None
+        self.last_checked = None
+        self.latency_ms: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def check_now(self) -> bool:
+        start = time.monotonic()
+        healthy = await self._probe()
+        self.latency_ms = round((time.monotonic() - start) * 1000, 1)
+        self.last_checked = bangkok_now()
+        if healthy != self.healthy:
+            logger.info(f"Ollama health changed: {self.healthy} -> {healthy}")
+        self.healthy = healthy
+        if not healthy:
+            # probe ล้มเหลวนับเป็นความล้มเหลวของ upstream ด้วย
+            self.breaker.record_failure()
+        return healthy
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.check_now()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ollama health probe error: {e}")
+            await asyncio.sleep(self.interval_seconds)
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(), name="ollama-health-monitor")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def status(self) -> Dict[str, Any]:
+        if self.healthy is None:
+            status = "unknown"
+        else:
+            status = "healthy" if self.healthy else "unhealthy"
+        return {
+            "status": status,
+            "ollama_connected": bool(self.healthy),
+            "last_checked": self.last_checked,
+            "probe_latency_ms": self.latency_ms,
+            "probe_interval_seconds": self.interval_seconds,
+            "circuit_breaker": self.breaker.metrics()
+        }
@@ -0,0 +1,201 @@
+import threading
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+# ช่วงของ histogram (วินาที / token ต่อวินาที) ครอบคลุมตั้งแต่ cache ของ prefix ไปจนถึงรายงานยาวบน GPU ช้า
+QUEUE_WAIT_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+TIME_TO_FIRST_TOKEN_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+LATENCY_BUCKETS = (1, 2.5, 5, 10, 20, 30, 60, 120, 300, 600, 1200, 1800, 3600)
+TOKENS_PER_SECOND_BUCKETS = (1, 2.5, 5, 10, 15, 20, 30, 40, 60, 80, 100, 150, 200)
+
+_NS_PER_MS = 1_000_000
+
+
+def _format_labels(names: Sequence[str], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Histogram:
+    """histogram แบบ Prometheus (cumulative buckets + _sum + _count) แยกตาม label"""
+
+    def __init__(self, name: str, help_text: str, buckets: Sequence[float], labels: Sequence[str] = ("model",)):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(sorted(buckets))
+        self.labels = tuple(labels)
+        self._series: Dict[Tuple[str, ...], List[Any]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(str(labels[name]) for name in self.labels)
+        with self._lock:
+            series = self._series.setdefault(key, [[0] * len(self.buckets), 0.0, 0])
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._series.items()):
+                for bound, bucket_count in zip(self.buckets, counts):
+                    le = 'le="%s"' % _format_value(bound)
+                    lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, le)} {bucket_count}")
+                le = 'le="+Inf"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, le)} {count}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {_format_value(total)}")
+                lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {count}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ("model",)):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = tuple(str(labels[name]) for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}")
+        return lines
+
+
+queue_wait_seconds = Histogram(
+    "analysis_queue_wait_seconds", "Time an analysis waited in the scheduler queue", QUEUE_WAIT_BUCKETS
+)
+analysis_duration_seconds = Histogram(
+    "analysis_duration_seconds", "Time to produce an analysis after leaving the queue", LATENCY_BUCKETS
+)
+request_duration_seconds = Histogram(
+    "ollama_request_duration_seconds", "Total latency of successful Ollama chat requests", LATENCY_BUCKETS
+)
+time_to_first_token_seconds = Histogram(
+    "ollama_time_to_first_token_seconds", "Time until the first generated token", TIME_TO_FIRST_TOKEN_BUCKETS
+)
+tokens_per_second = Histogram(
+    "ollama_tokens_per_second", "Generation speed of Ollama chat requests", TOKENS_PER_SECOND_BUCKETS
+)
+prompt_tokens_total = Counter("ollama_prompt_tokens_total", "Prompt tokens processed by Ollama")
+completion_tokens_total = Counter("ollama_completion_tokens_total", "Tokens generated by Ollama")
+
+METRICS = [
+    queue_wait_seconds,
+    analysis_duration_seconds,
+    request_duration_seconds,
+    time_to_first_token_seconds,
+    tokens_per_second,
+    prompt_tokens_total,
+    completion_tokens_total,
+]
+
+
+def render_metrics() -> str:
+    """ข้อความสำหรับ GET /metrics (Prometheus text exposition format)"""
+    return "\n".join(line for metric in METRICS for line in metric.render()) + "\n"
+
+
+def parse_usage(result: Dict[str, Any]) -> Dict[str, Optional[int]]:
+    """ดึง token และเวลา (ms) จาก response ของ Ollama
+
+    native /api/chat: prompt_eval_count, eval_count และ *_duration (nanoseconds)
+    OpenAI-compatible: usage.prompt_tokens / usage.completion_tokens (ไม่มีข้อมูลเวลา)
+    """
+    def duration_ms(field: str) -> Optional[int]:
+        value = result.get(field)
+        return int(value) // _NS_PER_MS if value is not None else None
+
+    if "eval_count" in result or "prompt_eval_count" in result:
+        return {
+            "prompt_tokens": result.get("prompt_eval_count"),
+            "completion_tokens": result.get("eval_count"),
+            "load_duration_ms": duration_ms("load_duration"),
+            "prompt_eval_duration_ms": duration_ms("prompt_eval_duration"),
+            "eval_duration_ms": duration_ms("eval_duration"),
+        }
+    usage = result.get("usage") or {}
+    return {
+        "prompt_tokens": usage.get("prompt_tokens"),
+        "completion_tokens": usage.get("completion_tokens"),
+        "load_duration_ms": None,
+        "prompt_eval_duration_ms": None,
+        "eval_duration_ms": None,
+    }
+
+
+class GenerationUsage:
+    """token และเวลาที่ Ollama ใช้กับการวิเคราะห์หนึ่งครั้ง (รวมทุก request เช่นขั้น map + reduce)"""
+
+    SUMMED_FIELDS = ("prompt_tokens", "completion_tokens", "load_duration_ms", "prompt_eval_duration_ms", "eval_duration_ms")
+
+    def __init__(self):
+        self.requests = 0
+        self.values: Dict[str, Optional[int]] = {field: None for field in self.SUMMED_FIELDS}
+        self.time_to_first_token_ms: Optional[int] = None
+        self.generation_seconds = 0.0
+
+    def add(self, usage: Dict[str, Optional[int]], time_to_first_token: Optional[float], generation_seconds: float) -> None:
+        self.requests += 1
+        for field in self.SUMMED_FIELDS:
+            if usage.get(field) is not None:
+                self.values[field] = (self.values[field] or 0) + usage[field]
+        # request สุดท้ายคือรายงานที่ผู้ใช้เห็น (ขั้น reduce ของการวิเคราะห์แบบแบ่งส่วน)
+        if time_to_first_token is not None:
+            self.time_to_first_token_ms = int(time_to_first_token * 1000)
+        self.generation_seconds += generation_seconds
+
+    def history_fields(self) -> Dict[str, Any]:
+        """ฟิลด์สำหรับ AIAnalysisHistoryCreate (None ถ้าไม่ได้เรียก Ollama เช่น cache hit)"""
+        completion_tokens = self.values["completion_tokens"]
+        rate = None
+        if completion_tokens and self.generation_seconds > 0:
+            rate = round(completion_tokens / self.generation_seconds, 2)
+        return {**self.values, "time_to_first_token_ms": self.time_to_first_token_ms, "tokens_per_second": rate}
+
+
+def observe_completion(
+    model: str,
+    usage: Dict[str, Optional[int]],
+    latency: float,
+    time_to_first_token: Optional[float] = None,
+    recorder: Optional[GenerationUsage] = None
+) -> None:
+    """บันทึก metrics ของ Ollama request ที่สำเร็จหนึ่งครั้ง (และสะสมลง recorder ของการวิเคราะห์ถ้ามี)
+
+    time_to_first_token วัดจาก stream; ถ้าไม่มีใช้ load + prompt_eval ของ native API แทน
+    เวลาสร้างคำตอบใช้ eval_duration ถ้ามี ไม่งั้นใช้ latency ลบ time to first token
+    """
+    if time_to_first_token is None and usage.get("prompt_eval_duration_ms") is not None:
+        time_to_first_token = ((usage.get("load_duration_ms") or 0) + usage["prompt_eval_duration_ms"]) / 1000
+    if usage.get("eval_duration_ms"):
+        generation_seconds = usage["eval_duration_ms"] / 1000
+    else:
+        generation_seconds = max(latency - (time_to_first_token or 0), 0.0)
+
+    request_duration_seconds.observe(latency, model=model)
+    if time_to_first_token is not None:
+        time_to_first_token_seconds.observe(time_to_first_token, model=model)
+    if usage.get("prompt_tokens"):
+        prompt_tokens_total.inc(usage["prompt_tokens"], model=model)
+    if usage.get("completion_tokens"):
+        completion_tokens_total.inc(usage["completion_tokens"], model=model)
+        if generation_seconds > 0:
+            tokens_per_second.observe(usage["completion_tokens"] / generation_seconds, model=model)
+    if recorder is not None:
+        recorder.add(usage, time_to_first_token, generation_seconds)
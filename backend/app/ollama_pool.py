@@ -0,0 +1,169 @@
+import time
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+from .config import settings
+from .ollama_health import CircuitBreaker, OllamaHealthMonitor
+
+logger = logging.getLogger(__name__)
+
+# น้ำหนักของ latency ล่าสุดใน EWMA
+LATENCY_EWMA_ALPHA = 0.3
+
+
+class NoBackendAvailable(Exception):
+    """ทุก backend ถูก circuit breaker ปิดอยู่ (หรือถูกตัดออกจากการลองซ้ำหมดแล้ว)"""
+
+
+class OllamaBackend:
+    """Ollama host หนึ่งตัวในกลุ่ม พร้อม circuit breaker, health monitor และสถิติของตัวเอง"""
+
+    def __init__(self, url: str, weight: float, max_concurrency: int, probe: Callable[["OllamaBackend"], Awaitable[bool]]):
+        self.url = url.rstrip("/")
+        self.weight = max(weight, 0.01)
+        self.max_concurrency = max(1, max_concurrency)
+        self.breaker = CircuitBreaker(
+            failure_threshold=settings.OLLAMA_BREAKER_FAILURE_THRESHOLD,
+            recovery_seconds=settings.OLLAMA_BREAKER_RECOVERY_SECONDS
+        )
+        self.health = OllamaHealthMonitor(
+            lambda: probe(self),
+            self.breaker,
+            interval_seconds=settings.OLLAMA_HEALTH_CHECK_INTERVAL
+        )
+        self.in_flight = 0
+        self.requests = 0
+        self.errors = 0
+        self.latency_ms: Optional[float] = None  # EWMA ของ request ที่สำเร็จ
+        self.last_error: Optional[str] = None
+
+    def load(self) -> float:
+        """งานที่ค้างอยู่ต่อหน่วยน้ำหนัก (น้อย = ว่างกว่า)"""
+        return self.in_flight / self.weight
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "url": self.url,
+            "weight": self.weight,
+            "max_concurrency": self.max_concurrency,
+            "in_flight": self.in_flight,
+            "requests": self.requests,
+            "errors": self.errors,
+            "latency_ms": round(self.latency_ms, 1) if self.latency_ms is not None else None,
+            "last_error": self.last_error,
+            **self.health.status()
+        }
+
+
+class OllamaBackendPool:
+    """กระจาย request ไปยังหลาย Ollama host
+
+    เลือก backend ที่ circuit breaker ยอมให้ผ่าน ยังไม่เต็ม max_concurrency และมีงานค้างต่อน้ำหนักน้อยที่สุด
+    (เท่ากันแล้วดู health และ latency) ถ้าทุกตัวเต็มจะรอจนมีตัวว่าง
+    """
+
+    def __init__(self, backends: List[OllamaBackend]):
+        self.backends = backends
+        # สร้างใน acquire() บน loop ที่กำลังทำงาน (pool เป็น global สร้างตอน import ยังไม่มี loop)
+        self._released: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    @property
+    def primary(self) -> OllamaBackend:
+        return self.backends[0]
+
+    def _pick(self, exclude: Set[OllamaBackend]) -> Optional[OllamaBackend]:
+        candidates = [
+            backend for backend in self.backends
+            if backend not in exclude and backend.in_flight < backend.max_concurrency and backend.breaker.available()
+        ]
+        candidates.sort(key=lambda b: (
+            b.health.healthy is False,
+            b.load(),
+            b.latency_ms if b.latency_ms is not None else 0.0
+        ))
+        for backend in candidates:
+            if backend.breaker.allow_request():
+                return backend
+        return None
+
+    def _any_usable(self, exclude: Set[OllamaBackend]) -> bool:
+        return any(backend not in exclude and backend.breaker.available() for backend in self.backends)
+
+    def _released_event(self) -> asyncio.Event:
+        loop = asyncio.get_running_loop()
+        if self._released is None or self._loop is not loop:
+            self._released, self._loop = asyncio.Event(), loop
+        return self._released
+
+    async def acquire(self, exclude: Optional[Set[OllamaBackend]] = None) -> OllamaBackend:
+        """จอง backend หนึ่งตัว (ต้องเรียก release เสมอ) raise NoBackendAvailable ถ้าไม่มีตัวที่ใช้ได้"""
+        exclude = exclude or set()
+        released = self._released_event()
+        while True:
+            released.clear()
+            backend = self._pick(exclude)
+            if backend is not None:
+                backend.in_flight += 1
+                backend.requests += 1
+                return backend
+            if not self._any_usable(exclude):
+                logger.warning("No Ollama backend available (circuit breakers open)")
+                raise NoBackendAvailable()
+            # ทุกตัวเต็ม max_concurrency: รอให้มีงานเสร็จ (ตรวจซ้ำเป็นระยะเผื่อ breaker พ้นช่วง recovery)
+            try:
+                await asyncio.wait_for(released.wait(), timeout=1.0)
+            except asyncio.TimeoutError:
+                pass
+
+    def release(self, backend: OllamaBackend, ok: Optional[bool], started_at: float, error: Optional[str] = None) -> None:
+        """คืน backend พร้อมผลลัพธ์: True = สำเร็จ, False = ล้มเหลว, None = ถูกยกเลิก (ไม่ทราบผล)"""
+        backend.in_flight -= 1
+        if ok is True:
+            latency = (time.monotonic() - started_at) * 1000
+            backend.latency_ms = latency if backend.latency_ms is None else (
+                LATENCY_EWMA_ALPHA * latency + (1 - LATENCY_EWMA_ALPHA) * backend.latency_ms
+            )
+            backend.breaker.record_success()
+        elif ok is False:
+            backend.errors += 1
+            backend.last_error = error
+            backend.breaker.record_failure()
+        else:
+            backend.breaker.release()
+        if self._released is not None:
+            self._released.set()
+
+    def start(self) -> None:
+        for backend in self.backends:
+            backend.health.start()
+
+    async def stop(self) -> None:
+        for backend in self.backends:
+            await backend.health.stop()
+
+    async def check_now(self) -> bool:
+        results = await asyncio.gather(*(backend.health.check_now() for backend in self.backends))
+        return any(results)
+
+    @property
+    def last_checked(self):
+        checked = [backend.health.last_checked for backend in self.backends if backend.health.last_checked]
+        return max(checked) if checked else None
+
+    def status(self) -> Dict[str, Any]:
+        healthy = [backend.health.healthy for backend in self.backends]
+        if all(h is None for h in healthy):
+            status = "unknown"
+        elif any(healthy):
+            status = "healthy" if all(healthy) else "degraded"
+        else:
+            status = "unhealthy"
+        return {
+            "status": status,
+            "ollama_connected": any(healthy),
+            "last_checked": self.last_checked,
+            "probe_interval_seconds": settings.OLLAMA_HEALTH_CHECK_INTERVAL,
+            "backends": [backend.stats() for backend in self.backends]
+        }
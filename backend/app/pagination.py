@@ -0,0 +1,55 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+from typing import Any, List, Optional, Sequence, Tuple
+
+from sqlalchemy import tuple_
+
+# ตำแหน่งของ keyset: (created_at, id) ของแถวสุดท้ายในหน้าที่แล้ว
+Keyset = Tuple[datetime, int]
+
+
+class InvalidCursor(ValueError):
+    """cursor ที่ client ส่งมาถอดรหัสไม่ได้"""
+
+
+def encode_cursor(created_at: datetime, row_id: int) -> str:
+    """token ทึบ (base64url ของ JSON) ให้ client ส่งกลับมาเพื่อขอหน้าถัดไป"""
+    raw = json.dumps([created_at.isoformat(), row_id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Keyset:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, row_id = json.loads(raw)
+        return datetime.fromisoformat(created_at), int(row_id)
+    except (binascii.Error, UnicodeDecodeError, TypeError, ValueError) as e:
+        raise InvalidCursor(str(e)) from e
+
+
+def keyset_page(query, model, after: Optional[Keyset], limit: int, descending: bool = False):
+    """เรียง query ตาม (created_at, id) และเริ่มต่อจาก after โดยไม่ใช้ OFFSET
+
+    อ่านจาก index ที่ขึ้นต้นด้วยคอลัมน์ filter ตามด้วย created_at (id คือ rowid ต่อท้าย index อยู่แล้ว)
+    จึงเร็วเท่ากันทุกหน้า และแถวที่เพิ่มระหว่างเลื่อนดูไม่ทำให้ข้ามหรือซ้ำ
+    ดึง limit + 1 แถว: แถวที่เกินบอกว่ายังมีหน้าถัดไป (ดู split_page)
+    """
+    key = tuple_(model.created_at, model.id)
+    if after is not None:
+        query = query.filter(key < tuple_(*after) if descending else key > tuple_(*after))
+    if descending:
+        query = query.order_by(model.created_at.desc(), model.id.desc())
+    else:
+        query = query.order_by(model.created_at, model.id)
+    return query.limit(limit + 1).all()
+
+
+def split_page(rows: Sequence[Any], limit: int) -> Tuple[List[Any], Optional[str]]:
+    """ตัดแถวที่เกินจาก keyset_page ออก และสร้าง cursor ของหน้าถัดไป (None = หน้าสุดท้าย)"""
+    items = list(rows[:limit])
+    if len(rows) <= limit or not items:
+        return items, None
+    last = items[-1]
+    return items, encode_cursor(last.created_at, last.id)
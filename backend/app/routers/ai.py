@@ -1,11 +1,19 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, status
 from typing import List
 from .. import schemas, auth, models, crud
-from ..database import get_db
-from ..ai_service import analyzer
+from ..db_executor import run_db, run_in_db_thread
+from ..ai_service import OllamaResponseError, analyzer
+from ..http_client import http_client
+from ..graph_analysis import analyze_topology
+from ..incremental_analysis import topology_snapshot
+from ..analysis_stream import streaming_analysis_response
+from ..analysis_scheduler import admit_analysis, analysis_scheduler
+from ..ollama_metrics import GenerationUsage
+from ..analysis_progress import AnalysisProgress
+from ..client_disconnect import CLIENT_CLOSED_REQUEST, ClientDisconnected, run_until_disconnected
 import logging
 import json
+import asyncio
 import time
 
 logger = logging.getLogger(__name__)
@@ -15,72 +23,121 @@ router = APIRouter()
 @router.post("/analyze", response_model=schemas.AIAnalysisResponse)
 async def analyze_network_topology(
     request: schemas.AIAnalysisRequest,
-    current_user: schemas.User = Depends(auth.get_current_active_user),
-    db: Session = Depends(get_db)
+    http_request: Request,
+    current_user: schemas.User = Depends(auth.get_current_active_user)
 ):
     """
     วิเคราะห์แผนผังเครือข่ายด้วย AI และบันทึกประวัติ (ไม่รับ prompt จาก user)
     """
+    ticket = admit_analysis(current_user.id)
+    usage = GenerationUsage()
     start_time = time.time()
+    progress = None
     try:
         logger.info(f"AI analysis requested by user {current_user.id}")
-        # ใช้ default prompt (ไม่รับจาก user)
-        analysis_result = await analyzer.get_ai_analysis(
-            nodes=request.nodes,
-            edges=request.edges
+        progress = await AnalysisProgress.start(
+            current_user.id, analyzer.ollama_service.model, len(request.nodes), request.project_id
         )
-        execution_time = int(time.time() - start_time)
+        # ใช้ default prompt (ไม่รับจาก user)
+        facts = analyze_topology(request.nodes, request.edges)
+        previous = await run_db(crud.get_latest_analysis_snapshot, current_user.id, request.project_id)
+        try:
+            # client ปิดหน้าเว็บระหว่างรอ: ยกเลิก request ไปยัง Ollama และไม่บันทึกประวัติ
+            analysis_result = await run_until_disconnected(http_request, analyzer.analyze(
+                nodes=request.nodes,
+                edges=request.edges,
+                facts=facts,
+                previous=previous,
+                ticket=ticket,
+                usage=usage,
+                progress=progress
+            ))
+            snapshot, analysis_status = topology_snapshot(request.nodes, request.edges), "completed"
+            base_analysis_id = analyzer.incremental_base(request.nodes, request.edges, previous)
+        except OllamaResponseError as e:
+            analysis_result, snapshot, analysis_status, base_analysis_id = e.message, None, "failed", None
+        # แยกเวลารอคิวของ scheduler ออกจากเวลาสร้างคำตอบ
+        execution_time = int(time.time() - start_time - ticket.queue_wait_seconds)
         analysis_history_data = schemas.AIAnalysisHistoryCreate(
             model_used=analyzer.ollama_service.model,
             total_device_count=len(request.nodes),
             analysis_result=analysis_result,
+            status=analysis_status,
             execution_time_seconds=execution_time,
-            project_id=request.project_id
+            queue_wait_seconds=round(ticket.queue_wait_seconds, 3),
+            project_id=request.project_id,
+            topology_snapshot=snapshot,
+            base_analysis_id=base_analysis_id,
+            **usage.history_fields()
         )
-        analysis_history = crud.create_analysis_history(db, analysis_history_data, current_user.id)
+        analysis_history = await progress.finish(analysis_history_data)
+        # status เดียวกับที่บันทึกในประวัติ: failed = analysis คือข้อความผิดพลาดจาก Ollama ไม่ใช่รายงาน
         return schemas.AIAnalysisResponse(
             analysis=analysis_result,
-            status="success",
+            status=analysis_status,
             analysis_id=analysis_history.id,
-            devices_analyzed=[schemas.AnalysisDevice(
-                device_type_id=ad.device_type_id,
-                count=ad.count,
-                device_type=ad.device_type
-            ) for ad in analysis_history.analysis_devices]
+            facts=facts
         )
+    except ClientDisconnected:
+        await progress.discard()
+        return Response(status_code=CLIENT_CLOSED_REQUEST)
+    except asyncio.CancelledError:
+        # server หยุดระหว่างวิเคราะห์: เก็บข้อความที่ได้ไว้เป็น interrupted
+        if progress is not None:
+            await progress.abort()
+        raise
     except Exception as e:
-        db.rollback()
+        if progress is not None:
+            await progress.abort("failed")
         logger.error(f"AI analysis failed: {e}")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"เกิดข้อผิดพลาดในการวิเคราะห์: {str(e)}"
         )
+    finally:
+        ticket.close()
+
+@router.post("/analyze/stream")
+async def analyze_network_topology_stream(
+    request: schemas.AIAnalysisRequest,
+    http_request: Request,
+    current_user: schemas.User = Depends(auth.get_current_active_user)
+):
+    """
+    วิเคราะห์แผนผังเครือข่ายด้วย AI แบบ streaming (NDJSON) และบันทึกประวัติเมื่อเสร็จ
+    """
+    logger.info(f"AI streaming analysis requested by user {current_user.id}")
+    return streaming_analysis_response(request, current_user.id, http_request)
 
 @router.get("/health")
 async def check_ai_health(
     current_user: schemas.User = Depends(auth.get_current_active_user)
 ):
     """
-    ตรวจสอบสถานะการเชื่อมต่อกับ Ollama
+    ตรวจสอบสถานะการเชื่อมต่อกับ Ollama (จาก cache ของ health prober) พร้อมสถิติและ circuit breaker ของแต่ละ backend
     """
-    try:
-        is_healthy = await analyzer.ollama_service.check_ollama_health()
-        return {
-            "status": "healthy" if is_healthy else "unhealthy",
-            "ollama_connected": is_healthy,
-            "model": analyzer.ollama_service.model,
-            "base_url": analyzer.ollama_service.base_url,
-            "api_version": "v1"  # ระบุว่าใช้ v1 API
-        }
-    except Exception as e:
-        logger.error(f"Health check failed: {e}")
-        return {
-            "status": "error",
-            "ollama_connected": False,
-            "error": str(e),
-            "api_version": "v1"
-        }
-
-
-
+    ollama = analyzer.ollama_service
+    # อ่านสถานะที่ background prober เก็บไว้ (probe ทันทีเฉพาะครั้งแรกก่อนมีผล)
+    if ollama.pool.last_checked is None:
+        await ollama.pool.check_now()
+    return {
+        **ollama.pool.status(),
+        "model": ollama.model,
+        "base_url": ollama.base_url,
+        "context_sizing": ollama.context_sizing.snapshot(),
+        "http_pool": http_client.metrics(),
+        "scheduler": analysis_scheduler.stats(),
+        "api_version": "native" if ollama.native_api else "v1"
+    }
 
+@router.get("/cache/stats")
+async def get_analysis_cache_stats(
+    current_user: schemas.User = Depends(auth.get_current_active_user)
+):
+    """
+    สถิติของ cache ผลการวิเคราะห์ (hit/miss/eviction) และการรวม request ที่ซ้ำกัน
+    """
+    return {
+        **await run_in_db_thread(analyzer.cache.stats),
+        "coalescing": analyzer.inflight.stats()
+    }
@@ -1,9 +1,11 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm
+from starlette.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 from datetime import timedelta
 from .. import crud, schemas, auth
 from ..database import get_db
+from ..db_executor import run_db
 from ..config import settings
 
 router = APIRouter()
@@ -38,8 +40,7 @@ from fastapi.responses import JSONResponse
 
 @router.post("/token")
 async def login_for_access_token(
-    request: Request,
-    db: Session = Depends(get_db)
+    request: Request
 ):
     # พยายามอ่านเป็น form-data ก่อน
     try:
@@ -66,8 +67,10 @@ async def login_for_access_token(
             detail="Username and password required"
         )
 
-    user = auth.authenticate_user(db, username, password)
-    if not user:
+    # ค้นหาผู้ใช้ใน DB thread แต่ตรวจ hash (ใช้ CPU นาน) ใน threadpool ทั่วไป
+    # ไม่ให้ login หลายคนพร้อมกันกิน DB thread pool ที่มีขนาดเล็กของทุก route
+    user = await run_db(auth.get_user, email=username)
+    if not user or not await run_in_threadpool(auth.check_user_password, user, password):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="อีเมลหรือรหัสผ่านไม่ถูกต้อง",
@@ -105,15 +108,14 @@ async def read_users_me(current_user: schemas.User = Depends(auth.get_current_ac
 
 @router.post("/reset-password")
 async def reset_password(
-    data: schemas.ResetPasswordRequest,
-    db: Session = Depends(get_db)
+    data: schemas.ResetPasswordRequest
 ):
     email = data.email
     current_password = data.current_password
     new_password = data.new_password
     
     # ตรวจสอบว่ามี user นี้หรือไม่
-    user = auth.get_user(db, email=email)
+    user = await run_db(auth.get_user, email=email)
     if not user:
         raise HTTPException(
             status_code=404,
@@ -121,7 +123,7 @@ async def reset_password(
         )
     
     # ตรวจสอบรหัสผ่านปัจจุบัน
-    if not auth.verify_password(current_password, user.hashed_password):
+    if not await run_in_threadpool(auth.verify_password, current_password, user.hashed_password):
         raise HTTPException(
             status_code=401,
             detail="รหัสผ่านเดิมไม่ถูกต้อง"
@@ -131,7 +133,8 @@ async def reset_password(
     
     # อัปเดตรหัสผ่านใหม่
     try:
-        crud.update_user_password(db, user.id, new_password)
+        hashed_password = await run_in_threadpool(auth.get_password_hash, new_password)
+        await run_db(crud.set_user_password_hash, user.id, hashed_password)
         return {"message": "เปลี่ยนรหัสผ่านสำเร็จ"}
     except Exception as e:
         raise HTTPException(
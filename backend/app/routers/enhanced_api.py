@@ -1,46 +1,72 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Request
-from sqlalchemy.orm import Session
-from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, status, Request, Response
+from typing import List, Optional, Union
 import json
+import asyncio
 
-from ..database import get_db
+from ..db_executor import run_db
 from ..auth import get_current_user
 from .. import crud, schemas, models
-from ..ai_service import analyzer
+from ..ai_service import OllamaResponseError, analyzer
+from ..graph_analysis import analyze_topology
+from ..incremental_analysis import topology_snapshot
+from ..analysis_stream import streaming_analysis_response
+from ..analysis_jobs import job_queue, job_status
+from ..analysis_batches import batch_status, create_batch, resume_batch, submit_batch
+from ..analysis_scheduler import RateLimitExceeded, admit_analysis, analysis_scheduler, too_many_requests
+from ..client_disconnect import CLIENT_CLOSED_REQUEST, ClientDisconnected, run_until_disconnected
+from ..ollama_metrics import GenerationUsage
+from ..analysis_progress import AnalysisProgress
+from ..pagination import InvalidCursor, Keyset, decode_cursor, split_page
 
 router = APIRouter()
 
+
+def _cursor_position(cursor: str) -> Optional[Keyset]:
+    """cursor ว่าง (?cursor=) = หน้าแรกของโหมด cursor"""
+    if not cursor:
+        return None
+    try:
+        return decode_cursor(cursor)
+    except InvalidCursor:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
 # Enhanced Project Endpoints
-@router.get("/projects", response_model=List[schemas.Project])
+@router.get("/projects", response_model=Union[schemas.ProjectPage, List[schemas.Project]])
 async def get_projects(
     skip: int = 0,
     limit: int = 100,
-    current_user: models.User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    cursor: Optional[str] = None,
+    current_user: models.User = Depends(get_current_user)
 ):
-    """Get user's projects"""
-    return crud.get_projects(db, current_user.id, skip=skip, limit=limit)
+    """Get user's projects
+
+    Offset mode (skip/limit) returns a list. Passing cursor (empty for the first page)
+    switches to keyset mode and returns {"items", "next_cursor"}.
+    """
+    if cursor is None:
+        return await run_db(crud.get_projects, current_user.id, skip=skip, limit=limit)
+    rows = await run_db(crud.get_projects_page, current_user.id, _cursor_position(cursor), limit)
+    items, next_cursor = split_page(rows, limit)
+    return schemas.ProjectPage(items=items, next_cursor=next_cursor)
 
 @router.post("/projects", response_model=schemas.Project)
 async def create_project(
     project: schemas.ProjectCreate,
-    current_user: models.User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: models.User = Depends(get_current_user)
 ):
     """Create a new project"""
     try:
-        return crud.create_project(db, project, current_user.id)
+        return await run_db(crud.create_project, project, current_user.id)
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Failed to create project: {str(e)}")
 
 @router.get("/projects/{project_id}", response_model=schemas.Project)
 async def get_project(
     project_id: int,
-    current_user: models.User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: models.User = Depends(get_current_user)
 ):
     """Get a specific project"""
-    project = crud.get_project(db, project_id, current_user.id)
+    project = await run_db(crud.get_project, project_id, current_user.id)
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
     return project
@@ -49,12 +75,11 @@ async def get_project(
 async def update_project(
     project_id: int,
     project: schemas.ProjectUpdate,
-    current_user: models.User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: models.User = Depends(get_current_user)
 ):
     """Update a project"""
     try:
-        updated_project = crud.update_project(db, project_id, project, current_user.id)
+        updated_project = await run_db(crud.update_project, project_id, project, current_user.id)
         if not updated_project:
             raise HTTPException(status_code=404, detail="Project not found")
         return updated_project
@@ -65,11 +90,10 @@ async def update_project(
 @router.delete("/projects/{project_id}")
 async def delete_project(
     project_id: int,
-    current_user: models.User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: models.User = Depends(get_current_user)
 ):
     """Delete a project"""
-    success = crud.delete_project(db, project_id, current_user.id)
+    success = await run_db(crud.delete_project, project_id, current_user.id)
     if not success:
         raise HTTPException(status_code=404, detail="Project not found")
     return {"message": "Project deleted successfully"}
@@ -79,10 +103,12 @@ async def delete_project(
 async def analyze_network(
     request: schemas.AIAnalysisRequest,
     current_request: Request,
-    current_user: models.User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: models.User = Depends(get_current_user)
 ):
     """Analyze network topology with device type tracking (no user prompt)"""
+    ticket = admit_analysis(current_user.id)
+    usage = GenerationUsage()
+    progress = None
     try:
         # Debug log: แสดง nodes และ edges ที่ได้รับจาก frontend
         import logging
@@ -93,63 +119,226 @@ async def analyze_network(
         # Use fixed model gpt-oss:latest
         model_to_use = "gpt-oss:latest"
         # Model is fixed, no need to set it dynamically
-        analysis_result = await analyzer.get_ai_analysis(
-            request.nodes,
-            request.edges
-        )
-        execution_time = int(time.time() - start_time)
+        # สร้างแถวประวัติ (running) ก่อนเริ่ม ข้อความที่สร้างได้ถูกบันทึกเป็นช่วง ๆ ระหว่างวิเคราะห์
+        progress = await AnalysisProgress.start(current_user.id, model_to_use, len(request.nodes), request.project_id)
+        facts = analyze_topology(request.nodes, request.edges)
+        # ผลสำเร็จครั้งล่าสุดของ project ใช้วิเคราะห์ซ้ำเฉพาะส่วนที่เปลี่ยน
+        previous = await run_db(crud.get_latest_analysis_snapshot, current_user.id, request.project_id)
+        try:
+            # client ปิดหน้าเว็บระหว่างรอ: ยกเลิก request ไปยัง Ollama และไม่บันทึกประวัติ
+            analysis_result = await run_until_disconnected(current_request, analyzer.analyze(
+                request.nodes,
+                request.edges,
+                facts=facts,
+                previous=previous,
+                ticket=ticket,
+                usage=usage,
+                progress=progress
+            ))
+            snapshot, analysis_status = topology_snapshot(request.nodes, request.edges), "completed"
+            base_analysis_id = analyzer.incremental_base(request.nodes, request.edges, previous)
+        except OllamaResponseError as e:
+            analysis_result, snapshot, analysis_status, base_analysis_id = e.message, None, "failed", None
+        # แยกเวลารอคิวของ scheduler ออกจากเวลาสร้างคำตอบ
+        execution_time = int(time.time() - start_time - ticket.queue_wait_seconds)
         analysis_history = schemas.AIAnalysisHistoryCreate(
             model_used=model_to_use,
             total_device_count=len(request.nodes),
             analysis_result=analysis_result,
+            status=analysis_status,
             execution_time_seconds=execution_time,
-            project_id=request.project_id
+            queue_wait_seconds=round(ticket.queue_wait_seconds, 3),
+            project_id=request.project_id,
+            topology_snapshot=snapshot,
+            base_analysis_id=base_analysis_id,
+            **usage.history_fields()
         )
-        db_analysis = crud.create_analysis_history(db, analysis_history, current_user.id)
+        db_analysis = await progress.finish(analysis_history)
+        # status เดียวกับที่บันทึกในประวัติ: failed = analysis คือข้อความผิดพลาดจาก Ollama ไม่ใช่รายงาน
         return schemas.AIAnalysisResponse(
             analysis=analysis_result,
-            status="success",
-            analysis_id=db_analysis.id
+            status=analysis_status,
+            analysis_id=db_analysis.id,
+            facts=facts
         )
+    except ClientDisconnected:
+        await progress.discard()
+        return Response(status_code=CLIENT_CLOSED_REQUEST)
+    except asyncio.CancelledError:
+        # server หยุดระหว่างวิเคราะห์: เก็บข้อความที่ได้ไว้เป็น interrupted
+        if progress is not None:
+            await progress.abort()
+        raise
     except Exception as e:
+        if progress is not None:
+            await progress.abort("failed")
         raise HTTPException(status_code=500, detail=f"Analysis failed: {str(e)}")
+    finally:
+        ticket.close()
+
+@router.post("/analyze/stream")
+async def analyze_network_stream(
+    request: schemas.AIAnalysisRequest,
+    current_request: Request,
+    current_user: models.User = Depends(get_current_user)
+):
+    """Analyze network topology and stream tokens as NDJSON while they are generated"""
+    return streaming_analysis_response(request, current_user.id, current_request)
+
+@router.post("/analyze/jobs", response_model=schemas.AIAnalysisJob, status_code=202)
+async def enqueue_analysis(
+    request: schemas.AIAnalysisRequest,
+    current_user: models.User = Depends(get_current_user)
+):
+    """Queue a network analysis and return immediately with a job id"""
+    try:
+        analysis_scheduler.check_rate(current_user.id)
+    except RateLimitExceeded as e:
+        raise too_many_requests(e)
+    job = await job_queue.enqueue(request, current_user.id)
+    return await run_db(job_status, job)
+
+@router.get("/analyze/jobs/{job_id}", response_model=schemas.AIAnalysisJob)
+async def get_analysis_job(
+    job_id: int,
+    current_user: models.User = Depends(get_current_user)
+):
+    """Get job status and queue position"""
+    job = await run_db(crud.get_analysis_job, job_id, current_user.id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return await run_db(job_status, job)
+
+@router.get("/analyze/jobs/{job_id}/result", response_model=schemas.AIAnalysisResponse)
+async def get_analysis_job_result(
+    job_id: int,
+    current_user: models.User = Depends(get_current_user)
+):
+    """Get the analysis produced by a completed job"""
+    job = await run_db(crud.get_analysis_job, job_id, current_user.id, load_analysis=True)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job.status == "failed":
+        raise HTTPException(status_code=500, detail=f"Analysis failed: {job.error}")
+    if job.status != "completed" or job.analysis is None:
+        raise HTTPException(status_code=409, detail=f"Job is not completed (status: {job.status})")
+    return schemas.AIAnalysisResponse(
+        analysis=job.analysis.analysis_result,
+        status=job.analysis.status,
+        analysis_id=job.analysis_id,
+        facts=analyze_topology(job.request_data.get("nodes", []), job.request_data.get("edges", []))
+    )
+
+@router.post("/analyze/batches", response_model=schemas.AIAnalysisBatch, status_code=202)
+async def create_analysis_batch(
+    request: schemas.AIAnalysisBatchCreate,
+    current_user: models.User = Depends(get_current_user)
+):
+    """Re-analyze many saved projects (selected ids or all of the user's projects) through the job queue"""
+    if request.all_projects == (request.project_ids is not None):
+        raise HTTPException(status_code=400, detail="Specify either project_ids or all_projects")
+    try:
+        analysis_scheduler.check_rate(current_user.id)
+    except RateLimitExceeded as e:
+        raise too_many_requests(e)
+    batch = await run_db(create_batch, current_user.id, owner_id=current_user.id, project_ids=request.project_ids)
+    await run_db(submit_batch, job_queue, batch.id)
+    return await run_db(batch_status, batch)
+
+@router.get("/analyze/batches/{batch_id}", response_model=schemas.AIAnalysisBatch)
+async def get_analysis_batch(
+    batch_id: int,
+    current_user: models.User = Depends(get_current_user)
+):
+    """Batch progress (job counts by status)"""
+    batch = await run_db(crud.get_analysis_batch, batch_id, current_user.id)
+    if not batch:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return await run_db(batch_status, batch)
+
+@router.post("/analyze/batches/{batch_id}/resume", response_model=schemas.AIAnalysisBatch)
+async def resume_analysis_batch(
+    batch_id: int,
+    retry_failed: bool = False,
+    current_user: models.User = Depends(get_current_user)
+):
+    """Re-submit unfinished jobs of a batch (and failed ones when retry_failed=true)"""
+    batch = await run_db(crud.get_analysis_batch, batch_id, current_user.id)
+    if not batch:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    await run_db(resume_batch, job_queue, batch.id, ["failed"] if retry_failed else [])
+    return await run_db(batch_status, batch)
+
+def _history_item(item: models.AIAnalysisHistory, summary: bool = False) -> dict:
+    """Transform for frontend compatibility (summary: analysis_excerpt instead of analysis_result)"""
+    item_dict = {
+        "id": item.id,
+        "user_id": item.user_id,
+        "project_id": item.project_id,
+        "model_used": item.model_used,
+        "device_count": item.total_device_count,  # Map total_device_count to device_count
+        "status": item.status,
+        "execution_time_seconds": item.execution_time_seconds,
+        "queue_wait_seconds": item.queue_wait_seconds,
+        "prompt_tokens": item.prompt_tokens,
+        "completion_tokens": item.completion_tokens,
+        "time_to_first_token_ms": item.time_to_first_token_ms,
+        "tokens_per_second": item.tokens_per_second,
+        "created_at": item.created_at
+    }
+    if summary:
+        item_dict["analysis_excerpt"] = item.analysis_excerpt
+    else:
+        item_dict["analysis_result"] = item.analysis_result
+    return item_dict
 
 @router.get("/analysis-history")
 async def get_analysis_history(
     project_id: Optional[int] = None,
     skip: int = 0,
     limit: int = 100,
-    current_user: models.User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    cursor: Optional[str] = None,
+    summary: bool = False,
+    current_user: models.User = Depends(get_current_user)
 ):
-    """Get analysis history with device information"""
-    history_items = crud.get_analysis_history(db, current_user.id, project_id, skip, limit)
-    
-    # Transform for frontend compatibility
-    result = []
-    for item in history_items:
-        item_dict = {
-            "id": item.id,
-            "user_id": item.user_id,
-            "project_id": item.project_id,
-            "model_used": item.model_used,
-            "device_count": item.total_device_count,  # Map total_device_count to device_count
-            "analysis_result": item.analysis_result,
-            "execution_time_seconds": item.execution_time_seconds,
-            "created_at": item.created_at
-        }
-        result.append(item_dict)
+    """Get analysis history with device information
+
+    Offset mode (skip/limit) returns a list. Passing cursor (empty for the first page)
+    switches to keyset mode and returns {"items", "next_cursor"}.
+    summary=true returns a short analysis_excerpt instead of the full analysis_result;
+    fetch the full text from GET /analysis-history/{analysis_id}.
+    """
+    next_cursor = None
+    if cursor is None:
+        history_items = await run_db(crud.get_analysis_history, current_user.id, project_id, skip, limit, summary)
+    else:
+        rows = await run_db(crud.get_analysis_history_page, current_user.id, project_id,
+                            _cursor_position(cursor), limit, summary)
+        history_items, next_cursor = split_page(rows, limit)
     
+    result = [_history_item(item, summary) for item in history_items]
+    if cursor is not None:
+        return {"items": result, "next_cursor": next_cursor}
     return result
 
+@router.get("/analysis-history/{analysis_id}")
+async def get_analysis(
+    analysis_id: int,
+    current_user: models.User = Depends(get_current_user)
+):
+    """Get one analysis with its full analysis_result"""
+    item = await run_db(crud.get_analysis_by_id, analysis_id, current_user.id)
+    if not item:
+        raise HTTPException(status_code=404, detail="Analysis not found")
+    return _history_item(item)
+
 @router.delete("/analysis-history/{analysis_id}")
 async def delete_analysis(
     analysis_id: int,
-    current_user: models.User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: models.User = Depends(get_current_user)
 ):
     """Delete a specific analysis"""
-    success = crud.delete_analysis_history(db, analysis_id, current_user.id)
+    success = await run_db(crud.delete_analysis_history, analysis_id, current_user.id)
     if not success:
         raise HTTPException(status_code=404, detail="Analysis not found")
     return {"message": "Analysis deleted successfully"}
@@ -157,10 +346,9 @@ async def delete_analysis(
 @router.delete("/analysis-history")
 async def delete_all_analysis(
     project_id: Optional[int] = None,
-    current_user: models.User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: models.User = Depends(get_current_user)
 ):
     """Delete all analysis history for user or specific project"""
-    count = crud.delete_all_analysis_history(db, current_user.id, project_id)
+    count = await run_db(crud.delete_all_analysis_history, current_user.id, project_id)
     return {"message": f"Deleted {count} analysis records"}
 
@@ -53,6 +53,11 @@ class Project(ProjectBase):
             datetime: lambda v: v.astimezone(timezone.utc).isoformat().replace('+00:00', 'Z')
         }
 
+class ProjectPage(BaseModel):
+    """หน้าของ GET /projects แบบ cursor (next_cursor = None คือหน้าสุดท้าย)"""
+    items: List[Project]
+    next_cursor: Optional[str] = None
+
 # Removed DeviceType and AnalysisDevice schemas - using JSON instead
 
 # AI Analysis History Schemas
@@ -60,10 +65,21 @@ class AIAnalysisHistoryBase(BaseModel):
     model_used: str
     total_device_count: int
     analysis_result: str
+    status: str = "completed"
     execution_time_seconds: Optional[int] = None
+    queue_wait_seconds: Optional[float] = None
+    prompt_tokens: Optional[int] = None
+    completion_tokens: Optional[int] = None
+    load_duration_ms: Optional[int] = None
+    prompt_eval_duration_ms: Optional[int] = None
+    eval_duration_ms: Optional[int] = None
+    time_to_first_token_ms: Optional[int] = None
+    tokens_per_second: Optional[float] = None
 
 class AIAnalysisHistoryCreate(AIAnalysisHistoryBase):
     project_id: Optional[int] = None
+    topology_snapshot: Optional[Dict[str, Any]] = None
+    base_analysis_id: Optional[int] = None
 
 class AIAnalysisHistory(AIAnalysisHistoryBase):
     id: int
@@ -100,10 +116,39 @@ class AIAnalysisRequest(BaseModel):
 
 class AIAnalysisResponse(BaseModel):
     analysis: str
-    status: str
+    status: str  # สถานะที่บันทึกในประวัติ: completed | failed
     analysis_id: Optional[int] = None
+    # ข้อเท็จจริงเชิงกราฟที่คำนวณในเครื่อง (SPOF, bridges, hop depth, bandwidth ต่อผู้ใช้)
+    facts: Optional[Dict[str, Any]] = None
     timestamp: datetime = datetime.now()
 
+class AIAnalysisJob(BaseModel):
+    job_id: int
+    status: str
+    queue_position: Optional[int] = None
+    project_id: Optional[int] = None
+    analysis_id: Optional[int] = None
+    error: Optional[str] = None
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+class AIAnalysisBatchCreate(BaseModel):
+    # ระบุ project_ids หรือ all_projects=true (ทุก project ของผู้ใช้) อย่างใดอย่างหนึ่ง
+    project_ids: Optional[List[int]] = None
+    all_projects: bool = False
+
+class AIAnalysisBatch(BaseModel):
+    batch_id: int
+    total: int
+    queued: int
+    running: int
+    completed: int
+    failed: int
+    progress: float  # สัดส่วนงานที่จบแล้ว (completed + failed)
+    done: bool
+    created_at: datetime
+
 class NetworkTopologyData(BaseModel):
     nodes: List[Dict[str, Any]]
     edges: List[Dict[str, Any]]
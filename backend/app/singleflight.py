@@ -0,0 +1,57 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    """รวม coroutine ที่มี key เดียวกันและกำลังทำงานอยู่ให้เหลือเพียงงานเดียว
+
+    ผู้เรียกคนแรกเริ่มงานเป็น task แยก ผู้เรียกคนถัดไปที่ key ตรงกันจะรอผลของ task เดิม
+    การยกเลิกของผู้เรียกคนหนึ่งไม่กระทบคนอื่น (ใช้ asyncio.shield)
+    แต่ถ้าผู้เรียกยกเลิกครบทุกคน (เช่น client ปิดหน้าเว็บ) งานจะถูกยกเลิกด้วยเพื่อคืน GPU ของ Ollama
+    """
+
+    def __init__(self):
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._waiters: Dict[asyncio.Task, int] = {}
+        self.leaders = 0
+        self.followers = 0
+        self.cancelled = 0
+
+    def in_flight(self, key: str) -> bool:
+        return key in self._inflight
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]], on_done: Optional[Callable[[], None]] = None) -> Any:
+        """on_done ถูกเรียกเมื่องานที่ผู้เรียกนี้เริ่มจบ (ไม่ใช่เมื่อผู้เรียกเลิกรอ) ใช้ได้เฉพาะเมื่อ key ยังไม่ in_flight"""
+        task = self._inflight.get(key)
+        if task is None:
+            self.leaders += 1
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _t, k=key: self._inflight.pop(k, None))
+            if on_done is not None:
+                task.add_done_callback(lambda _t: on_done())
+        else:
+            self.followers += 1
+            logger.info(f"Joining in-flight request ({key[:12]})")
+        self._waiters[task] = self._waiters.get(task, 0) + 1
+        try:
+            return await asyncio.shield(task)
+        finally:
+            self._waiters[task] -= 1
+            if self._waiters[task] == 0:
+                del self._waiters[task]
+                if not task.done():
+                    logger.info(f"All callers cancelled, aborting in-flight request ({key[:12]})")
+                    self.cancelled += 1
+                    task.cancel()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "in_flight": len(self._inflight),
+            "leaders": self.leaders,
+            "followers": self.followers,
+            "cancelled": self.cancelled
+        }
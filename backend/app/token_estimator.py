@@ -0,0 +1,93 @@
+import math
+import logging
+from collections import Counter
+from typing import Any, Dict, Iterable, List
+
+logger = logging.getLogger(__name__)
+
+# ค่าเฉลี่ยจำนวนตัวอักษรต่อ token (ประมาณแบบ conservative สำหรับ BPE tokenizer ทั่วไป)
+# ภาษาไทยไม่มีช่องว่างระหว่างคำและมักถูกตัดเป็น token สั้นกว่าภาษาอังกฤษมาก
+THAI_CHARS_PER_TOKEN = 2.0
+LATIN_CHARS_PER_TOKEN = 4.0
+DIGITS_PER_TOKEN = 3.0
+SAFETY_MARGIN = 1.1
+
+
+def _is_thai(ch: str) -> bool:
+    return "฀" <= ch <= "๿"
+
+
+def estimate_tokens(text: str) -> int:
+    """ประมาณจำนวน token ของข้อความ (ไม่ต้องโหลด tokenizer ของ model)
+
+    แยกนับตามชนิดตัวอักษร: ภาษาไทย, ตัวอักษรละติน, ตัวเลข, และสัญลักษณ์/emoji (1 token ต่อตัว)
+    ผลลัพธ์เผื่อไว้ SAFETY_MARGIN เพื่อไม่ให้ context window เล็กเกินจริง
+    """
+    thai = latin = digits = symbols = 0
+    for ch in text:
+        if ch.isspace():
+            continue
+        if _is_thai(ch):
+            thai += 1
+        elif ch.isascii() and ch.isalpha():
+            latin += 1
+        elif ch.isdigit():
+            digits += 1
+        else:
+            symbols += 1
+    estimate = (
+        thai / THAI_CHARS_PER_TOKEN
+        + latin / LATIN_CHARS_PER_TOKEN
+        + digits / DIGITS_PER_TOKEN
+        + symbols
+    )
+    return int(math.ceil(estimate * SAFETY_MARGIN))
+
+
+def estimate_messages_tokens(messages: Iterable[Dict[str, Any]]) -> int:
+    """ประมาณ token ของ chat messages (รวม overhead ของ role/template ราว 4 token ต่อข้อความ)"""
+    return sum(estimate_tokens(m.get("content", "")) + 4 for m in messages)
+
+
+def choose_num_ctx(prompt_tokens: int, output_tokens: int, ladder: List[int], headroom_tokens: int = 0) -> int:
+    """เลือก num_ctx ที่เล็กที่สุดจาก ladder ที่รองรับ prompt + output + headroom
+
+    ถ้าใหญ่เกินทุกขั้นจะคืนขั้นที่ใหญ่ที่สุด (Ollama จะตัด prompt ส่วนต้นเอง)
+    """
+    required = prompt_tokens + output_tokens + headroom_tokens
+    sizes = sorted(ladder)
+    for size in sizes:
+        if size >= required:
+            return size
+    logger.warning(f"Prompt needs ~{required} tokens, larger than max num_ctx {sizes[-1]}")
+    return sizes[-1]
+
+
+class ContextSizingStats:
+    """สถิติการเลือก num_ctx (ใช้ปรับ ladder)"""
+
+    def __init__(self):
+        self.num_ctx_counts: Counter = Counter()
+        self.requests = 0
+        self.total_prompt_tokens = 0
+        self.max_prompt_tokens = 0
+        self.last_prompt_tokens = None
+        self.last_num_ctx = None
+
+    def record(self, prompt_tokens: int, num_ctx: int) -> None:
+        self.requests += 1
+        self.num_ctx_counts[num_ctx] += 1
+        self.total_prompt_tokens += prompt_tokens
+        self.max_prompt_tokens = max(self.max_prompt_tokens, prompt_tokens)
+        self.last_prompt_tokens = prompt_tokens
+        self.last_num_ctx = num_ctx
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "num_ctx_counts": {str(k): v for k, v in sorted(self.num_ctx_counts.items())},
+            "avg_prompt_tokens": round(self.total_prompt_tokens / self.requests) if self.requests else 0,
+            "max_prompt_tokens": self.max_prompt_tokens,
+            "last_prompt_tokens": self.last_prompt_tokens,
+            "last_num_ctx": self.last_num_ctx
+        }
@@ -0,0 +1,233 @@
+from collections import OrderedDict, defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+
+from .token_estimator import estimate_tokens
+
+# ตัวคูณแปลง bandwidth/throughput เป็น Mbps
+_UNIT_TO_MBPS = {
+    "kbps": 0.001,
+    "mbps": 1.0,
+    "gbps": 1000.0,
+    "tbps": 1000000.0,
+}
+
+
+def to_mbps(value: Any, unit: Any) -> Optional[float]:
+    """แปลงค่า bandwidth เป็น Mbps (คืน None ถ้าไม่มีค่าหรืออ่านไม่ได้; ไม่ระบุหน่วยถือเป็น Mbps)"""
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    factor = _UNIT_TO_MBPS.get(str(unit or "mbps").strip().lower())
+    if factor is None:
+        return None
+    return number * factor
+
+
+def format_mbps(mbps: float) -> str:
+    if mbps >= 1000:
+        return f"{mbps / 1000:g} Gbps"
+    return f"{mbps:g} Mbps"
+
+
+def _bandwidth_label(data: Dict[str, Any]) -> str:
+    if not data.get("bandwidth"):
+        return ""
+    return f"{data['bandwidth']} {data.get('bandwidthUnit', '')}".strip()
+
+
+def _device_details(data: Dict[str, Any]) -> List[str]:
+    """รายละเอียดอุปกรณ์แบบเดียวกับ summary ของ OllamaService._create_context"""
+    details = []
+    if data.get("maxThroughput"):
+        details.append(f"Throughput: {data['maxThroughput']} {data.get('throughputUnit', '')}".strip())
+    if data.get("userCapacity"):
+        details.append(f"Users: {data['userCapacity']}")
+    if data.get("deviceRole"):
+        details.append(f"Role: {data['deviceRole']}")
+    return details
+
+
+def compact_topology_summary(nodes: List[Dict], edges: List[Dict], token_budget: int) -> str:
+    """สรุป topology แบบกระชับสำหรับแผนผังขนาดใหญ่
+
+    - รวม edge ซ้ำ (parallel edges ระหว่างคู่อุปกรณ์เดียวกัน) เป็นบรรทัดเดียวพร้อมจำนวนเส้น
+    - รวมอุปกรณ์ปลายทาง (leaf) ที่โครงสร้างเหมือนกันภายใต้อุปกรณ์เดียวกัน เช่น
+      "SW-3 -> 40× pc (100 Mbps each, 1 user each)"
+    - สรุปยอดรวมต่ออุปกรณ์ที่มี leaf ต่ออยู่ (จำนวนเครื่อง, ผู้ใช้, bandwidth รวม)
+
+    เนื้อหาถูกเพิ่มตามลำดับความสำคัญที่แน่นอนจนครบ token_budget:
+    ข้อมูลพื้นฐาน > การเชื่อมต่อระหว่างอุปกรณ์หลัก > รายละเอียดอุปกรณ์หลัก > ยอดรวมต่อ switch > กลุ่ม leaf
+    """
+    node_data = {node.get("id"): (node.get("data") or {}) for node in nodes}
+    labels = {node_id: data.get("label", node_id) for node_id, data in node_data.items()}
+
+    # 1) รวม parallel edges ตามคู่ (source, target) โดยไม่สนทิศ
+    merged: "OrderedDict[Tuple[Any, Any], Dict[str, Any]]" = OrderedDict()
+    for edge in edges:
+        source, target = edge.get("source"), edge.get("target")
+        pair = (source, target) if str(source) <= str(target) else (target, source)
+        entry = merged.setdefault(pair, {"source": source, "target": target, "bandwidths": [], "count": 0})
+        entry["count"] += 1
+        bandwidth = _bandwidth_label(edge.get("data") or {})
+        if bandwidth:
+            entry["bandwidths"].append(bandwidth)
+
+    neighbors: Dict[Any, set] = defaultdict(set)
+    for source, target in merged:
+        neighbors[source].add(target)
+        neighbors[target].add(source)
+
+    def is_leaf(node_id) -> bool:
+        return len(neighbors[node_id]) == 1
+
+    # 2) แยก edge ที่ไปยัง leaf ออกเป็นกลุ่มตามโครงสร้างที่เหมือนกัน
+    infra_lines: List[str] = []
+    groups: "OrderedDict[Tuple, List[Any]]" = OrderedDict()
+    for (a, b), entry in merged.items():
+        leaf, parent = None, None
+        if is_leaf(b) and not is_leaf(a):
+            leaf, parent = b, a
+        elif is_leaf(a) and not is_leaf(b):
+            leaf, parent = a, b
+        if leaf is None:
+            line = f"{labels.get(entry['source'], entry['source'])} -> {labels.get(entry['target'], entry['target'])}"
+            if entry["bandwidths"]:
+                line += f" [{', '.join(sorted(set(entry['bandwidths'])))}]"
+            if entry["count"] > 1:
+                line += f" ×{entry['count']} เส้น"
+            infra_lines.append(line)
+            continue
+        data = node_data.get(leaf, {})
+        signature = (
+            parent,
+            entry["source"] == parent,  # ทิศของลูกศร
+            data.get("deviceType", "Unknown"),
+            tuple(_device_details(data)),
+            tuple(sorted(set(entry["bandwidths"]))),
+            entry["count"],
+        )
+        groups.setdefault(signature, []).append(leaf)
+
+    # leaf ที่ไม่มีตัวซ้ำ (เช่น ISP, Server ตัวเดียว) ไม่ต้องรวมกลุ่ม ให้แสดงเป็นอุปกรณ์หลักตามปกติ
+    grouped_leaves = set()
+    for signature in list(groups):
+        members = groups[signature]
+        if len(members) > 1:
+            grouped_leaves.update(members)
+            continue
+        del groups[signature]
+        parent, parent_is_source, _, _, bandwidths, count = signature
+        leaf = members[0]
+        source, target = (parent, leaf) if parent_is_source else (leaf, parent)
+        line = f"{labels.get(source, source)} -> {labels.get(target, target)}"
+        if bandwidths:
+            line += f" [{', '.join(bandwidths)}]"
+        if count > 1:
+            line += f" ×{count} เส้น"
+        infra_lines.append(line)
+
+    # 3) สรุปยอดรวมต่ออุปกรณ์ที่มี leaf ต่ออยู่
+    aggregates: "OrderedDict[Any, Dict[str, Any]]" = OrderedDict()
+    for (parent, _, _, _, bandwidths, count), members in groups.items():
+        agg = aggregates.setdefault(parent, {"leaves": 0, "users": 0, "mbps": 0.0})
+        agg["leaves"] += len(members)
+        for member in members:
+            try:
+                agg["users"] += int(node_data.get(member, {}).get("userCapacity") or 0)
+            except (TypeError, ValueError):
+                pass
+        for bandwidth in bandwidths:
+            value, _, unit = bandwidth.partition(" ")
+            mbps = to_mbps(value, unit)
+            if mbps:
+                agg["mbps"] += mbps * len(members) * count / len(bandwidths)
+
+    group_lines = []
+    # กลุ่มใหญ่ก่อน แล้วเรียงตามชื่ออุปกรณ์แม่ (ลำดับแน่นอนทุกครั้ง)
+    ordered_groups = sorted(
+        groups.items(),
+        key=lambda item: (-len(item[1]), str(labels.get(item[0][0], item[0][0])), str(item[0][2]))
+    )
+    for (parent, parent_is_source, device_type, details, bandwidths, count), members in ordered_groups:
+        parent_label = labels.get(parent, parent)
+        examples = ", ".join(str(labels.get(m, m)) for m in members[:3])
+        more = ", ..." if len(members) > 3 else ""
+        target = f"{len(members)}× {device_type} ({examples}{more})"
+        line = f"{parent_label} -> {target}" if parent_is_source else f"{target} -> {parent_label}"
+        attrs = []
+        if bandwidths:
+            attrs.append(f"{', '.join(bandwidths)} each")
+        if count > 1:
+            attrs.append(f"{count} links each")
+        if details:
+            attrs.append(f"{', '.join(details)} each")
+        if attrs:
+            line += f" [{'; '.join(attrs)}]"
+        group_lines.append(line)
+
+    aggregate_lines = []
+    for parent, agg in aggregates.items():
+        line = (
+            f"{labels.get(parent, parent)}: {len(neighbors[parent])} การเชื่อมต่อ, "
+            f"อุปกรณ์ปลายทาง {agg['leaves']} เครื่อง"
+        )
+        if agg["users"]:
+            line += f", ผู้ใช้รวม {agg['users']}"
+        if agg["mbps"]:
+            line += f", bandwidth ขาลงรวม {format_mbps(agg['mbps'])}"
+        aggregate_lines.append(line)
+
+    infra_detail_lines = []
+    for node in nodes:
+        node_id = node.get("id")
+        if node_id in grouped_leaves:
+            continue
+        data = node_data.get(node_id, {})
+        details = _device_details(data)
+        if details:
+            infra_detail_lines.append(f"{labels.get(node_id, node_id)} ({data.get('deviceType', 'Unknown')}): {', '.join(details)}")
+
+    # 4) ประกอบตามลำดับความสำคัญภายใต้ token budget
+    device_types: Dict[str, int] = {}
+    for data in node_data.values():
+        device_type = data.get("deviceType", "Unknown")
+        device_types[device_type] = device_types.get(device_type, 0) + 1
+    header = [
+        f"จำนวนอุปกรณ์: {len(nodes)}",
+        f"จำนวนการเชื่อมต่อ: {len(edges)} (ไม่ซ้ำ {len(merged)} คู่)",
+    ]
+    if device_types:
+        header.append(f"ประเภทอุปกรณ์: {', '.join(f'{k}: {v}' for k, v in device_types.items())}")
+    header.append("(สรุปแบบกระชับ: อุปกรณ์ปลายทางที่เหมือนกันถูกรวมเป็นกลุ่ม)")
+
+    sections = [
+        ("การเชื่อมต่อระหว่างอุปกรณ์หลัก:", infra_lines),
+        ("รายละเอียดอุปกรณ์หลัก:", infra_detail_lines),
+        ("ยอดรวมต่ออุปกรณ์:", aggregate_lines),
+        ("อุปกรณ์ปลายทาง (รวมกลุ่ม):", group_lines),
+    ]
+
+    parts = list(header)
+    used = estimate_tokens("\n".join(parts))
+    omitted = 0
+    for title, lines in sections:
+        if not lines:
+            continue
+        title_cost = estimate_tokens(title)
+        if omitted or used + title_cost > token_budget:
+            omitted += len(lines)
+            continue
+        parts.append(f"\n{title}")
+        used += title_cost
+        for index, line in enumerate(lines):
+            cost = estimate_tokens(line)
+            if used + cost > token_budget:
+                omitted += len(lines) - index
+                break
+            parts.append(line)
+            used += cost
+
+    if omitted:
+        parts.append(f"\n(ละไว้อีก {omitted} รายการเนื่องจากเกินงบ token)")
+    return "\n".join(parts)
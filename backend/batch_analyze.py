@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Re-run AI analysis over many saved projects (e.g. after a prompt or model change)
+
+    python batch_analyze.py --projects 1 2 3
+    python batch_analyze.py --user 5 --concurrency 2
+    python batch_analyze.py --resume 12 --retry-failed
+
+Each project's current diagram_data is analyzed and saved to ai_analysis_history
+like any other analysis. Progress is kept in ai_analysis_jobs, so a run that was
+stopped (Ctrl+C, crash) continues with --resume <batch id>. Jobs are leased by the
+process working on them (ANALYSIS_JOB_LEASE_SECONDS, renewed while it runs), so the
+API server and other runs skip them; jobs of a crashed run are picked up once
+their lease expires.
+"""
+
+import sys
+import asyncio
+import argparse
+import logging
+
+from app import crud, models
+from app.config import settings
+from app.database import SessionLocal, engine
+from app.ai_service import analyzer
+from app.http_client import http_client
+from app.analysis_jobs import AnalysisJobQueue
+from app.analysis_batches import batch_status, create_batch, resume_batch, submit_batch
+
+
+def print_progress(batch_id: int) -> None:
+    """พิมพ์ความคืบหน้า (ใช้ session สั้น ๆ ไม่ให้ค้าง lock ของ SQLite ระหว่าง worker บันทึกผล)"""
+    db = SessionLocal()
+    try:
+        status = batch_status(db, crud.get_analysis_batch(db, batch_id))
+    finally:
+        db.close()
+    finished = status.completed + status.failed
+    print(
+        f"[{finished}/{status.total}] {status.progress:.0%} "
+        f"completed={status.completed} failed={status.failed} running={status.running} queued={status.queued}",
+        flush=True
+    )
+
+
+def unfinished_jobs(batch_id: int) -> int:
+    db = SessionLocal()
+    try:
+        status = batch_status(db, crud.get_analysis_batch(db, batch_id))
+    finally:
+        db.close()
+    return status.queued + status.running
+
+
+async def run(args: argparse.Namespace) -> int:
+    db = SessionLocal()
+    try:
+        if args.resume is not None:
+            batch = crud.get_analysis_batch(db, args.resume)
+            if batch is None:
+                print(f"Batch {args.resume} not found", file=sys.stderr)
+                return 2
+        else:
+            batch = create_batch(db, None, owner_id=args.user, project_ids=args.projects)
+        batch_id = batch.id
+        print(f"Batch {batch_id}: {batch.total_jobs} projects")
+    finally:
+        db.close()
+
+    # process นี้ทำเฉพาะงานของ batch: ให้ scheduler ยอมให้งานของผู้ใช้คนเดียวกันทำพร้อมกันได้ตาม --concurrency
+    settings.ANALYSIS_MAX_CONCURRENT = args.concurrency
+    settings.ANALYSIS_USER_MAX_CONCURRENT = args.concurrency
+
+    queue = AnalysisJobQueue(worker_count=args.concurrency)
+    await http_client.open()
+    analyzer.ollama_service.pool.start()
+    await queue.start(requeue=False)
+    try:
+        db = SessionLocal()
+        try:
+            if args.resume is not None:
+                # งาน running ของ run ก่อนหน้าถูกรับต่อเมื่อ lease หมดอายุ
+                submitted = resume_batch(db, queue, batch_id, ["failed"] if args.retry_failed else [])
+            else:
+                submitted = submit_batch(db, queue, batch_id)
+        finally:
+            db.close()
+        print(f"Submitted {submitted} jobs with concurrency {args.concurrency}")
+        held = unfinished_jobs(batch_id) - submitted
+        if held > 0:
+            print(f"{held} unfinished jobs are leased by another process and were skipped "
+                  f"(leases expire {settings.ANALYSIS_JOB_LEASE_SECONDS}s after that process stops)")
+
+        join = asyncio.create_task(queue.join())
+        while not join.done():
+            await asyncio.wait({join}, timeout=args.progress_interval)
+            print_progress(batch_id)
+    finally:
+        await queue.stop()
+        await analyzer.ollama_service.pool.stop()
+        await http_client.close()
+
+    db = SessionLocal()
+    try:
+        status = batch_status(db, crud.get_analysis_batch(db, batch_id))
+    finally:
+        db.close()
+    if status.failed:
+        print(f"{status.failed} jobs failed, retry with: python batch_analyze.py --resume {batch_id} --retry-failed")
+    return 1 if status.failed else 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--projects", type=int, nargs="+", metavar="ID", help="project ids to analyze")
+    parser.add_argument("--user", type=int, metavar="ID", help="analyze all projects owned by this user id")
+    parser.add_argument("--resume", type=int, metavar="BATCH_ID", help="continue an earlier batch")
+    parser.add_argument("--retry-failed", action="store_true", help="with --resume, also re-run failed jobs")
+    parser.add_argument("--concurrency", type=int, default=settings.ANALYSIS_WORKER_COUNT, help="parallel analyses")
+    parser.add_argument("--progress-interval", type=float, default=10.0, help="seconds between progress lines")
+    args = parser.parse_args()
+    if args.resume is None and args.projects is None and args.user is None:
+        parser.error("specify --projects, --user or --resume")
+    if args.resume is not None and (args.projects or args.user):
+        parser.error("--resume cannot be combined with --projects or --user")
+    args.concurrency = max(1, args.concurrency)
+
+    logging.basicConfig(level=logging.WARNING, format="%(levelname)s %(name)s: %(message)s")
+    models.Base.metadata.create_all(bind=engine)
+    try:
+        return asyncio.run(run(args))
+    except KeyboardInterrupt:
+        print("Interrupted, unfinished jobs stay queued (continue with --resume)")
+        return 130
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Batch re-analysis check while Ollama answers every chat request with an error
+
+Runs the real app (job queue workers included) against a temporary SQLite
+database and a fake Ollama started with --error-rate 1:
+
+    1. POST /api/analyze/batches {"all_projects": true}: every job must end
+       "failed" with an error, and the batch must count them as failed
+    2. fake Ollama restarted without errors, then
+       POST /api/analyze/batches/{id}/resume?retry_failed=true: every job must
+       be retried and end "completed"
+
+Exits with status 1 if any check fails.
+
+Run from the backend directory:
+    python benchmarks/check_batch_failures.py --projects 3
+"""
+
+import os
+import sys
+import time
+import socket
+import argparse
+import tempfile
+import subprocess
+from typing import Any, Dict, List
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS))
+
+from db_loop_lag import make_diagram
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_fake(port: int, error_rate: float) -> subprocess.Popen:
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(BENCHMARKS, "fake_ollama.py"), "--port", str(port), "--error-rate", str(error_rate)],
+        stdout=subprocess.DEVNULL
+    )
+    for _ in range(50):
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.1).close()
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise SystemExit("fake Ollama did not start")
+
+
+def wait_for_batch(client, batch_id: int, timeout: float = 60.0) -> Dict[str, Any]:
+    deadline = time.monotonic() + timeout
+    while True:
+        batch = client.get(f"/api/analyze/batches/{batch_id}").json()
+        if batch["done"] or time.monotonic() > deadline:
+            return batch
+        time.sleep(0.2)
+
+
+def check(failures: List[str], condition: bool, message: str) -> None:
+    print(f"{'ok' if condition else 'FAIL':>4}  {message}")
+    if not condition:
+        failures.append(message)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--projects", type=int, default=3)
+    args = parser.parse_args()
+
+    tmpdir = tempfile.TemporaryDirectory()
+    port = free_port()
+    # ต้องตั้งก่อน import app (Settings อ่าน environment ตอน import)
+    os.environ.update({
+        "DATABASE_URL": f"sqlite:///{os.path.join(tmpdir.name, 'check_batch_failures.db')}",
+        "OLLAMA_BASE_URL": f"http://127.0.0.1:{port}",
+        "OLLAMA_BACKENDS": "[]",
+        "ANALYSIS_CACHE_ENABLED": "false",
+        "OLLAMA_BREAKER_RECOVERY_SECONDS": "0",
+        "ANALYSIS_RATE_BURST": "100",
+    })
+
+    from fastapi.testclient import TestClient
+    from app.main import app
+    from app import models
+
+    failures: List[str] = []
+    fake = start_fake(port, error_rate=1.0)
+    try:
+        with TestClient(app) as client:
+            client.post("/auth/register", json={"email": "batch@example.com", "username": "batch", "password": "batch"})
+            token = client.post("/auth/token", data={"username": "batch@example.com", "password": "batch"}).json()
+            client.headers["Authorization"] = f"Bearer {token['access_token']}"
+            for i in range(args.projects):
+                client.post("/api/projects", json={"name": f"batch-{i}", "diagram_data": make_diagram(5, i)})
+
+            batch = client.post("/api/analyze/batches", json={"all_projects": True}).json()
+            batch = wait_for_batch(client, batch["batch_id"])
+            check(failures, batch["done"], f"batch finished during the outage: {batch}")
+            check(failures, batch["failed"] == args.projects and batch["completed"] == 0,
+                  f"all {args.projects} jobs counted as failed")
+
+            from app.database import SessionLocal
+            db = SessionLocal()
+            try:
+                jobs = db.query(models.AIAnalysisJob).filter(models.AIAnalysisJob.batch_id == batch["batch_id"]).all()
+                check(failures, all(job.status == "failed" and job.error for job in jobs), "every job has an error message")
+                history = db.query(models.AIAnalysisHistory.status).all()
+                check(failures, [status for (status,) in history] == ["failed"] * args.projects,
+                      "history rows saved as failed")
+            finally:
+                db.close()
+
+            fake.kill()
+            fake.wait()
+            fake = start_fake(port, error_rate=0.0)
+            resumed = client.post(f"/api/analyze/batches/{batch['batch_id']}/resume", params={"retry_failed": "true"}).json()
+            check(failures, resumed["failed"] == 0 and resumed["queued"] + resumed["running"] == args.projects,
+                  f"retry_failed requeued the failed jobs: {resumed}")
+            batch = wait_for_batch(client, batch["batch_id"])
+            check(failures, batch["completed"] == args.projects and batch["failed"] == 0,
+                  f"retried jobs completed after Ollama recovered: {batch}")
+    finally:
+        fake.kill()
+        tmpdir.cleanup()
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
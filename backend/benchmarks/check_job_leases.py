@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Job lease check: two job queues on one database, as when the API server restarts
+while batch_analyze.py is working on a batch
+
+Runs against a temporary SQLite database and an in-process fake Ollama (slow
+enough that the batch takes a few seconds):
+
+    1. queue "cli" leases and works on a batch
+    2. queue "server" starts (startup requeue) and resubmits the batch while "cli"
+       is alive: it must not take any job
+    3. "cli" stops without releasing its leases (crash); once the leases expire
+       "server" must take the unfinished jobs and finish them
+    4. every project ends with exactly one completed analysis
+
+Exits with status 1 if any check fails.
+
+Run from the backend directory:
+    python benchmarks/check_job_leases.py --projects 4
+"""
+
+import os
+import sys
+import asyncio
+import argparse
+import tempfile
+from typing import List
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS))
+
+from db_loop_lag import make_diagram
+from fake_ollama import FakeOllama
+
+LEASE_SECONDS = 1
+
+
+def check(failures: List[str], condition: bool, message: str) -> None:
+    print(f"{'ok' if condition else 'FAIL':>4}  {message}")
+    if not condition:
+        failures.append(message)
+
+
+async def run(args: argparse.Namespace, failures: List[str]) -> None:
+    from app import crud, models, schemas
+    from app.database import SessionLocal, engine
+    from app.ai_service import analyzer
+    from app.http_client import http_client
+    from app.analysis_jobs import AnalysisJobQueue
+    from app.analysis_batches import create_batch, submit_batch
+
+    fake = FakeOllama(first_token_latency=args.latency)
+    await fake.start()
+    analyzer.ollama_service.pool.primary.url = f"http://127.0.0.1:{fake.port}"
+    models.Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        user = crud.create_user(db, schemas.UserCreate(email="lease@example.com", username="lease", password="lease"))
+        for i in range(args.projects):
+            crud.create_project(db, schemas.ProjectCreate(name=f"lease-{i}", diagram_data=make_diagram(5, i)), user.id)
+        batch_id = create_batch(db, None, owner_id=user.id).id
+    finally:
+        db.close()
+
+    def counts():
+        db = SessionLocal()
+        try:
+            return crud.count_batch_jobs_by_status(db, batch_id)
+        finally:
+            db.close()
+
+    def with_db(fn, *fn_args):
+        db = SessionLocal()
+        try:
+            return fn(db, *fn_args)
+        finally:
+            db.close()
+
+    await http_client.open()
+    cli, server = AnalysisJobQueue(worker_count=1), AnalysisJobQueue(worker_count=1)
+    try:
+        await cli.start(requeue=False)
+        check(failures, with_db(submit_batch, cli, batch_id) == args.projects, f"cli submitted {args.projects} jobs")
+        await asyncio.sleep(0.5)
+
+        await server.start()
+        check(failures, server._queue.qsize() == 0, "server startup did not requeue jobs leased by cli")
+        # หลายรอบของการต่ออายุ lease: งานต้องยังเป็นของ cli
+        await asyncio.sleep(LEASE_SECONDS * 2)
+        check(failures, with_db(submit_batch, server, batch_id) == 0, "server resume skipped jobs leased by cli")
+        check(failures, counts().get("running", 0) <= 1, f"at most one job running (cli concurrency 1): {counts()}")
+
+        # cli ตายโดยไม่คืน lease
+        cli._heartbeat.cancel()
+        for worker in cli._workers:
+            worker.cancel()
+        await asyncio.gather(cli._heartbeat, *cli._workers, return_exceptions=True)
+        cli._workers = []
+        finished_by_cli = counts().get("completed", 0)
+        check(failures, finished_by_cli < args.projects, f"cli stopped with unfinished jobs: {counts()}")
+        check(failures, with_db(submit_batch, server, batch_id) == 0, "server waits while the cli leases are valid")
+
+        await asyncio.sleep(LEASE_SECONDS + 0.5)
+        taken = with_db(submit_batch, server, batch_id)
+        check(failures, taken == args.projects - finished_by_cli, f"server took {taken} jobs after the leases expired")
+        await server.join()
+        check(failures, counts() == {"completed": args.projects}, f"all jobs completed: {counts()}")
+
+        db = SessionLocal()
+        try:
+            completed = db.query(models.AIAnalysisHistory.project_id)\
+                .filter(models.AIAnalysisHistory.status == "completed").all()
+        finally:
+            db.close()
+        check(failures, sorted(project_id for (project_id,) in completed) == list(range(1, args.projects + 1)),
+              "exactly one completed analysis per project")
+    finally:
+        await server.stop()
+        await http_client.close()
+        await fake.stop()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--projects", type=int, default=4)
+    parser.add_argument("--latency", type=float, default=1.5, help="seconds the fake Ollama takes per analysis")
+    args = parser.parse_args()
+
+    tmpdir = tempfile.TemporaryDirectory()
+    # ต้องตั้งก่อน import app (Settings อ่าน environment ตอน import)
+    os.environ.update({
+        "DATABASE_URL": f"sqlite:///{os.path.join(tmpdir.name, 'check_job_leases.db')}",
+        "OLLAMA_BACKENDS": "[]",
+        "ANALYSIS_CACHE_ENABLED": "false",
+        "INCREMENTAL_ANALYSIS_ENABLED": "false",
+        "ANALYSIS_JOB_LEASE_SECONDS": str(LEASE_SECONDS),
+    })
+
+    failures: List[str] = []
+    try:
+        asyncio.run(run(args, failures))
+    finally:
+        tmpdir.cleanup()
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Query-plan check for the history and project access patterns (offset and cursor pages)
+
+Runs the real crud functions against a SQLite database, captures the SQL they
+emit and checks EXPLAIN QUERY PLAN: each query must search the expected index
+and must not sort in a temporary B-tree. Exits with status 1 if any check fails.
+
+Run from the backend directory (default: temporary database built with
+create_all and filled with --rows history rows):
+    python benchmarks/check_query_plans.py
+    python benchmarks/check_query_plans.py --database-url sqlite:////tmp/migrated.db   # after alembic upgrade
+"""
+
+import os
+import sys
+import argparse
+import tempfile
+from datetime import datetime
+from typing import Callable, List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import event, text
+from sqlalchemy.orm import sessionmaker
+
+from app import crud, models
+from app.database import create_db_engine
+
+# ตำแหน่ง cursor กลางข้อมูล (หน้าถัด ๆ ไปต้องใช้ index เดียวกับหน้าแรก)
+AFTER = (datetime(2026, 1, 1), 1000)
+
+# (ชื่อ, การเรียก crud, index ที่ต้องใช้ในตารางหลัก: ชื่อเดียว หรือ "a|b" = ใช้อันใดก็ได้)
+CHECKS: List[Tuple[str, Callable, str]] = [
+    ("history of a user", lambda db: crud.get_analysis_history(db, 1, None, 0, 20),
+     "ix_ai_analysis_history_user_created"),
+    ("history of a project", lambda db: crud.get_analysis_history(db, 1, 2, 0, 20),
+     "ix_ai_analysis_history_user_project_created"),
+    ("latest snapshot of a project", lambda db: crud.get_latest_analysis_snapshot(db, 1, 2),
+     "ix_ai_analysis_history_user_project_created"),
+    ("projects of a user", lambda db: crud.get_projects(db, 1, 0, 20),
+     "ix_projects_owner_created|sqlite_autoindex_projects_1"),
+    ("history cursor page of a user", lambda db: crud.get_analysis_history_page(db, 1, None, AFTER, 20),
+     "ix_ai_analysis_history_user_created"),
+    ("history cursor page of a project", lambda db: crud.get_analysis_history_page(db, 1, 2, AFTER, 20),
+     "ix_ai_analysis_history_user_project_created"),
+    ("history summary page of a user", lambda db: crud.get_analysis_history_page(db, 1, None, AFTER, 20, summary=True),
+     "ix_ai_analysis_history_user_created"),
+    ("projects cursor page of a user", lambda db: crud.get_projects_page(db, 1, AFTER, 20),
+     "ix_projects_owner_created"),
+]
+
+
+def seed(Session, rows: int) -> None:
+    db = Session()
+    try:
+        if db.query(models.User).count():
+            return
+        db.add_all([models.User(id=user_id, email=f"u{user_id}@example.com", username=f"u{user_id}",
+                                hashed_password="x") for user_id in range(1, 11)])
+        db.add_all([models.Project(id=project_id, name=f"p{project_id}", owner_id=project_id % 10 + 1)
+                    for project_id in range(1, 101)])
+        db.flush()
+        db.bulk_insert_mappings(models.AIAnalysisHistory, [
+            {"user_id": index % 10 + 1, "project_id": index % 100 + 1, "model_used": "m",
+             "total_device_count": 1, "analysis_result": "", "status": "completed"}
+            for index in range(rows)
+        ])
+        db.commit()
+        # สถิติให้ planner เลือก index แบบเดียวกับฐานข้อมูลจริงที่มีข้อมูลมาก
+        db.execute(text("ANALYZE"))
+    finally:
+        db.close()
+
+
+def query_plan(engine, Session, call: Callable) -> List[str]:
+    """EXPLAIN QUERY PLAN ของทุก SELECT ที่ crud function ส่งออกไป"""
+    captured = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT"):
+            captured.append((statement, parameters))
+
+    event.listen(engine, "before_cursor_execute", capture)
+    db = Session()
+    try:
+        call(db)
+    finally:
+        db.close()
+        event.remove(engine, "before_cursor_execute", capture)
+
+    details = []
+    with engine.connect() as conn:
+        for statement, parameters in captured:
+            rows = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters).fetchall()
+            details.extend(row[-1] for row in rows)
+    return details
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", default=None, help="default: temporary SQLite file")
+    parser.add_argument("--rows", type=int, default=20000, help="history rows to seed into the temporary database")
+    args = parser.parse_args()
+
+    tmpdir = tempfile.TemporaryDirectory()
+    url = args.database_url or f"sqlite:///{os.path.join(tmpdir.name, 'query_plans.db')}"
+    engine = create_db_engine(url)
+    Session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    if args.database_url is None:
+        models.Base.metadata.create_all(bind=engine)
+        seed(Session, args.rows)
+
+    failures = 0
+    try:
+        for name, call, index in CHECKS:
+            plan = query_plan(engine, Session, call)
+            problems = []
+            if not any(name in line for name in index.split("|") for line in plan):
+                problems.append(f"does not use {index}")
+            if any("USE TEMP B-TREE" in line for line in plan):
+                problems.append("sorts in a temporary B-tree")
+            failures += bool(problems)
+            print(f"{'FAIL' if problems else 'ok':>4}  {name}: {'; '.join(problems) or index}")
+            for line in plan:
+                print(f"        {line}")
+    finally:
+        engine.dispose()
+        tmpdir.cleanup()
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Event-loop lag while large projects are being saved
+
+Several concurrent "autosave" tasks repeatedly write a large diagram_data JSON
+through crud.update_project against a temporary SQLite database, while a
+monitor measures how late the event loop wakes up (the delay every in-flight
+stream and health check would see). Two modes are compared:
+
+    inline    crud called directly on the event loop (how async routes used to call it)
+    executor  crud called through app.db_executor.run_db (bounded DB thread pool)
+
+Run from the backend directory:
+    python benchmarks/db_loop_lag.py --savers 4 --nodes 3000 --duration 5
+"""
+
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+from typing import Any, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from load_test import LoopLagMonitor, percentile
+
+
+def make_diagram(nodes: int, revision: int) -> Dict[str, List[Dict[str, Any]]]:
+    return {
+        "nodes": [
+            {
+                "id": f"n{i}",
+                "position": {"x": i * 10 + revision, "y": i % 40 * 25},
+                "data": {"label": f"PC-{i}", "deviceType": "pc", "userCapacity": 1 + i % 5}
+            }
+            for i in range(nodes)
+        ],
+        "edges": [
+            {"id": f"e{i}", "source": "core", "target": f"n{i}", "data": {"bandwidth": 1000, "bandwidthUnit": "Mbps"}}
+            for i in range(nodes)
+        ],
+    }
+
+
+async def run_mode(mode: str, args: argparse.Namespace, project_ids: List[int], owner_id: int) -> Dict[str, float]:
+    from app import crud, schemas
+    from app.database import SessionLocal
+    from app.db_executor import run_db
+
+    saves = 0
+    # สร้าง payload ไว้ก่อน ให้ค่า lag สะท้อนเฉพาะงาน DB (JSON encode + commit) ไม่รวมการสร้างข้อมูล
+    updates = [schemas.ProjectUpdate(diagram_data=make_diagram(args.nodes, revision)) for revision in range(2)]
+    deadline = time.monotonic() + args.duration
+
+    async def saver(project_id: int) -> None:
+        nonlocal saves
+        revision = 0
+        while time.monotonic() < deadline:
+            revision += 1
+            update = updates[revision % 2]
+            if mode == "inline":
+                db = SessionLocal()
+                try:
+                    crud.update_project(db, project_id, update, owner_id)
+                finally:
+                    db.close()
+                # ให้ task อื่นได้ทำงานระหว่างรอบ (เหมือน request ถัดไปของ client)
+                await asyncio.sleep(0)
+            else:
+                await run_db(crud.update_project, project_id, update, owner_id)
+            saves += 1
+
+    monitor = LoopLagMonitor(interval=0.01)
+    lag_task = asyncio.create_task(monitor.run())
+    started = time.monotonic()
+    await asyncio.gather(*(saver(project_id) for project_id in project_ids))
+    wall = time.monotonic() - started
+    lag_task.cancel()
+    lag = monitor.samples or [0.0]
+    return {
+        "saves_per_second": saves / wall,
+        "mean_ms": sum(lag) / len(lag) * 1000,
+        "p99_ms": percentile(lag, 99) * 1000,
+        "max_ms": max(lag) * 1000,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--savers", type=int, default=4, help="concurrent autosave tasks (one project each)")
+    parser.add_argument("--nodes", type=int, default=3000, help="devices per saved diagram")
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds per mode")
+    parser.add_argument("--modes", nargs="+", choices=["inline", "executor"], default=["inline", "executor"])
+    args = parser.parse_args()
+
+    tmpdir = tempfile.TemporaryDirectory()
+    # ต้องตั้งก่อน import app (Settings อ่าน environment ตอน import)
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tmpdir.name, 'db_loop_lag.db')}"
+
+    from app import crud, models, schemas
+    from app.database import SessionLocal, engine
+    from app.db_executor import db_executor
+
+    models.Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        user = crud.create_user(db, schemas.UserCreate(email="bench@example.com", username="bench", password="bench"))
+        project_ids = [
+            crud.create_project(db, schemas.ProjectCreate(name=f"bench-{i}"), user.id).id for i in range(args.savers)
+        ]
+        owner_id = user.id
+    finally:
+        db.close()
+
+    payload_kb = len(schemas.ProjectUpdate(diagram_data=make_diagram(args.nodes, 0)).model_dump_json()) / 1024
+    print(f"savers={args.savers}  diagram={payload_kb:.0f} KB  duration={args.duration}s  "
+          f"db_threads={db_executor.max_workers}")
+    print(f"{'mode':>9} {'saves/s':>8} {'lag mean ms':>12} {'lag p99 ms':>11} {'lag max ms':>11}")
+    try:
+        for mode in args.modes:
+            result = asyncio.run(run_mode(mode, args, project_ids, owner_id))
+            print(f"{mode:>9} {result['saves_per_second']:>8.1f} {result['mean_ms']:>12.1f} "
+                  f"{result['p99_ms']:>11.1f} {result['max_ms']:>11.1f}")
+    finally:
+        db_executor.shutdown()
+        engine.dispose()
+        tmpdir.cleanup()
+
+
+if __name__ == "__main__":
+    main()
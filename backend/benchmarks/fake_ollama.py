@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+"""
+Local Ollama stand-in for benchmarks (no GPU required)
+
+Fakes the endpoints OllamaService uses and records every chat request so
+benchmarks can inspect exactly what the backend sent.
+
+Generation can be shaped to look like a real GPU box:
+    --first-token-latency  seconds before the first token (prompt processing)
+    --token-rate           tokens per second after that (0 = instant)
+    --error-rate           fraction of chat requests answered with --error-status
+    --num-parallel         requests generated at once, the rest wait (like OLLAMA_NUM_PARALLEL; 0 = unlimited)
+
+Record/replay of real responses:
+    --record FILE --upstream http://gpu-box:11434
+        forward every chat request to a real Ollama and append the reply to FILE
+    --replay FILE
+        answer with the recorded reply for the same messages (default reply if
+        the messages were never recorded), paced by the options above
+
+Run standalone from the backend directory:
+    python benchmarks/fake_ollama.py --port 11434 --first-token-latency 2 --token-rate 30
+"""
+
+import json
+import random
+import asyncio
+import hashlib
+import argparse
+from contextlib import nullcontext
+from typing import Any, Dict, List, Optional
+
+import aiohttp
+from aiohttp import web
+
+DEFAULT_REPLY = "## 1. การจัดวางอุปกรณ์ตามหลักการ Layer ของเครือข่าย\n\nผลการวิเคราะห์จำลองจาก fake Ollama"
+
+
+def recording_key(body: Dict[str, Any]) -> str:
+    """key ของ request ที่ใช้จับคู่ตอน replay (ขึ้นกับ messages เท่านั้น ไม่สนตัวเลือกอย่าง num_ctx)"""
+    messages = json.dumps(body.get("messages", []), ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(messages.encode("utf-8")).hexdigest()
+
+
+class FakeOllama:
+    def __init__(
+        self,
+        reply: str = DEFAULT_REPLY,
+        model: str = "gpt-oss:latest",
+        first_token_latency: float = 0.0,
+        token_rate: float = 0.0,
+        error_rate: float = 0.0,
+        error_status: int = 500,
+        num_parallel: int = 0,
+        record_path: Optional[str] = None,
+        upstream: Optional[str] = None,
+        replay_path: Optional[str] = None,
+        seed: Optional[int] = None
+    ):
+        self.reply = reply
+        self.model = model
+        self.first_token_latency = first_token_latency
+        self.token_rate = token_rate
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.num_parallel = num_parallel
+        self._slots = asyncio.Semaphore(num_parallel) if num_parallel else nullcontext()
+        self.record_path = record_path
+        self.upstream = upstream.rstrip("/") if upstream else None
+        self.recordings: Dict[str, str] = self._load_recordings(replay_path) if replay_path else {}
+        self.random = random.Random(seed)
+        self.requests: List[Dict[str, Any]] = []
+        self.errors_injected = 0
+        self.app = web.Application()
+        self.app.router.add_get("/v1/models", self.handle_models)
+        self.app.router.add_get("/api/tags", self.handle_tags)
+        self.app.router.add_post("/v1/chat/completions", self.handle_openai_chat)
+        self.app.router.add_post("/api/chat", self.handle_native_chat)
+        self._runner: Optional[web.AppRunner] = None
+        self.port: Optional[int] = None
+
+    @staticmethod
+    def _load_recordings(path: str) -> Dict[str, str]:
+        recordings = {}
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    recordings[entry["key"]] = entry["content"]
+        return recordings
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    async def start(self, port: int = 0) -> None:
+        self._runner = web.AppRunner(self.app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    async def handle_models(self, request: web.Request) -> web.Response:
+        return web.json_response({"object": "list", "data": [{"id": self.model, "object": "model"}]})
+
+    async def handle_tags(self, request: web.Request) -> web.Response:
+        return web.json_response({"models": [{"name": self.model}]})
+
+    def _inject_error(self) -> Optional[web.Response]:
+        if self.error_rate and self.random.random() < self.error_rate:
+            self.errors_injected += 1
+            return web.json_response({"error": "injected error"}, status=self.error_status)
+        return None
+
+    async def _reply_for(self, endpoint: str, body: Dict[str, Any]) -> str:
+        """คำตอบของ request: จาก Ollama จริง (record), จากไฟล์ (replay) หรือ reply คงที่"""
+        key = recording_key(body)
+        if self.upstream is not None:
+            content = await self._forward(endpoint, body)
+            if self.record_path:
+                with open(self.record_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps({"key": key, "content": content}, ensure_ascii=False) + "\n")
+            return content
+        return self.recordings.get(key, self.reply)
+
+    async def _forward(self, endpoint: str, body: Dict[str, Any]) -> str:
+        # ขอคำตอบแบบ non-streaming จาก upstream แล้วค่อย pace ตามตัวเลือกของ fake เอง
+        async with aiohttp.ClientSession() as session:
+            async with session.post(f"{self.upstream}{endpoint}", json={**body, "stream": False}) as response:
+                response.raise_for_status()
+                result = await response.json()
+        if endpoint == "/api/chat":
+            return result["message"]["content"]
+        return result["choices"][0]["message"]["content"]
+
+    async def _tokens(self, content: str):
+        """แบ่งคำตอบเป็น token (คั่นด้วยช่องว่าง) ตาม first-token latency และ token rate
+
+        ถ้าตั้ง num_parallel ไว้ request ที่เกินจำนวน slot จะรอจนกว่า slot ว่าง (เหมือน Ollama)
+        """
+        async with self._slots:
+            await asyncio.sleep(self.first_token_latency)
+            tokens = content.split(" ")
+            for index, token in enumerate(tokens):
+                # ต่อกลับแล้วต้องได้คำตอบเดิมทุกตัวอักษร (สำคัญกับ replay)
+                yield token if index == len(tokens) - 1 else token + " "
+                if self.token_rate:
+                    await asyncio.sleep(1 / self.token_rate)
+
+    def _usage(self, body: Dict[str, Any], content: str) -> Dict[str, int]:
+        prompt_chars = sum(len(str(m.get("content", ""))) for m in body.get("messages", []))
+        return {"prompt_tokens": prompt_chars // 4, "completion_tokens": len(content.split(" "))}
+
+    def _native_usage(self, body: Dict[str, Any], content: str) -> Dict[str, int]:
+        """ฟิลด์ token และเวลา (nanoseconds) แบบ native /api/chat ตาม pacing ที่ตั้งไว้"""
+        usage = self._usage(body, content)
+        eval_seconds = usage["completion_tokens"] / self.token_rate if self.token_rate else 0.0
+        return {
+            "prompt_eval_count": usage["prompt_tokens"],
+            "eval_count": usage["completion_tokens"],
+            "load_duration": 0,
+            "prompt_eval_duration": int(self.first_token_latency * 1e9),
+            "eval_duration": int(eval_seconds * 1e9)
+        }
+
+    async def _generate(self, content: str) -> None:
+        """non-streaming: รอเท่าเวลาที่ใช้สร้างคำตอบทั้งหมด"""
+        async for _ in self._tokens(content):
+            pass
+
+    async def handle_openai_chat(self, request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        self.requests.append({"endpoint": "/v1/chat/completions", "body": body})
+        error = self._inject_error()
+        if error is not None:
+            return error
+        content = await self._reply_for("/v1/chat/completions", body)
+        if body.get("stream"):
+            response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+            await response.prepare(request)
+            async for token in self._tokens(content):
+                chunk = {"choices": [{"delta": {"content": token}}]}
+                await response.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+            if (body.get("stream_options") or {}).get("include_usage"):
+                chunk = {"choices": [], "usage": self._usage(body, content)}
+                await response.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            await response.write(b"data: [DONE]\n\n")
+            return response
+        await self._generate(content)
+        return web.json_response({
+            "choices": [{"message": {"role": "assistant", "content": content}}],
+            "usage": self._usage(body, content)
+        })
+
+    async def handle_native_chat(self, request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        self.requests.append({"endpoint": "/api/chat", "body": body})
+        error = self._inject_error()
+        if error is not None:
+            return error
+        content = await self._reply_for("/api/chat", body)
+        if body.get("stream", True):
+            response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+            await response.prepare(request)
+            async for token in self._tokens(content):
+                chunk = {"model": self.model, "message": {"role": "assistant", "content": token}, "done": False}
+                await response.write((json.dumps(chunk, ensure_ascii=False) + "\n").encode("utf-8"))
+            final = {"model": self.model, "done": True, **self._native_usage(body, content)}
+            await response.write((json.dumps(final) + "\n").encode("utf-8"))
+            return response
+        await self._generate(content)
+        return web.json_response({
+            "model": self.model,
+            "message": {"role": "assistant", "content": content},
+            "done": True,
+            **self._native_usage(body, content)
+        })
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    """ตัวเลือกของ fake Ollama (ใช้ร่วมกับ benchmark อื่นที่สร้าง FakeOllama เอง)"""
+    parser.add_argument("--first-token-latency", type=float, default=0.0, help="seconds before the first token")
+    parser.add_argument("--token-rate", type=float, default=0.0, help="tokens per second (0 = instant)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of chat requests that fail")
+    parser.add_argument("--error-status", type=int, default=500)
+    parser.add_argument("--num-parallel", type=int, default=0, help="concurrent generations (0 = unlimited)")
+    parser.add_argument("--record", metavar="FILE", help="append replies from --upstream to FILE")
+    parser.add_argument("--upstream", metavar="URL", help="real Ollama to forward chat requests to")
+    parser.add_argument("--replay", metavar="FILE", help="answer with replies recorded in FILE")
+    parser.add_argument("--seed", type=int, default=None, help="seed for error injection")
+
+
+def from_arguments(args: argparse.Namespace) -> FakeOllama:
+    if args.record and not args.upstream:
+        raise SystemExit("--record requires --upstream")
+    return FakeOllama(
+        first_token_latency=args.first_token_latency,
+        token_rate=args.token_rate,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        num_parallel=args.num_parallel,
+        record_path=args.record,
+        upstream=args.upstream,
+        replay_path=args.replay,
+        seed=args.seed
+    )
+
+
+async def _serve(fake: FakeOllama, port: int) -> None:
+    await fake.start(port)
+    print(f"Fake Ollama listening on {fake.base_url}")
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=11434)
+    add_arguments(parser)
+    args = parser.parse_args()
+    asyncio.run(_serve(from_arguments(args), args.port))
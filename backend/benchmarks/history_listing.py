@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Analysis-history listing: response size and query time per mode
+
+A temporary SQLite database is filled with report-sized analyses (Thai markdown)
+whose projects carry a large diagram_data, then one page of GET /api/analysis-history
+is built the way the route builds it:
+
+    legacy   the old query (joinedload Project, every column) + full analysis_result
+    full     crud.get_analysis_history: listing columns + full analysis_result
+    summary  crud.get_analysis_history(summary=True): listing columns + analysis_excerpt
+
+Run from the backend directory:
+    python benchmarks/history_listing.py --rows 2000 --report-kb 40 --limit 100
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+from typing import Dict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db_loop_lag import make_diagram
+
+PARAGRAPH = "## 1. การจัดวางอุปกรณ์ตามหลักการ Layer ของเครือข่าย\nผลการวิเคราะห์ของ switch และ router ในแต่ละชั้น "
+
+
+def legacy_history(db, user_id: int, limit: int):
+    from sqlalchemy import desc
+    from sqlalchemy.orm import joinedload
+    from app import models
+
+    return db.query(models.AIAnalysisHistory)\
+        .options(joinedload(models.AIAnalysisHistory.project))\
+        .filter(models.AIAnalysisHistory.user_id == user_id)\
+        .order_by(desc(models.AIAnalysisHistory.created_at)).limit(limit).all()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=2000, help="analyses in the history")
+    parser.add_argument("--report-kb", type=int, default=40, help="size of each analysis_result")
+    parser.add_argument("--nodes", type=int, default=500, help="devices per project diagram")
+    parser.add_argument("--limit", type=int, default=100, help="page size")
+    parser.add_argument("--repeat", type=int, default=20, help="timed pages per mode")
+    args = parser.parse_args()
+
+    tmpdir = tempfile.TemporaryDirectory()
+    # ต้องตั้งก่อน import app (Settings อ่าน environment ตอน import)
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tmpdir.name, 'history_listing.db')}"
+
+    from app import crud, models, schemas
+    from app.database import SessionLocal, engine
+    from app.routers.enhanced_api import _history_item
+
+    models.Base.metadata.create_all(bind=engine)
+    report = PARAGRAPH * (args.report_kb * 1024 // len(PARAGRAPH.encode()))
+    db = SessionLocal()
+    try:
+        user = crud.create_user(db, schemas.UserCreate(email="bench@example.com", username="bench", password="bench"))
+        user_id = user.id
+        project_ids = [
+            crud.create_project(db, schemas.ProjectCreate(name=f"bench-{i}", diagram_data=make_diagram(args.nodes, i)),
+                                user_id).id
+            for i in range(10)
+        ]
+        db.bulk_insert_mappings(models.AIAnalysisHistory, [
+            {"user_id": user_id, "project_id": project_ids[i % 10], "model_used": "bench",
+             "total_device_count": args.nodes, "analysis_result": report, "status": "completed",
+             "created_at": models.bangkok_now()}
+            for i in range(args.rows)
+        ])
+        db.commit()
+    finally:
+        db.close()
+
+    modes = {
+        "legacy": (lambda db: legacy_history(db, user_id, args.limit), False),
+        "full": (lambda db: crud.get_analysis_history(db, user_id, limit=args.limit), False),
+        "summary": (lambda db: crud.get_analysis_history(db, user_id, limit=args.limit, summary=True), True),
+    }
+    print(f"rows={args.rows}  report={len(report.encode()) / 1024:.0f} KB  limit={args.limit}")
+    print(f"{'mode':>8} {'response KB':>12} {'query+serialize ms':>19}")
+    results: Dict[str, float] = {}
+    try:
+        for mode, (query, summary) in modes.items():
+            timings = []
+            for _ in range(args.repeat):
+                started = time.perf_counter()
+                db = SessionLocal()
+                try:
+                    body = json.dumps([_history_item(item, summary) for item in query(db)], default=str)
+                finally:
+                    db.close()
+                timings.append(time.perf_counter() - started)
+            results[mode] = len(body.encode())
+            print(f"{mode:>8} {results[mode] / 1024:>12.1f} {sorted(timings)[len(timings) // 2] * 1000:>19.1f}")
+    finally:
+        engine.dispose()
+        tmpdir.cleanup()
+    print(f"summary response is {results['legacy'] / results['summary']:.0f}x smaller than legacy")
+
+
+if __name__ == "__main__":
+    main()
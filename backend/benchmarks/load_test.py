@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+"""
+End-to-end load test against the real FastAPI app
+
+Starts the app with uvicorn (own thread and event loop, temporary SQLite
+database) and a fake Ollama (benchmarks/fake_ollama.py, another thread), then
+drives it over HTTP with N concurrent clients. Reports p50/p95/p99 latency
+and throughput per operation, plus event-loop lag measured inside the app's
+loop (blocking calls such as sync DB queries or password hashing show up here).
+
+Scenarios:
+    analyze   POST /api/analyze with a different topology every request
+    projects  project CRUD (create, get, list, update, delete)
+    auth      POST /auth/token
+    mixed     20% analyze, 60% projects, 20% auth
+
+Run from the backend directory:
+    python benchmarks/load_test.py --scenario mixed --concurrency 20 --requests 300 \\
+        --first-token-latency 0.5 --token-rate 200
+
+Settings are read from the environment as usual (e.g. ANALYSIS_MAX_CONCURRENT=4);
+the per-user rate limits are lifted unless --keep-limits is given.
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import random
+import asyncio
+import argparse
+import tempfile
+import threading
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+
+import aiohttp
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_ollama import add_arguments, from_arguments
+
+SCENARIO_WEIGHTS = {
+    "analyze": {"analyze": 1},
+    "projects": {"projects": 1},
+    "auth": {"auth": 1},
+    "mixed": {"analyze": 2, "projects": 6, "auth": 2},
+}
+PASSWORD = "loadtest-password"
+
+
+class LoopThread:
+    """event loop ใน thread แยก เพื่อไม่ให้แอป, fake Ollama และตัวยิง load แย่ง loop เดียวกัน"""
+
+    def __init__(self, name: str):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name=name, daemon=True)
+        self.thread.start()
+
+    def submit(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro, timeout: Optional[float] = None):
+        return self.submit(coro).result(timeout)
+
+    def stop(self) -> None:
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+
+class LoopLagMonitor:
+    """วัดความหน่วงของ event loop: sleep ทีละ interval แล้วดูว่าตื่นช้ากว่ากำหนดเท่าไร"""
+
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.samples: List[float] = []
+
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, loop.time() - started - self.interval))
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """nearest-rank percentile (values ต้องไม่ว่าง)"""
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def make_topology(seed: int) -> Dict[str, List[Dict[str, Any]]]:
+    rng = random.Random(seed)
+    nodes = [
+        {"id": "isp", "data": {"label": "ISP", "deviceType": "isp", "maxThroughput": rng.choice([100, 500, 1000]), "throughputUnit": "Mbps"}},
+        {"id": "core", "data": {"label": "Core-SW", "deviceType": "switch", "maxThroughput": 10, "throughputUnit": "Gbps"}},
+    ]
+    edges = [{"id": "e-isp", "source": "isp", "target": "core", "data": {"bandwidth": 1, "bandwidthUnit": "Gbps"}}]
+    for i in range(rng.randint(5, 40)):
+        nodes.append({"id": f"pc{i}", "data": {"label": f"PC-{i}", "deviceType": "pc", "userCapacity": rng.randint(1, 5)}})
+        edges.append({"id": f"e{i}", "source": "core", "target": f"pc{i}", "data": {"bandwidth": 100, "bandwidthUnit": "Mbps"}})
+    return {"nodes": nodes, "edges": edges}
+
+
+class LoadTest:
+    def __init__(self, base_url: str, scenario: str, concurrency: int, requests: int, duration: Optional[float], users: int):
+        self.base_url = base_url
+        self.weights = SCENARIO_WEIGHTS[scenario]
+        self.concurrency = concurrency
+        self.requests = requests
+        self.duration = duration
+        self.users = users
+        self.tokens: List[str] = []
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        self.started = 0
+        self.seed = 0
+        self.rng = random.Random(0)
+
+    async def _call(self, session: aiohttp.ClientSession, op: str, method: str, path: str, **kwargs) -> Tuple[int, Any]:
+        started = time.perf_counter()
+        try:
+            async with session.request(method, self.base_url + path, **kwargs) as response:
+                body = await response.json(content_type=None)
+                status = response.status
+        except Exception as e:
+            self.errors[op][type(e).__name__] += 1
+            return 0, None
+        self.latencies[op].append(time.perf_counter() - started)
+        if status >= 400:
+            self.errors[op][str(status)] += 1
+        return status, body
+
+    async def setup(self, session: aiohttp.ClientSession) -> None:
+        for i in range(self.users):
+            email = f"load{i}@example.com"
+            await session.post(self.base_url + "/auth/register",
+                               json={"email": email, "username": f"load{i}", "password": PASSWORD})
+            async with session.post(self.base_url + "/auth/token", data={"username": email, "password": PASSWORD}) as response:
+                self.tokens.append((await response.json())["access_token"])
+        self.latencies.clear()
+        self.errors.clear()
+
+    async def op_analyze(self, session: aiohttp.ClientSession, headers: Dict[str, str]) -> None:
+        self.seed += 1
+        await self._call(session, "analyze", "POST", "/api/analyze", json=make_topology(self.seed), headers=headers)
+
+    async def op_projects(self, session: aiohttp.ClientSession, headers: Dict[str, str]) -> None:
+        self.seed += 1
+        # ชื่อ project ต้องไม่ซ้ำกันต่อผู้ใช้
+        status, project = await self._call(session, "project.create", "POST", "/api/projects",
+                                           json={"name": f"load test {self.seed}", "diagram_data": make_topology(self.seed)},
+                                           headers=headers)
+        if status != 200:
+            return
+        path = f"/api/projects/{project['id']}"
+        await self._call(session, "project.get", "GET", path, headers=headers)
+        await self._call(session, "project.list", "GET", "/api/projects", headers=headers)
+        await self._call(session, "project.update", "PUT", path, json={"description": "updated"}, headers=headers)
+        await self._call(session, "project.delete", "DELETE", path, headers=headers)
+
+    async def op_auth(self, session: aiohttp.ClientSession, headers: Dict[str, str]) -> None:
+        i = self.rng.randrange(self.users)
+        await self._call(session, "auth.token", "POST", "/auth/token",
+                         data={"username": f"load{i}@example.com", "password": PASSWORD})
+
+    async def _client(self, session: aiohttp.ClientSession, deadline: Optional[float]) -> None:
+        ops = list(self.weights)
+        weights = [self.weights[op] for op in ops]
+        while True:
+            if deadline is not None and time.monotonic() >= deadline:
+                return
+            if deadline is None and self.started >= self.requests:
+                return
+            self.started += 1
+            headers = {"Authorization": f"Bearer {self.rng.choice(self.tokens)}"}
+            op = self.rng.choices(ops, weights)[0]
+            await getattr(self, f"op_{op}")(session, headers)
+
+    async def run(self, on_start=None) -> float:
+        """สร้างผู้ใช้และ login ก่อน แล้วเรียก on_start ก่อนเริ่มจับเวลาช่วงยิง load"""
+        connector = aiohttp.TCPConnector(limit=self.concurrency)
+        timeout = aiohttp.ClientTimeout(total=None)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            await self.setup(session)
+            if on_start is not None:
+                on_start()
+            deadline = time.monotonic() + self.duration if self.duration else None
+            started = time.perf_counter()
+            await asyncio.gather(*(self._client(session, deadline) for _ in range(self.concurrency)))
+            return time.perf_counter() - started
+
+
+def report(test: LoadTest, wall: float, lag: List[float], as_json: bool) -> None:
+    rows = {}
+    for op, values in sorted(test.latencies.items()):
+        rows[op] = {
+            "count": len(values),
+            "errors": dict(test.errors.get(op, {})),
+            "p50_ms": percentile(values, 50) * 1000,
+            "p95_ms": percentile(values, 95) * 1000,
+            "p99_ms": percentile(values, 99) * 1000,
+            "max_ms": max(values) * 1000,
+            "throughput_rps": len(values) / wall,
+        }
+    for op, errors in test.errors.items():
+        rows.setdefault(op, {"count": 0, "errors": dict(errors)})
+    total = sum(len(values) for values in test.latencies.values())
+    lag_stats = {
+        "samples": len(lag),
+        "mean_ms": sum(lag) / len(lag) * 1000 if lag else 0.0,
+        "p99_ms": percentile(lag, 99) * 1000 if lag else 0.0,
+        "max_ms": max(lag) * 1000 if lag else 0.0,
+    }
+    if as_json:
+        print(json.dumps({"wall_seconds": wall, "requests": total, "throughput_rps": total / wall,
+                          "operations": rows, "event_loop_lag": lag_stats}, indent=2))
+        return
+
+    print(f"\n{'operation':<16} {'count':>6} {'err':>5} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9} {'req/s':>8}")
+    for op, row in rows.items():
+        errors = sum(row["errors"].values())
+        if not row["count"]:
+            print(f"{op:<16} {0:>6} {errors:>5}")
+            continue
+        print(f"{op:<16} {row['count']:>6} {errors:>5} {row['p50_ms']:>9.1f} {row['p95_ms']:>9.1f} "
+              f"{row['p99_ms']:>9.1f} {row['max_ms']:>9.1f} {row['throughput_rps']:>8.1f}")
+    for op, row in rows.items():
+        if row["errors"]:
+            print(f"  {op} errors: {row['errors']}")
+    print(f"\ntotal: {total} requests in {wall:.1f}s ({total / wall:.1f} req/s)")
+    print(f"event-loop lag: mean {lag_stats['mean_ms']:.1f} ms, p99 {lag_stats['p99_ms']:.1f} ms, "
+          f"max {lag_stats['max_ms']:.1f} ms ({lag_stats['samples']} samples)")
+
+
+def configure_environment(args: argparse.Namespace, ollama_url: str) -> None:
+    """ต้องตั้งก่อน import app (Settings อ่าน environment ตอน import)"""
+    os.environ["DATABASE_URL"] = args.database_url
+    os.environ["OLLAMA_BASE_URL"] = ollama_url
+    os.environ.setdefault("OLLAMA_BACKENDS", "[]")
+    if not args.keep_limits:
+        for name in ("ANALYSIS_RATE_PER_MINUTE", "ANALYSIS_RATE_BURST", "ANALYSIS_USER_MAX_PENDING"):
+            os.environ.setdefault(name, "1000000")
+
+
+async def _start_server(server) -> None:
+    asyncio.get_running_loop().create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenario", choices=list(SCENARIO_WEIGHTS), default="mixed")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--requests", type=int, default=200, help="number of scenario iterations")
+    parser.add_argument("--duration", type=float, default=None, help="run for N seconds instead of --requests")
+    parser.add_argument("--users", type=int, default=5)
+    parser.add_argument("--ollama-url", default=None, help="use this Ollama instead of starting the fake")
+    parser.add_argument("--database-url", default=None, help="default: temporary SQLite file")
+    parser.add_argument("--keep-limits", action="store_true", help="keep the per-user rate limits from Settings")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    tmpdir = tempfile.TemporaryDirectory()
+    if args.database_url is None:
+        args.database_url = f"sqlite:///{os.path.join(tmpdir.name, 'load_test.db')}"
+
+    fake_thread = None
+    ollama_url = args.ollama_url
+    if ollama_url is None:
+        fake_thread = LoopThread("fake-ollama")
+        fake = from_arguments(args)
+        fake_thread.run(fake.start())
+        ollama_url = fake.base_url
+    configure_environment(args, ollama_url)
+
+    import uvicorn
+    from app.main import app
+
+    # route วิเคราะห์ log topology ทั้งก้อนที่ระดับ INFO
+    logging.getLogger("uvicorn.info").setLevel(logging.WARNING)
+
+    app_thread = LoopThread("app")
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=0, log_level="warning"))
+    app_thread.run(_start_server(server), timeout=30)
+    port = server.servers[0].sockets[0].getsockname()[1]
+
+    monitor = LoopLagMonitor()
+    lag_task = None
+    try:
+        test = LoadTest(f"http://127.0.0.1:{port}", args.scenario, args.concurrency, args.requests, args.duration, args.users)
+
+        async def run_load() -> float:
+            nonlocal lag_task
+            lag_task = app_thread.submit(monitor.run())
+            # ไม่นับช่วง setup (register/login) ในค่า lag
+            return await test.run(on_start=monitor.samples.clear)
+
+        wall = asyncio.run(run_load())
+        lag_task.cancel()
+        report(test, wall, list(monitor.samples), args.json)
+    finally:
+        server.should_exit = True
+        time.sleep(0.5)
+        app_thread.stop()
+        if fake_thread is not None:
+            fake_thread.stop()
+        tmpdir.cleanup()
+
+
+if __name__ == "__main__":
+    main()
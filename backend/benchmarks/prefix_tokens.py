@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Prompt prefix benchmark
+
+Sends a series of different topologies through OllamaService to a local
+Ollama stand-in and reports, per request, how many prompt tokens are a
+byte-identical prefix of the previous request (reusable from Ollama's KV
+cache) versus how many must be processed fresh.
+
+Run from the backend directory:
+    python benchmarks/prefix_tokens.py --requests 5
+"""
+
+import os
+import sys
+import random
+import asyncio
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_ollama import FakeOllama
+from app.ai_service import OllamaService, ANALYSIS_PROMPT
+from app.config import settings
+from app.http_client import http_client
+from app.token_estimator import estimate_tokens
+
+
+def make_topology(seed: int, pcs: int):
+    rng = random.Random(seed)
+    nodes = [
+        {"id": "isp", "data": {"label": "ISP", "deviceType": "isp", "maxThroughput": rng.choice([100, 500, 1000]), "throughputUnit": "Mbps"}},
+        {"id": "fw", "data": {"label": "Firewall", "deviceType": "firewall"}},
+        {"id": "core", "data": {"label": "Core-SW", "deviceType": "switch", "maxThroughput": 10, "throughputUnit": "Gbps"}},
+    ]
+    edges = [
+        {"source": "isp", "target": "fw", "data": {"bandwidth": 1, "bandwidthUnit": "Gbps"}},
+        {"source": "fw", "target": "core", "data": {"bandwidth": 1, "bandwidthUnit": "Gbps"}},
+    ]
+    for i in range(pcs):
+        nodes.append({"id": f"pc{i}", "data": {"label": f"PC-{i}", "deviceType": "pc", "userCapacity": rng.randint(1, 5)}})
+        edges.append({"source": "core", "target": f"pc{i}", "data": {"bandwidth": rng.choice([100, 1000]), "bandwidthUnit": "Mbps"}})
+    return nodes, edges
+
+
+def render(messages) -> str:
+    """ประมาณ prompt ที่ model เห็นหลังผ่าน chat template"""
+    return "".join(f"<|{m['role']}|>\n{m['content']}\n" for m in messages)
+
+
+def common_prefix(a: str, b: str) -> str:
+    n = 0
+    limit = min(len(a), len(b))
+    while n < limit and a[n] == b[n]:
+        n += 1
+    return a[:n]
+
+
+async def run(mode: str, requests: int) -> None:
+    fake = FakeOllama()
+    await fake.start()
+    settings.OLLAMA_BASE_URL = fake.base_url
+    settings.OLLAMA_BACKENDS = []
+    service = OllamaService()
+    service.native_api = mode == "native"
+    try:
+        for i in range(requests):
+            nodes, edges = make_topology(seed=i, pcs=5 + i * 3)
+            await service.request_completion(ANALYSIS_PROMPT, {"nodes": nodes, "edges": edges})
+    finally:
+        await http_client.close()
+        await fake.stop()
+
+    print(f"\nmode={mode}  endpoint={fake.requests[0]['endpoint']}  keep_alive={fake.requests[0]['body'].get('keep_alive')}")
+    print(f"{'req':>4} {'prompt_tok':>11} {'prefix_tok':>11} {'fresh_tok':>10} {'reuse':>7} {'num_ctx':>8}")
+    previous = None
+    for i, recorded in enumerate(fake.requests):
+        body = recorded["body"]
+        text = render(body["messages"])
+        total = estimate_tokens(text)
+        prefix = estimate_tokens(common_prefix(previous, text)) if previous is not None else 0
+        print(f"{i + 1:>4} {total:>11} {prefix:>11} {total - prefix:>10} {prefix / total:>6.0%} {body['options']['num_ctx']:>8}")
+        previous = text
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=5)
+    parser.add_argument("--mode", choices=["openai", "native", "both"], default="both")
+    args = parser.parse_args()
+    modes = ["openai", "native"] if args.mode == "both" else [args.mode]
+    for mode in modes:
+        asyncio.run(run(mode, args.requests))
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Sectioned analysis benchmark
+
+Runs the same topology through NetworkTopologyAnalyzer with ANALYSIS_MODE=single
+and ANALYSIS_MODE=sectioned against a fake Ollama with a fixed number of
+parallel slots, and reports wall-clock time per analysis. The fake answers a
+section request with 1/5 of the full report length, so both modes generate
+the same number of tokens.
+
+Run from the backend directory:
+    python benchmarks/sectioned_analysis.py --num-parallel 5 --first-token-latency 1 \\
+        --token-rate 40 --report-tokens 1200
+"""
+
+import os
+import sys
+import time
+import asyncio
+import argparse
+from typing import Any, Dict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_ollama import FakeOllama, add_arguments, from_arguments
+from prefix_tokens import make_topology
+from app.ai_service import ANALYSIS_SECTIONS, SECTION_INSTRUCTION, NetworkTopologyAnalyzer
+from app.config import settings
+from app.http_client import http_client
+from app.ollama_metrics import GenerationUsage
+
+SECTION_MARKER = SECTION_INSTRUCTION.split("{")[0]
+
+
+def make_reply(tokens: int) -> str:
+    return " ".join(f"คำ{index}" for index in range(max(1, tokens)))
+
+
+class ReportFake(FakeOllama):
+    """ตอบรายงานเต็มหรือหนึ่งหัวข้อ (สั้นกว่าตามจำนวนหัวข้อ) ตามคำสั่งท้าย user message"""
+
+    def __init__(self, report_tokens: int, **kwargs):
+        super().__init__(**kwargs)
+        self.report = make_reply(report_tokens)
+        self.section = make_reply(report_tokens // len(ANALYSIS_SECTIONS))
+
+    async def _reply_for(self, endpoint: str, body: Dict[str, Any]) -> str:
+        user = body["messages"][-1]["content"]
+        return self.section if SECTION_MARKER in user else self.report
+
+
+async def run(args: argparse.Namespace) -> None:
+    base = from_arguments(args)
+    fake = ReportFake(
+        args.report_tokens,
+        first_token_latency=base.first_token_latency,
+        token_rate=base.token_rate,
+        num_parallel=base.num_parallel
+    )
+    await fake.start()
+    settings.OLLAMA_BASE_URL = fake.base_url
+    settings.OLLAMA_BACKENDS = []
+    settings.OLLAMA_BACKEND_MAX_CONCURRENCY = max(settings.OLLAMA_BACKEND_MAX_CONCURRENCY, len(ANALYSIS_SECTIONS))
+    analyzer = NetworkTopologyAnalyzer()
+    # วัดเวลาสร้างรายงานทุกครั้ง (ไม่ใช้ cache และไม่แตะ DB)
+    analyzer.cache.enabled = False
+    nodes, edges = make_topology(seed=1, pcs=args.pcs)
+
+    print(f"num_parallel={args.num_parallel}  first_token_latency={args.first_token_latency}s  "
+          f"token_rate={args.token_rate}/s  report_tokens={args.report_tokens}")
+    print(f"{'mode':>10} {'run':>4} {'seconds':>8} {'requests':>9} {'completion_tok':>15}")
+    try:
+        for mode in ("single", "sectioned"):
+            settings.ANALYSIS_MODE = mode
+            timings = []
+            for run_index in range(args.runs):
+                usage = GenerationUsage()
+                started_at = time.monotonic()
+                await analyzer.analyze(nodes, edges, usage=usage)
+                elapsed = time.monotonic() - started_at
+                timings.append(elapsed)
+                print(f"{mode:>10} {run_index + 1:>4} {elapsed:>8.2f} {usage.requests:>9} "
+                      f"{usage.values['completion_tokens'] or 0:>15}")
+            print(f"{mode:>10} mean {sum(timings) / len(timings):>8.2f}")
+    finally:
+        await http_client.close()
+        await fake.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=2, help="analyses per mode")
+    parser.add_argument("--pcs", type=int, default=20, help="end devices in the topology")
+    parser.add_argument("--report-tokens", type=int, default=1200, help="tokens in a full report")
+    add_arguments(parser)
+    args = parser.parse_args()
+    asyncio.run(run(args))
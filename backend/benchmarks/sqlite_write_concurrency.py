@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+SQLite write-concurrency benchmark for the storage profiles
+
+For each profile (app.database.sqlite_pragmas) a fresh temporary database is
+hammered by N threads, the way the DB thread pool and the job workers use it:
+
+    autosave  crud.update_project with a large diagram_data
+    history   crud.create_analysis_history with a report-sized text
+    read      crud.get_analysis_history (one page)
+
+Reports operations per second, p50/p99 latency per operation and how many
+operations failed (e.g. "database is locked").
+
+Run from the backend directory:
+    python benchmarks/sqlite_write_concurrency.py --threads 8 --duration 5 --nodes 1000
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import threading
+from collections import defaultdict
+from typing import Any, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy.orm import sessionmaker
+
+from load_test import percentile
+from db_loop_lag import make_diagram
+from app import crud, models, schemas
+from app.database import create_db_engine
+
+OPERATION_WEIGHTS = {"autosave": 4, "history": 2, "read": 4}
+REPORT = "## 1. การจัดวางอุปกรณ์ตามหลักการ Layer ของเครือข่าย\n" + "ผลการวิเคราะห์ " * 2000
+
+
+def run_profile(profile: str, args: argparse.Namespace, directory: str) -> Dict[str, Any]:
+    engine = create_db_engine(f"sqlite:///{os.path.join(directory, f'{profile}.db')}", profile)
+    models.Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+    db = Session()
+    try:
+        user = crud.create_user(db, schemas.UserCreate(email="bench@example.com", username="bench", password="bench"))
+        user_id = user.id
+        project_ids = [
+            crud.create_project(db, schemas.ProjectCreate(name=f"bench-{i}"), user_id).id for i in range(args.threads)
+        ]
+    finally:
+        db.close()
+
+    updates = [schemas.ProjectUpdate(diagram_data=make_diagram(args.nodes, revision)) for revision in range(2)]
+    history = schemas.AIAnalysisHistoryCreate(model_used="bench", total_device_count=args.nodes, analysis_result=REPORT)
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    errors: Dict[str, int] = defaultdict(int)
+    lock = threading.Lock()
+    deadline = time.monotonic() + args.duration
+    operations = list(OPERATION_WEIGHTS)
+    weights = list(OPERATION_WEIGHTS.values())
+
+    def worker(index: int) -> None:
+        rng = random.Random(index)
+        revision = 0
+        while time.monotonic() < deadline:
+            op = rng.choices(operations, weights)[0]
+            started = time.monotonic()
+            session = Session()
+            try:
+                if op == "autosave":
+                    revision += 1
+                    crud.update_project(session, project_ids[index], updates[revision % 2], user_id)
+                elif op == "history":
+                    crud.create_analysis_history(session, history, user_id)
+                else:
+                    crud.get_analysis_history(session, user_id, limit=20)
+                elapsed = time.monotonic() - started
+                with lock:
+                    latencies[op].append(elapsed)
+            except Exception:
+                session.rollback()
+                with lock:
+                    errors[op] += 1
+            finally:
+                session.close()
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(args.threads)]
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.monotonic() - started
+    engine.dispose()
+
+    return {
+        "ops_per_second": sum(len(values) for values in latencies.values()) / wall,
+        "operations": {
+            op: {
+                "count": len(latencies[op]),
+                "errors": errors[op],
+                "p50_ms": percentile(latencies[op], 50) * 1000 if latencies[op] else 0.0,
+                "p99_ms": percentile(latencies[op], 99) * 1000 if latencies[op] else 0.0,
+            }
+            for op in operations
+        },
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds per profile")
+    parser.add_argument("--nodes", type=int, default=1000, help="devices per saved diagram")
+    parser.add_argument("--profiles", nargs="+", choices=["default", "tuned"], default=["default", "tuned"])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        print(f"threads={args.threads}  duration={args.duration}s  nodes={args.nodes}")
+        print(f"{'profile':>8} {'op':>9} {'count':>7} {'errors':>7} {'p50 ms':>8} {'p99 ms':>8}")
+        for profile in args.profiles:
+            result = run_profile(profile, args, directory)
+            for op, stats in result["operations"].items():
+                print(f"{profile:>8} {op:>9} {stats['count']:>7} {stats['errors']:>7} "
+                      f"{stats['p50_ms']:>8.1f} {stats['p99_ms']:>8.1f}")
+            print(f"{profile:>8} {'total':>9} {result['ops_per_second']:>7.1f} ops/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -59,12 +59,22 @@ def reset_database_safe():
         print(f"❌ Error resetting database: {e}")
         return False
 
+def clear_analysis_cache():
+    """ล้าง cache ผลการวิเคราะห์ที่ใช้ร่วมกันทุกผู้ใช้ (งานของผู้ดูแลระบบ เช่น หลังเปลี่ยน model หรือ prompt)"""
+    from app.analysis_cache import AnalysisCache
+    count = AnalysisCache().clear()
+    print(f"🧹 Cleared {count} cached analyses")
+    return count
+
 if __name__ == "__main__":
     import sys
     if len(sys.argv) > 1 and sys.argv[1] == "--confirm":
         reset_database_safe()
+    elif len(sys.argv) > 1 and sys.argv[1] == "--clear-analysis-cache":
+        clear_analysis_cache()
     else:
         print("⚠️  This will DELETE all existing data!")
         print("   But you can keep the backend server running")
         print("   Run with --confirm to proceed:")
-        print("   python reset_database_safe.py --confirm")
\ No newline at end of file
+        print("   python reset_database_safe.py --confirm")
+        print("   (clear only the analysis cache: python reset_database_safe.py --clear-analysis-cache)")
\ No newline at end of file